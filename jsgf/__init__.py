@@ -3,6 +3,16 @@ This package contains classes and functions for compiling, matching and parsing
 grammars using rules, imports and rule expansions, such as sequences, repeats,
 optional and required groupings.
 """
+from .automata import Automaton
+from .automata import AutomatonCompiler
+from .automata import AutomatonSet
+from .automata import AutomatonStream
+from .automata import MatchingBackend
+from .automata import MatchResult
+
+from .charts import ChartCompiler
+from .charts import ChartParser
+
 from .errors import CompilationError
 from .errors import ExpansionError
 from .errors import GrammarError
@@ -32,16 +42,27 @@ from .expansions import NamedRuleRef, NullRef, VoidRef
 
 from .grammars import Grammar
 from .grammars import Import
+from .grammars import MatchCacheInfo
+from .grammars import MatchStream
+from .grammars import PrefilterInfo
 from .grammars import RootGrammar
 
+from .parse_cache import ParseCache
+
 from .parser import parse_grammar_string, parse_grammar_file, valid_grammar
+from .parser import iter_grammar_file, GrammarHeader
 from .parser import parse_expansion_string, parse_rule_string
 
 from .references import BaseRef
 
+from .regexes import RegexCompiler
+from .regexes import RegexMatcher
+
 from .rules import PrivateRule
 from .rules import PublicRule
 from .rules import Rule
 
+from .vocabulary import Vocabulary
+
 # Things kept in for backwards compatibility.
 from .rules import HiddenRule
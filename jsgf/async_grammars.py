@@ -0,0 +1,217 @@
+"""
+This module contains the ``AsyncGrammar`` class for matching speech with grammars
+from `asyncio` applications.
+
+Matching is done in a bounded executor so that the event loop isn't blocked.
+Concurrent requests to match the same speech string share one call, and grammar
+changes made through :meth:`AsyncGrammar.update` are ordered with respect to
+matching requests.
+
+This module requires Python 3.5 or higher and is not imported by the ``jsgf``
+package::
+
+    from jsgf.async_grammars import AsyncGrammar
+
+"""
+
+import asyncio
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncGrammar(object):
+    """
+    Wrapper class for matching speech with a ``Grammar`` or ``DictationGrammar``
+    using coroutines.
+
+    Requests and updates are handled in the order they are made: each update
+    waits for earlier matching requests to finish and matching requests made
+    after an update wait for it to finish.
+    """
+
+    def __init__(self, grammar, max_workers=4, executor=None):
+        """
+        :param grammar: Grammar
+        :param max_workers: maximum number of threads to match with if no
+            executor is specified (default 4)
+        :param executor: ``concurrent.futures.Executor`` to match with (optional)
+        """
+        self.grammar = grammar
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers)
+        self._executor = executor
+
+        # find_matching_rules() sets the match data of rule expansions, so only
+        # one call can be made at a time.
+        self._find_lock = threading.Lock()
+
+        # Requests in progress for each method, speech string and generation, and
+        # the number of callers waiting for each.
+        self._requests = {}
+        self._waiting = {}
+
+        # State for ordering requests and updates. The generation is increased
+        # for each update so that requests made after an update don't share
+        # calls made before it.
+        self._generation = 0
+        self._readers = 0
+        self._writing = False
+        self._queue = collections.deque()
+
+    def close(self):
+        """
+        Shut down the executor if it was created by this object.
+        """
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    def _can_acquire(self, writer):
+        if writer:
+            return not self._writing and self._readers == 0
+        return not self._writing
+
+    def _grant(self, writer):
+        if writer:
+            self._writing = True
+        else:
+            self._readers += 1
+
+    def _release(self, writer):
+        if writer:
+            self._writing = False
+        else:
+            self._readers -= 1
+
+        # Grant waiting requests and updates in order.
+        while self._queue:
+            waiter_writer, future = self._queue[0]
+            if future.done():
+                self._queue.popleft()
+                continue
+            if not self._can_acquire(waiter_writer):
+                break
+            self._queue.popleft()
+            self._grant(waiter_writer)
+            future.set_result(None)
+
+    def _enqueue(self, writer):
+        # Return a future that is done once a request or update can be made.
+        # Requests and updates are queued in the order this is called.
+        future = asyncio.get_event_loop().create_future()
+        if not self._queue and self._can_acquire(writer):
+            self._grant(writer)
+            future.set_result(None)
+        else:
+            self._queue.append((writer, future))
+        return future
+
+    async def _wait(self, writer, future):
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Release the request or update if it was granted after all.
+            if future.done() and not future.cancelled():
+                self._release(writer)
+            raise
+
+    async def _run(self, func, speech, ticket):
+        # Call a matching function in the executor once earlier updates have been
+        # made. Updates wait until the call has finished, even if this coroutine
+        # is cancelled.
+        await self._wait(False, ticket)
+        try:
+            future = self._executor.submit(func, speech)
+        except Exception:
+            self._release(False)
+            raise
+
+        wrapped = asyncio.wrap_future(future)
+        wrapped.add_done_callback(lambda _: self._release(False))
+        try:
+            return await asyncio.shield(wrapped)
+        except asyncio.CancelledError:
+            # Stop the call if it hasn't started yet.
+            future.cancel()
+            raise
+
+    async def _request(self, name, func, speech, timeout):
+        # Share calls for the same method and speech string that are in progress.
+        key = (name, speech, self._generation)
+        task = self._requests.get(key)
+        if task is None or key not in self._waiting:
+            ticket = self._enqueue(False)
+            task = asyncio.ensure_future(self._run(func, speech, ticket))
+            self._requests[key] = task
+            self._waiting[key] = 0
+            task.add_done_callback(lambda t: self._remove_request(key, t))
+
+        self._waiting[key] += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        finally:
+            # Cancel the call if there are no other callers waiting for it.
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                self._waiting.pop(key)
+                if not task.done():
+                    task.cancel()
+        return list(result)
+
+    def _remove_request(self, key, task):
+        if self._requests.get(key) is task:
+            self._requests.pop(key)
+
+    def _find_matching_rules(self, speech):
+        with self._find_lock:
+            return self.grammar.find_matching_rules(speech)
+
+    async def find_matching_rules(self, speech, timeout=None):
+        """
+        Find each visible rule in the grammar that matches the `speech` string
+        using the grammar's ``find_matching_rules`` method.
+
+        Calls are made one at a time because they set the match data of rule
+        expansions. Use :meth:`match` to match concurrently instead.
+
+        :param speech: str
+        :param timeout: number of seconds to wait for the result (optional)
+        :returns: list
+        :raises: asyncio.TimeoutError
+        """
+        return await self._request("find_matching_rules",
+                                   self._find_matching_rules, speech, timeout)
+
+    async def match(self, speech, timeout=None):
+        """
+        Match speech with each visible rule in the grammar and return a list of
+        ``MatchResult`` objects using the grammar's ``match`` method.
+
+        :param speech: str
+        :param timeout: number of seconds to wait for the result (optional)
+        :returns: list
+        :raises: asyncio.TimeoutError
+        """
+        return await self._request("match", self.grammar.match, speech, timeout)
+
+    async def update(self, func, *args, **kwargs):
+        """
+        Call a function that changes the grammar or its rules, such as
+        ``grammar.add_rule``, and return the result.
+
+        The function is called once earlier matching requests have finished.
+        Matching requests made after this method is called wait until the
+        function has returned.
+
+        :param func: callable
+        :param args: positional arguments for func
+        :param kwargs: keyword arguments for func
+        :returns: the result of func
+        """
+        self._generation += 1
+        await self._wait(True, self._enqueue(True))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._release(True)
@@ -0,0 +1,1307 @@
+"""
+This module contains classes for compiling rule expansions into token-level
+automata and for matching speech strings with them.
+
+The automaton matching backend is an alternative to the `pyparsing` elements
+returned by ``Expansion.matcher_element``. Expansion trees, including the trees
+of referenced rules, are compiled into a program of simple instructions that
+operate on whitespace-separated words. Speech strings are matched by simulating
+every possible path through the program in parallel, so matching time grows
+linearly with the number of words instead of with the amount of backtracking.
+
+Paths through the program are prioritised in the same way as the `pyparsing`
+elements: optional expansions and repeats are greedy and alternatives are tried
+in the order used by ``AlternativeSet``. Unlike the `pyparsing` backend, the
+automaton backend will also find matches for ambiguous expansions such as
+``[test] test``.
+
+The backend can be selected for a grammar's rules by setting the
+:py:attr:`~jsgf.grammars.Grammar.matching_backend` property::
+
+    grammar.matching_backend = MatchingBackend.Automaton
+
+"""
+
+import re
+import threading
+
+from six import get_unbound_function, string_types
+
+from .errors import GrammarError
+from .vocabulary import _WordIDs
+
+
+class MatchingBackend(object):
+    """
+    Constants for the available matching backends.
+    """
+    Pyparsing, Automaton, Chart, Regex = list(range(4))
+
+
+# Instruction operation codes.
+_WORD, _WORD_TABLE, _DICTATION, _SPLIT, _JUMP, _OPEN, _CLOSE, _LITERAL, \
+    _BEGIN_REPETITION, _END_REPETITION, _FAIL, _MATCH = list(range(12))
+
+# Operation codes that record events in the path of a thread.
+_EVENT_OPS = frozenset([_OPEN, _CLOSE, _LITERAL, _BEGIN_REPETITION,
+                        _END_REPETITION])
+
+# Pattern used to split speech strings into words.
+_token_pattern = re.compile(r"\S+", re.UNICODE)
+
+
+def _tokenize(speech):
+    """
+    Split a speech string into a list of words and a list of (start, end)
+    character offsets for each word.
+
+    Speech can also be a sequence of words, which is used without splitting or
+    joining strings. Offsets of the words are those of the words joined with
+    spaces. The words of speech given as word IDs are returned as the same
+    ``_WordIDs`` tuple so that automata can match the IDs.
+
+    :param speech: str | sequence of words
+    :returns: tuple of the speech string with leading and trailing whitespace
+        removed, or a tuple of the words, and the lists of words and offsets
+    """
+    words, offsets = [], []
+    if isinstance(speech, string_types):
+        speech = speech.strip()
+        for m in _token_pattern.finditer(speech):
+            words.append(m.group())
+            offsets.append(m.span())
+    else:
+        if not isinstance(speech, _WordIDs):
+            speech = tuple(speech)
+        start = 0
+        for word in speech:
+            words.append(word)
+            offsets.append((start, start + len(word)))
+            start += len(word) + 1
+        if isinstance(speech, _WordIDs):
+            words = speech
+    return speech, words, offsets
+
+
+def _get_remainder(speech, words, offsets, position):
+    # Get the part of speech after the word at a position, in the same form as
+    # the speech.
+    if not isinstance(speech, string_types):
+        return tuple(words[position:])
+    elif position == 0:
+        return speech
+    return speech[offsets[position - 1][1]:].strip()
+
+
+# Functions that set the match data of expansions for matches whose match data
+# hasn't been used yet, in the order the matches were made, with the set of IDs
+# of the root expansions whose trees each function sets data for.
+_deferred_matches = []
+_deferred_lock = threading.RLock()
+
+# Maximum number of matches to defer setting match data for.
+_MAX_DEFERRED_MATCHES = 100
+
+
+def _defer_match_data(roots, func, replaces=True):
+    """
+    Defer setting the match data of the trees of root expansions, including
+    referenced rules, until the match data of any expansion is used or changed.
+
+    If ``replaces`` is True, the function must reset the match data of every
+    expansion in the trees and any deferred function that only sets match data
+    in the same trees is discarded. Functions are never discarded if they were
+    deferred with ``replaces`` set to False.
+
+    :param roots: list of root expansions
+    :param func: callable
+    :param replaces: whether func replaces the match data of the trees
+    """
+    keys = frozenset(map(id, roots))
+    with _deferred_lock:
+        if replaces:
+            _deferred_matches[:] = [(k, f) for k, f in _deferred_matches
+                                    if k is None or not k <= keys]
+        _deferred_matches.append((keys if replaces else None, func))
+        if len(_deferred_matches) > _MAX_DEFERRED_MATCHES:
+            _set_deferred_match_data()
+
+
+def _set_deferred_match_data():
+    """
+    Set the match data of expansions for each deferred match in order.
+    """
+    if not _deferred_matches:
+        return
+
+    with _deferred_lock:
+        deferred = list(_deferred_matches)
+        del _deferred_matches[:]
+        for _, func in deferred:
+            func()
+
+
+def _get_resets(tree):
+    """
+    Get a list of each expansion of a tree with whether resetting its match data
+    only sets its ``current_match`` value and matching slice, and the
+    ``current_match`` value that resetting sets.
+
+    :param tree: list of expansions
+    :returns: list
+    """
+    # Import locally to avoid import cycles.
+    from .expansions import Expansion
+
+    reset = get_unbound_function(Expansion.reset_match_data)
+    return [(e, get_unbound_function(type(e).reset_match_data) is reset,
+             e._correct_current_match(None)) for e in tree]
+
+
+def _reset_match_data(resets):
+    """
+    Reset the match data of each expansion of a list returned by
+    ``_get_resets``.
+
+    :param resets: list
+    """
+    # Set deferred match data first, as the properties of expansions do.
+    _set_deferred_match_data()
+    for e, only_values, current_match in resets:
+        if only_values:
+            e._current_match = current_match
+            e._matching_slice = None
+        else:
+            e.reset_match_data()
+
+
+class _MatchedWords(object):
+    """
+    Range of words of a speech string matched by an expansion.
+
+    Match values and slices are only created from the range when they are used.
+    """
+
+    __slots__ = ("words", "offsets", "start", "end")
+
+    def __init__(self, words, offsets, start, end):
+        """
+        :param words: list of words
+        :param offsets: list of (start, end) character offsets of each word, or
+            None if the words can contain whitespace
+        :param start: index of the first matched word
+        :param end: index after the last matched word
+        """
+        self.words = words
+        self.offsets = offsets
+        self.start = start
+        self.end = end
+
+    def __bool__(self):
+        # Whether any words were matched.
+        if self.offsets is None:
+            return any(word.strip() for word in
+                       self.words[self.start:self.end])
+        return self.end > self.start
+
+    __nonzero__ = __bool__
+
+    def join(self):
+        """
+        Get the matched words separated by single spaces.
+
+        :returns: str
+        """
+        words = self.words[self.start:self.end]
+        if self.offsets is None:
+            return " ".join(" ".join(words).split())
+        return " ".join(words)
+
+    def get_slice(self):
+        """
+        Get the slice of the speech string that was matched.
+
+        :returns: slice | None
+        """
+        offsets = self.offsets
+        if offsets is None:
+            return None
+        elif self.end > self.start:
+            return slice(offsets[self.start][0], offsets[self.end - 1][1])
+        elif self.start < len(offsets):
+            loc = offsets[self.start][0]
+        else:
+            loc = offsets[-1][1] if offsets else 0
+        return slice(loc, loc)
+
+
+def _add_thread(program, threads, visited, pc, path, position):
+    # Follow instructions that don't consume words and add a thread for each
+    # reachable instruction that does, in order of priority.
+    stack = [(pc, path)]
+    while stack:
+        pc, path = stack.pop()
+        if pc in visited:
+            continue
+        visited.add(pc)
+        op, arg = program[pc]
+        if op == _JUMP:
+            stack.append((arg, path))
+        elif op == _SPLIT:
+            for target in reversed(arg):
+                stack.append((target, path))
+        elif op in _EVENT_OPS:
+            stack.append((pc + 1, (op, arg, position, path)))
+        elif op != _FAIL:
+            threads.append((pc, path))
+
+
+def _start_threads(program, starts):
+    # Get the threads for the start of a list of words.
+    threads, visited = [], set()
+    for start in starts:
+        _add_thread(program, threads, visited, start, None, 0)
+    return threads
+
+
+def _step(program, threads, word, lower, position):
+    # Advance threads over the word at a position, returning the threads for the
+    # next position.
+    next_threads, visited = [], set()
+    for pc, path in threads:
+        op, arg = program[pc]
+        if op == _WORD:
+            if (word if arg[1] else lower) != arg[0]:
+                continue
+            target = pc + 1
+        elif op == _WORD_TABLE:
+            target = arg[0].get(word if arg[1] else lower)
+            if target is None:
+                continue
+        elif op == _DICTATION:
+            if lower in arg[1] or not arg[0].match(word):
+                continue
+            target = pc + 1
+        else:
+            continue
+
+        _add_thread(program, next_threads, visited, target, path, position + 1)
+    return next_threads
+
+
+def _simulate(program, words, complete, starts=(0,), nonempty=False,
+              lower_words=None):
+    """
+    Run threads of an automaton program in lock step over a list of words.
+
+    If `complete` is ``True``, only matches of every word are used. Otherwise,
+    the preferred match of the start of the words is used, which is only
+    supported for programs with one ``_MATCH`` instruction.
+
+    :param program: list of instructions
+    :param words: list
+    :param complete: bool
+    :param starts: instructions to start threads at, in order of priority
+    :param nonempty: whether to ignore matches of no words if `complete` is
+        ``False``
+    :param lower_words: list of the lowercase form of each word (default: the
+        words lowercased)
+    :returns: dict of each matching ``_MATCH`` argument to a (position, path)
+        tuple for the preferred match
+    """
+    n = len(words)
+    threads = _start_threads(program, starts)
+    results = {}
+    for position in range(n + 1):
+        if complete and position == n:
+            results = _get_matches(program, threads, position)
+        elif not complete and (position or not nonempty):
+            # Use the first matching thread and stop the threads after it.
+            for i, (pc, path) in enumerate(threads):
+                op, arg = program[pc]
+                if op == _MATCH:
+                    results[arg] = position, path
+                    del threads[i:]
+                    break
+
+        if position == n or not threads:
+            break
+
+        word = words[position]
+        lower = word.lower() if lower_words is None else lower_words[position]
+        threads = _step(program, threads, word, lower, position)
+
+    return results
+
+
+class _WordIDPattern(object):
+    # Pattern for matching dictation words by ID, which matches the words of a
+    # vocabulary with the regular expression of a _DICTATION instruction.
+    def __init__(self, pattern, words):
+        self._pattern = pattern
+        self._words = words
+
+    def match(self, word_id):
+        return self._pattern.match(self._words[word_id])
+
+
+def _translate_program(program, vocabulary):
+    """
+    Get a copy of an automaton program that matches word IDs from a vocabulary
+    instead of words. Words of the program are added to the vocabulary if
+    necessary, so the copy is valid for as long as the vocabulary is used.
+
+    :param program: list of instructions
+    :param vocabulary: Vocabulary
+    :returns: list
+    """
+    translated = []
+    for op, arg in program:
+        if op == _WORD:
+            arg = (vocabulary.add(arg[0]), arg[1])
+        elif op == _WORD_TABLE:
+            arg = (dict((vocabulary.add(word), target)
+                        for word, target in arg[0].items()), arg[1])
+        elif op == _DICTATION:
+            # Stop words with spaces never match a word, so they are left out.
+            arg = (_WordIDPattern(arg[0], vocabulary._words),
+                   frozenset(vocabulary.add(word) for word in arg[1]
+                             if len(word.split()) == 1))
+        translated.append((op, arg))
+    return translated
+
+
+# Lock used for translating programs, which adds words to vocabularies.
+_translate_lock = threading.Lock()
+
+
+def _get_simulated_words(matcher, words):
+    """
+    Get the program of an ``Automaton`` or ``AutomatonSet`` to simulate with a
+    list of words, and the lists of words and lowercase words to use.
+
+    Words given as word IDs are simulated using their IDs and the IDs of their
+    lowercase forms with a translated copy of the program, which is kept until
+    words from another vocabulary are matched.
+
+    :param matcher: Automaton | AutomatonSet
+    :param words: list | _WordIDs
+    :returns: tuple
+    """
+    if not isinstance(words, _WordIDs):
+        return matcher._program, words, None
+
+    vocabulary = words.vocabulary
+    translated = matcher._translated_program
+    if translated is None or translated[0] is not vocabulary:
+        with _translate_lock:
+            translated = (vocabulary,
+                          _translate_program(matcher._program, vocabulary))
+        matcher._translated_program = translated
+    return translated[1], words.ids, vocabulary._get_lower_ids(words.ids)
+
+
+def _get_matches(program, threads, position):
+    # Use the first matching thread for each match instruction.
+    results = {}
+    for pc, path in threads:
+        op, arg = program[pc]
+        if op == _MATCH and arg not in results:
+            results[arg] = position, path
+    return results
+
+
+class AutomatonCompiler(object):
+    """
+    Class used to compile expansion trees into automaton instructions.
+
+    Each expansion class defines how it is compiled by implementing the
+    ``Expansion._compile_instructions`` method, which calls the methods of this
+    class.
+    """
+
+    def __init__(self):
+        self.instructions = []
+        self.expansions = []
+        self.fixed_words = {}
+        self.repetitions = {}
+        self._indices = {}
+        self._stack = []
+        self._rule_stack = []
+
+    @property
+    def position(self):
+        """
+        The index of the next instruction.
+
+        :returns: int
+        """
+        return len(self.instructions)
+
+    def emit(self, op, arg=None):
+        """
+        Add an instruction and return its index.
+
+        :param op: int
+        :param arg: object
+        :returns: int
+        """
+        self.instructions.append((op, arg))
+        return len(self.instructions) - 1
+
+    def patch(self, index, arg):
+        """
+        Set the argument of a previously emitted instruction.
+
+        :param index: int
+        :param arg: object
+        """
+        self.instructions[index] = (self.instructions[index][0], arg)
+
+    def index_of(self, e):
+        """
+        Get the index used for an expansion in compiled instructions, adding the
+        expansion if necessary.
+
+        :param e: Expansion
+        :returns: int
+        """
+        index = self._indices.get(id(e))
+        if index is None:
+            index = len(self.expansions)
+            self._indices[id(e)] = index
+            self.expansions.append(e)
+        return index
+
+    def compile(self, e):
+        """
+        Compile an expansion so that its match data is recorded.
+
+        :param e: Expansion
+        """
+        index = self.index_of(e)
+        e._automaton_compiled = True
+        self._stack.append(index)
+        self.emit(_OPEN, index)
+        e._compile_instructions(self)
+        self.emit(_CLOSE, index)
+        self._stack.pop()
+
+    def compile_reference(self, rule):
+        """
+        Compile the expansion of a referenced rule.
+
+        :param rule: Rule
+        :raises: GrammarError
+        """
+        if rule in self._rule_stack:
+            raise GrammarError("recursive reference to rule %r cannot be matched "
+                               "with an automaton" % rule.name)
+        self._rule_stack.append(rule)
+        self.compile(rule.expansion)
+        self._rule_stack.pop()
+
+    def emit_words(self, words, case_sensitive):
+        """
+        Emit instructions for matching a sequence of words. The matched words are
+        used as match values for the expansion being compiled.
+
+        :param words: list
+        :param case_sensitive: bool
+        """
+        words = list(words)
+        for word in words:
+            if not case_sensitive:
+                word = word.lower()
+            self.emit(_WORD, (word, case_sensitive))
+        self.fixed_words[self._stack[-1]] = words
+
+    def emit_dictation(self, word_pattern, stop_words, single_word):
+        """
+        Emit instructions for matching one or more dictation words.
+
+        :param word_pattern: compiled regular expression for dictation words
+        :param stop_words: set of lowercase words to stop matching on
+        :param single_word: whether to match only one word
+        """
+        start = self.emit(_DICTATION, (word_pattern, frozenset(stop_words)))
+        if not single_word:
+            self.emit(_SPLIT, (start, self.position + 1))
+
+    def emit_alternatives(self, alternatives):
+        """
+        Emit instructions for matching one of a list of expansions. Alternatives
+        earlier in the list have higher priority.
+
+        :param alternatives: list
+        """
+        if not alternatives:
+            self.emit_fail()
+            return
+
+        split = self.emit(_SPLIT)
+        targets, jumps = [], []
+        for e in alternatives:
+            targets.append(self.position)
+            self.compile(e)
+            jumps.append(self.emit(_JUMP))
+
+        end = self.position
+        self.patch(split, tuple(targets))
+        for jump in jumps:
+            self.patch(jump, end)
+
+    def emit_literal_alternatives(self, literals, case_sensitive):
+        """
+        Emit instructions for matching one of a list of literals using a word trie,
+        so that the number of literals doesn't affect matching time. Longer
+        literals have higher priority, then literals earlier in the list.
+
+        :param literals: list
+        :param case_sensitive: bool
+        """
+        if not literals:
+            self.emit_fail()
+            return
+
+        # Build the trie. Each node is a list of child nodes by word and the index
+        # of the first literal ending at the node.
+        root = [{}, None]
+        for e in literals:
+            index = self.index_of(e)
+            e._automaton_compiled = True
+            words = e._text.split()
+            self.fixed_words[index] = words
+            node = root
+            for word in words:
+                if not case_sensitive:
+                    word = word.lower()
+                node = node[0].setdefault(word, [{}, None])
+            if node[1] is None:
+                node[1] = index
+
+        # Emit instructions for each node and jump to the end from each literal.
+        jumps = []
+        stack = [(root, 0, None)]
+        while stack:
+            (children, index), depth, parent = stack.pop()
+            if parent is not None:
+                table, word = parent
+                table[word] = self.position
+
+            if children and index is not None:
+                split = self.emit(_SPLIT)
+            if children:
+                table = {}
+                self.emit(_WORD_TABLE, (table, case_sensitive))
+                for word, child in children.items():
+                    stack.append((child, depth + 1, (table, word)))
+            if index is not None:
+                if children:
+                    self.patch(split, (split + 1, self.position))
+                self.emit(_LITERAL, (index, depth))
+                jumps.append(self.emit(_JUMP))
+
+        end = self.position
+        for jump in jumps:
+            self.patch(jump, end)
+
+    def emit_optional(self, e):
+        """
+        Emit instructions for optionally matching an expansion.
+
+        :param e: Expansion
+        """
+        split = self.emit(_SPLIT)
+        self.compile(e)
+        self.patch(split, (split + 1, self.position))
+
+    def emit_repetition(self, repeat, allow_zero, allow_many=True):
+        """
+        Emit instructions for matching repetitions of a repeat expansion's child.
+        The match data of each repetition is recorded.
+
+        :param repeat: Repeat
+        :param allow_zero: whether zero repetitions are allowed
+        :param allow_many: whether more than one repetition is allowed
+        """
+        index = self._stack[-1]
+        self.repetitions[index] = repeat.child
+        if allow_zero:
+            split = self.emit(_SPLIT)
+
+        start = self.emit(_BEGIN_REPETITION, index)
+        self.compile(repeat.child)
+        self.emit(_END_REPETITION, index)
+        if allow_many:
+            self.emit(_SPLIT, (start, self.position + 1))
+
+        if allow_zero:
+            self.patch(split, (start, self.position))
+
+    def emit_fail(self):
+        """
+        Emit an instruction that never matches.
+        """
+        self.emit(_FAIL)
+
+
+class Automaton(object):
+    """
+    Token-level automaton compiled from an expansion tree.
+
+    Automata are created by the ``Rule`` and ``Expansion`` matching methods as
+    necessary; they are invalidated in the same way as `pyparsing` matcher
+    elements.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: root Expansion
+        :raises: GrammarError
+        """
+        # Import locally to avoid import cycles.
+        from .expansions import flat_map_expansion
+
+        compiler = AutomatonCompiler()
+        compiler.compile(root)
+        compiler.emit(_MATCH)
+        self.root = root
+        self._program = compiler.instructions
+        self._expansions = compiler.expansions
+        self._indices = compiler._indices
+        self._fixed_words = compiler.fixed_words
+
+        # Collect the expansions in the tree, and the trees of repeated
+        # expansions with their indices, for resetting match data.
+        self._tree = flat_map_expansion(root)
+        self._resets = _get_resets(self._tree)
+        self._repetitions = dict(
+            (index, [(e, self._indices[id(e)])
+                     for e in flat_map_expansion(child)])
+            for index, child in compiler.repetitions.items()
+        )
+
+        # The current_match value used for each expansion if it isn't matched.
+        self._unmatched_values = [e._correct_current_match(None)
+                                  for e in self._expansions]
+
+        # The vocabulary and program last used for matching word IDs.
+        self._translated_program = None
+
+    def _simulate(self, words, complete, nonempty=False):
+        # Return the position and path of the preferred match or None.
+        program, words, lower_words = _get_simulated_words(self, words)
+        return _simulate(program, words, complete, nonempty=nonempty,
+                         lower_words=lower_words).get(None)
+
+    def _apply(self, path, words, offsets):
+        # Reset match data and replay the events of a matching path to set the
+        # match data of each expansion.
+        _reset_match_data(self._resets)
+
+        if path is not None:
+            self._replay(path, words, offsets)
+
+    def _events(self, path):
+        # Get the (op, index, position) events of a matching path in order.
+        events = []
+        while path is not None:
+            op, index, position, path = path
+            events.append((op, index, position))
+        events.reverse()
+        return events
+
+    def _evaluate(self, path, words, offsets):
+        # Evaluate the events of a matching path without changing any expansions.
+        # Return a dictionary of expansion indices to the _MatchedWords of each
+        # matched expansion, and a dictionary of repeat indices to lists of such
+        # dictionaries for each repetition.
+        return self._evaluate_events(self._events(path), words, offsets)
+
+    def _evaluate_events(self, events, words, offsets, tokens=None):
+        # Evaluate a list of events like _evaluate() does. Fixed words are copied
+        # into the matched words, which the values of enclosing expansions also
+        # use. The matched words are a copy of the words unless a list of tokens
+        # to use is given.
+        fixed_words = self._fixed_words
+        if tokens is None:
+            tokens = list(words)
+        starts = {}
+        values = {}
+        repetitions = {}
+
+        # Values of the expansions matched by each repetition being matched, so
+        # that repeated expansion trees aren't traversed for each repetition.
+        open_repetitions = []
+        for op, index, position in events:
+            if op == _LITERAL:
+                # Literals matched with word tables are opened and closed at once.
+                index, depth = index
+                starts.setdefault(index, []).append(position - depth)
+                op = _CLOSE
+
+            # Keep a stack of start positions for each expansion because chart
+            # parsers can match expansions of recursive rules inside themselves.
+            if op == _OPEN:
+                starts.setdefault(index, []).append(position)
+                if index in self._repetitions:
+                    repetitions[index] = []
+            elif op == _CLOSE:
+                start = starts[index].pop()
+                if index in fixed_words:
+                    tokens[start:position] = fixed_words[index]
+                matched = _MatchedWords(tokens, offsets, start, position)
+                values[index] = matched
+                for repetition in open_repetitions:
+                    repetition[index] = matched
+            elif op == _BEGIN_REPETITION:
+                # Wipe match values for the next repetition: the values of the
+                # last repetition, or of the whole tree before the first one.
+                previous = repetitions[index]
+                if previous:
+                    for i in previous[-1]:
+                        values.pop(i, None)
+                else:
+                    for _, i in self._repetitions[index]:
+                        values.pop(i, None)
+                open_repetitions.append({})
+            elif op == _END_REPETITION:
+                repetitions[index].append(open_repetitions.pop())
+        return values, repetitions
+
+    def _get_current_match(self, index, values):
+        # Get the match value of an expansion from evaluated values, correcting the
+        # value in the same way as Expansion.current_match.
+        matched = values.get(index)
+        current_match = matched.join() if matched is not None else ""
+        if not current_match:
+            current_match = self._unmatched_values[index]
+        return current_match
+
+    def _get_matching_slice(self, index, values):
+        # Get the matching slice of an expansion from evaluated values.
+        matched = values.get(index)
+        return matched.get_slice() if matched is not None else None
+
+    def _replay(self, path, words, offsets):
+        # Replay the events of a matching path to set the match data of each
+        # expansion. Expansions create match values and slices from the matched
+        # words when they are used.
+        values, repetitions = self._evaluate(path, words, offsets)
+        expansions = self._expansions
+        for index, matched in values.items():
+            expansions[index]._set_matched_words(matched)
+
+        for index, matches in repetitions.items():
+            expansions[index]._repetitions_matched = [
+                dict((id(expansions[i]), (expansions[i], matched, matched))
+                     for i, matched in repetition.items())
+                for repetition in matches
+            ]
+
+    def matches(self, speech):
+        """
+        Match a speech string completely, set the match data of each expansion and
+        return whether it matched.
+
+        :param speech: str | sequence of words
+        :returns: bool
+        """
+        _, words, offsets = _tokenize(speech)
+        result = self._simulate(words, True)
+        self._apply(result and result[1], words, offsets)
+        return result is not None
+
+    def _defer_matches(self, speech):
+        # Match a speech string completely and defer setting the match data of
+        # each expansion until it is used. Return whether the current_match value
+        # of the root expansion will not be None.
+        _, words, offsets = _tokenize(speech)
+        result = self._simulate(words, True)
+        path = result and result[1]
+        _defer_match_data([self.root],
+                          lambda: self._apply(path, words, offsets))
+        return bool(result is not None and words) or \
+            self._unmatched_values[self._indices[id(self.root)]] is not None
+
+    def _reject(self, defer=False):
+        # Reset the match data of each expansion as for speech that doesn't match,
+        # or defer resetting it until it is used. Return whether the
+        # current_match value of the root expansion will not be None.
+        if defer:
+            _defer_match_data([self.root], lambda: self._apply(None, (), ()))
+        else:
+            self._apply(None, (), ())
+        return self._unmatched_values[self._indices[id(self.root)]] is not None
+
+    def match(self, speech):
+        """
+        Match a speech string completely and return a ``MatchResult`` with the
+        match data of each expansion, or None if the speech doesn't match.
+
+        The match data of expansions is not changed.
+
+        :param speech: str | sequence of words
+        :returns: MatchResult | None
+        """
+        speech, words, offsets = _tokenize(speech)
+        result = self._simulate(words, True)
+        if result is None:
+            return None
+        return MatchResult(self, speech, *self._evaluate(result[1], words,
+                                                         offsets))
+
+    def matches_prefix(self, speech):
+        """
+        Match the start of a speech string, set the match data of each expansion
+        and return the remainder of the string, or a tuple of the remaining words
+        if speech is a sequence of words.
+
+        :param speech: str | sequence of words
+        :returns: str | tuple
+        """
+        speech, words, offsets = _tokenize(speech)
+        result = self._simulate(words, False)
+        self._apply(result and result[1], words, offsets)
+        return _get_remainder(speech, words, offsets, result[0] if result else 0)
+
+
+class MatchResult(object):
+    """
+    Immutable result of matching a speech string with an automaton.
+
+    Match results are returned by the ``Rule.match`` and ``Grammar.match``
+    methods. Match data is looked up by expansion instead of being set on the
+    expansions themselves, so rules and grammars can be matched from several
+    threads at once.
+    """
+
+    def __init__(self, automaton, speech, values, repetitions):
+        """
+        :param automaton: Automaton
+        :param speech: matched speech string or tuple of words
+        :param values: dictionary of expansion indices to match values and slices
+        :param repetitions: dictionary of repeat indices to lists of dictionaries
+            like `values` for each repetition
+        """
+        self._automaton = automaton
+        self._speech = speech
+        self._values = values
+        self._repetitions = repetitions
+
+    def __repr__(self):
+        return "%s(rule=%r, speech=%r)" % (self.__class__.__name__,
+                                           self.rule, self._speech)
+
+    @property
+    def expansion(self):
+        """
+        The root expansion that was matched.
+
+        :returns: Expansion
+        """
+        return self._automaton.root
+
+    @property
+    def rule(self):
+        """
+        The rule that was matched, if any.
+
+        :returns: Rule | None
+        """
+        return self._automaton.root.rule
+
+    @property
+    def speech(self):
+        """
+        The speech string that was matched with leading and trailing whitespace
+        removed. If a sequence of words was matched, this is the words separated
+        by spaces.
+
+        :returns: str
+        """
+        speech = self._speech
+        if not isinstance(speech, string_types):
+            speech = " ".join(speech)
+        return speech
+
+    @property
+    def current_match(self):
+        """
+        The matched speech value of the root expansion.
+
+        :returns: str | None
+        """
+        return self.get_current_match(self._automaton.root)
+
+    @property
+    def matched_tags(self):
+        """
+        A list of JSGF tags whose expansions were matched. The returned list will
+        be in the order in which tags appear in the compiled rule.
+
+        This includes matching tags in referenced rules.
+
+        :returns: list
+        """
+        # Import locally to avoid import cycles.
+        from .expansions import filter_expansion, TraversalOrder
+
+        tagged_expansions = filter_expansion(
+            self._automaton.root, lambda e: e.tag and self.had_match(e),
+            TraversalOrder.PostOrder
+        )
+        return [e.tag for e in tagged_expansions]
+
+    def _index_of(self, e):
+        index = self._automaton._indices.get(id(e))
+        if index is None:
+            raise ValueError("expansion %r is not part of the matched expansion "
+                             "tree" % e)
+        return index
+
+    def get_current_match(self, e):
+        """
+        Get the matched speech value of an expansion. This will be None (if
+        required) or '' (if optional) if the expansion wasn't matched.
+
+        For expansions with a Repeat or KleeneStar ancestor, this is the value
+        matched in the last repetition.
+
+        :param e: Expansion
+        :returns: str | None
+        :raises: ValueError
+        """
+        return self._automaton._get_current_match(self._index_of(e),
+                                                  self._values)
+
+    def get_matching_slice(self, e):
+        """
+        Get the slice of the speech string matched by an expansion, or None if the
+        expansion wasn't matched.
+
+        :param e: Expansion
+        :returns: slice | None
+        :raises: ValueError
+        """
+        return self._automaton._get_matching_slice(self._index_of(e),
+                                                   self._values)
+
+    def had_match(self, e):
+        """
+        Whether an expansion matched a value that is not '' or None. This will also
+        check if the expansion was part of a complete repetition if it has a Repeat
+        or KleeneStar ancestor.
+
+        :param e: Expansion
+        :returns: bool
+        :raises: ValueError
+        """
+        if self.get_current_match(e):
+            return True
+
+        rep = e.repetition_ancestor
+        return bool(rep and any(self.get_expansion_matches(rep, e)))
+
+    def _get_repetition_data(self, repeat, e, get_data):
+        # Get a list of an expansion's match values or slices for each repetition
+        # of a repeat. The list is empty if the expansion isn't repeated by it.
+        automaton = self._automaton
+        repeat_index, index = self._index_of(repeat), self._index_of(e)
+        repeated = automaton._repetitions.get(repeat_index, ())
+        if all(i != index for _, i in repeated):
+            return []
+        return [get_data(index, values)
+                for values in self._repetitions.get(repeat_index, ())]
+
+    def get_repetitions_matched(self, repeat):
+        """
+        Get the number of repetitions matched by a Repeat or KleeneStar expansion.
+
+        :param repeat: Repeat
+        :returns: int
+        :raises: ValueError
+        """
+        return len(self._repetitions.get(self._index_of(repeat), ()))
+
+    def get_expansion_matches(self, repeat, e):
+        """
+        Get a list of an expansion's matched speech values for each repetition of
+        a Repeat or KleeneStar ancestor.
+
+        :param repeat: Repeat
+        :param e: Expansion
+        :returns: list
+        :raises: ValueError
+        """
+        return self._get_repetition_data(repeat, e,
+                                         self._automaton._get_current_match)
+
+    def get_expansion_slices(self, repeat, e):
+        """
+        Get a list of an expansion's matching slices for each repetition of a
+        Repeat or KleeneStar ancestor.
+
+        :param repeat: Repeat
+        :param e: Expansion
+        :returns: list
+        :raises: ValueError
+        """
+        return self._get_repetition_data(repeat, e,
+                                         self._automaton._get_matching_slice)
+
+
+class AutomatonSet(object):
+    """
+    Automaton that simulates the automata of several expansions in one pass over
+    the words of a speech string.
+
+    This is used by ``Grammar.find_matching_rules`` to match every rule at once.
+    """
+
+    def __init__(self, automata):
+        """
+        :param automata: list of Automaton objects
+        """
+        self.automata = list(automata)
+
+        # Join the programs of each automaton, relocating instruction targets and
+        # using the automaton's index as the argument of its match instruction.
+        program = [None]
+        starts = []
+        for i, automaton in enumerate(self.automata):
+            offset = len(program)
+            starts.append(offset)
+            for op, arg in automaton._program:
+                if op == _JUMP:
+                    arg += offset
+                elif op == _SPLIT:
+                    arg = tuple(target + offset for target in arg)
+                elif op == _WORD_TABLE:
+                    arg = (dict((word, target + offset)
+                                for word, target in arg[0].items()), arg[1])
+                elif op == _MATCH:
+                    arg = i
+                program.append((op, arg))
+
+        program[0] = (_SPLIT, tuple(starts))
+        self._program = program
+        self._starts = starts
+
+        # The vocabulary and program last used for matching word IDs.
+        self._translated_program = None
+
+        # The index of the automaton each instruction belongs to.
+        self._owners = [None]
+        for i, automaton in enumerate(self.automata):
+            self._owners.extend([i] * len(automaton._program))
+
+    def uses(self, automata):
+        """
+        Whether this object was created from the specified automata.
+
+        :param automata: list of Automaton objects
+        :returns: bool
+        """
+        return (len(automata) == len(self.automata) and
+                all(a is b for a, b in zip(automata, self.automata)))
+
+    def begin_stream(self, indices=None):
+        """
+        Start matching speech with each automaton one word at a time.
+
+        :param indices: indices of the automata to use (default all of them).
+            Other automata don't match.
+        :returns: AutomatonStream
+        """
+        return AutomatonStream(self, indices)
+
+    def match(self, speech, indices=None):
+        """
+        Match a speech string completely with each automaton and return a list of
+        ``MatchResult`` objects, using None for automata that didn't match.
+
+        The match data of expansions is not changed.
+
+        :param speech: str | sequence of words
+        :param indices: indices of the automata to use (default all of them).
+            Other automata don't match.
+        :returns: list
+        """
+        if indices is None:
+            indices = range(len(self.automata))
+
+        speech, words, offsets = _tokenize(speech)
+        starts = [self._starts[i] for i in indices]
+        program, simulated, lower_words = _get_simulated_words(self, words)
+        results = _simulate(program, simulated, True, starts,
+                            lower_words=lower_words)
+
+        matched = [None] * len(self.automata)
+        for i in indices:
+            result = results.get(i)
+            if result is not None:
+                automaton = self.automata[i]
+                matched[i] = MatchResult(automaton, speech, *automaton._evaluate(
+                    result[1], words, offsets))
+        return matched
+
+    def matches(self, speech, indices=None, defer=False):
+        """
+        Match a speech string completely with each automaton, set the match data of
+        each automaton's expansions and return a list of whether each automaton
+        matched.
+
+        Match data is reset once for every expansion and then set for each
+        matching automaton in order, so expansions used by more than one matching
+        automaton will have the match data of the last one.
+
+        :param speech: str | sequence of words
+        :param indices: indices of the automata to use (default all of them).
+            Other automata don't match and their match data is left alone.
+        :param defer: whether to defer setting match data until it is used
+        :returns: list
+        """
+        if indices is None:
+            indices = range(len(self.automata))
+        else:
+            indices = list(indices)
+
+        _, words, offsets = _tokenize(speech)
+        starts = [self._starts[i] for i in indices]
+        program, simulated, lower_words = _get_simulated_words(self, words)
+        results = _simulate(program, simulated, True, starts,
+                            lower_words=lower_words)
+        if defer:
+            _defer_match_data([self.automata[i].root for i in indices],
+                              lambda: self._set_match_data(indices, results,
+                                                           words, offsets))
+        else:
+            self._set_match_data(indices, results, words, offsets)
+        return [i in results for i in range(len(self.automata))]
+
+    def _set_match_data(self, indices, results, words, offsets):
+        # Reset the match data of each distinct expansion used by the automata.
+        seen = set()
+        resets = []
+        for i in indices:
+            for reset in self.automata[i]._resets:
+                if id(reset[0]) not in seen:
+                    seen.add(id(reset[0]))
+                    resets.append(reset)
+        _reset_match_data(resets)
+
+        # Replay the paths of the matching automata.
+        for i in indices:
+            result = results.get(i)
+            if result is not None:
+                self.automata[i]._replay(result[1], words, offsets)
+
+
+class AutomatonStream(object):
+    """
+    Object for matching speech with the automata of an ``AutomatonSet`` one word
+    at a time.
+
+    The threads of each automaton are kept between words, so each word takes
+    time proportional to the number of threads that are still running instead
+    of the number of words so far.
+
+    Streams are created by ``AutomatonSet.begin_stream``.
+    """
+
+    def __init__(self, automaton_set, indices=None):
+        """
+        :param automaton_set: AutomatonSet
+        :param indices: indices of the automata to use (default all of them)
+        """
+        if indices is None:
+            indices = range(len(automaton_set.automata))
+
+        self.automaton_set = automaton_set
+        self._words = []
+        self._offsets = []
+        self._length = 0
+        starts = [automaton_set._starts[i] for i in indices]
+        self._threads = _start_threads(automaton_set._program, starts)
+
+    @property
+    def words(self):
+        """
+        The words fed to this stream so far.
+
+        :returns: list
+        """
+        return list(self._words)
+
+    @property
+    def speech(self):
+        """
+        The words fed to this stream so far, separated by spaces.
+
+        :returns: str
+        """
+        return " ".join(self._words)
+
+    def feed(self, words):
+        """
+        Match one or more whitespace-separated words or a sequence of words.
+
+        :param words: str | sequence of words
+        """
+        if isinstance(words, string_types):
+            words = words.split()
+        program = self.automaton_set._program
+        for word in words:
+            # Record the offsets of each word in the speech property's value.
+            start = self._length + 1 if self._words else 0
+            self._length = start + len(word)
+            self._offsets.append((start, self._length))
+
+            position = len(self._words)
+            self._words.append(word)
+            self._threads = _step(program, self._threads, word, word.lower(),
+                                  position)
+
+    @property
+    def viable(self):
+        """
+        Sorted list of the indices of the automata that match the words so far or
+        that could match them followed by more words.
+
+        :returns: list
+        """
+        owners = self.automaton_set._owners
+        return sorted(set(owners[pc] for pc, _ in self._threads))
+
+    @property
+    def matched(self):
+        """
+        Sorted list of the indices of the automata that match the words so far.
+
+        :returns: list
+        """
+        results = _get_matches(self.automaton_set._program, self._threads,
+                               len(self._words))
+        return sorted(results)
+
+    def match(self):
+        """
+        Get a list of ``MatchResult`` objects for the words so far from each
+        automaton, using None for automata that didn't match.
+
+        The match data of expansions is not changed.
+
+        :returns: list
+        """
+        automata = self.automaton_set.automata
+        results = _get_matches(self.automaton_set._program, self._threads,
+                               len(self._words))
+        speech = tuple(self._words)
+        matched = [None] * len(automata)
+        for i, (_, path) in results.items():
+            automaton = automata[i]
+            matched[i] = MatchResult(automaton, speech, *automaton._evaluate(
+                path, self._words, self._offsets))
+        return matched
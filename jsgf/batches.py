@@ -0,0 +1,74 @@
+"""
+This module contains functions for matching batches of speech strings in worker
+processes.
+
+These functions are used by the ``Grammar.find_matching_rules_many`` and
+``Rule.matches_many`` methods. The rule or grammar to match with is sent to each
+worker process once when the process starts instead of with every speech string.
+Small batches are matched in the current process.
+"""
+
+import functools
+import itertools
+import multiprocessing
+
+#: Default number of speech strings sent to a worker process at a time.
+DEFAULT_CHUNK_SIZE = 50
+
+# Object used for matching in worker processes.
+_worker_target = None
+
+
+def _init_worker(target):
+    # Set the object used for matching in this worker process.
+    global _worker_target
+    _worker_target = target
+
+
+def _call_worker(func, speech):
+    return func(_worker_target, speech)
+
+
+def match_many(target, func, speech_strings, workers=None,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Call a function with a target object and each speech string, yielding the
+    results in the same order as the speech strings.
+
+    If there are fewer than ``workers * chunk_size`` speech strings or if fewer
+    than two workers are used, the function is called in the current process.
+    Otherwise a pool of worker processes is used, each of which receives a copy
+    of the target once when it starts.
+
+    :param target: picklable object to match with, such as a Grammar
+    :param func: picklable function taking the target and a speech string
+    :param speech_strings: iterable of speech strings
+    :param workers: number of worker processes to use (default: the number of
+        CPUs)
+    :param chunk_size: number of speech strings to send to a worker process at a
+        time
+    :returns: generator
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    # Take enough speech strings to decide whether to use worker processes.
+    speech_strings = iter(speech_strings)
+    batch = list(itertools.islice(speech_strings, workers * chunk_size))
+    if workers < 2 or len(batch) < workers * chunk_size:
+        for speech in itertools.chain(batch, speech_strings):
+            yield func(target, speech)
+        return
+
+    pool = multiprocessing.Pool(workers, _init_worker, (target,))
+    try:
+        for result in pool.imap(functools.partial(_call_worker, func),
+                                itertools.chain(batch, speech_strings),
+                                chunk_size):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,915 @@
+"""
+This module contains classes for matching speech strings with expansion trees
+using a chart parser.
+
+The chart matching backend is an alternative to the automaton backend in the
+:py:mod:`jsgf.automata` module. Expansion trees are compiled into a list of
+simple items for each expansion, using the same ``_compile_instructions``
+methods as automata, except that the trees of referenced rules are compiled once
+and called instead of being copied into the tree of each reference. Speech
+strings are matched by finding every word position where each expansion can
+stop matching from each position it is tried at. These results are memoized, so
+each expansion is only matched once at each position.
+
+The chart backend can match any expansion that the automaton backend can,
+including ambiguous expansions such as ``[test] test``, as well as rules that
+reference themselves, such as ``<rule> = <rule> test | test;``. When there is
+more than one way to match a speech string, the same parse is preferred as with
+the automaton backend: optional expansions and repeats are greedy and
+alternatives are tried in the order used by ``AlternativeSet``.
+
+The backend can be selected for a grammar's rules by setting the
+:py:attr:`~jsgf.grammars.Grammar.matching_backend` property::
+
+    grammar.matching_backend = MatchingBackend.Chart
+
+Chart parsers can also find each distinct parse of a speech string, ordered by
+the weights of alternative sets, using the
+:py:meth:`~jsgf.rules.Rule.iter_parses` method.
+
+"""
+
+import heapq
+import math
+
+from .automata import Automaton, MatchResult, _CLOSE, _OPEN, \
+    _BEGIN_REPETITION, _END_REPETITION, _get_resets, _tokenize
+
+# Item types.
+_WORDS, _DICTATION, _NODE, _ALTERNATIVES, _LITERALS, _OPTIONAL, _REPETITION, \
+    _FAIL = list(range(8))
+
+# Item types that match words without other items.
+_LEAF_ITEMS = frozenset([_WORDS, _DICTATION, _LITERALS])
+
+# Node types used for enumerating parses, in addition to _NODE and _REPETITION.
+_SEQUENCE, _ITEM = list(range(8, 10))
+
+# Depth used for chart keys that aren't being matched.
+_NO_DEPTH = float("inf")
+
+#: Default maximum number of steps used to find parses with ``iter_parses``.
+DEFAULT_MAX_WORK = 10000
+
+
+class _WorkLimitReached(Exception):
+    """
+    Exception raised when the maximum number of steps has been used.
+    """
+
+
+class ChartCompiler(object):
+    """
+    Class used to compile expansion trees into lists of chart parser items.
+
+    This class implements the same methods as ``AutomatonCompiler`` that are
+    called by the ``Expansion._compile_instructions`` method.
+    """
+
+    def __init__(self):
+        self.bodies = []
+        self.expansions = []
+        self.fixed_words = {}
+        self.repetitions = {}
+        self.references = {}
+        self.costs = {}
+        self._indices = {}
+        self._stack = []
+
+    def index_of(self, e):
+        """
+        Get the index used for an expansion in compiled items, adding the
+        expansion if necessary.
+
+        :param e: Expansion
+        :returns: int
+        """
+        index = self._indices.get(id(e))
+        if index is None:
+            index = len(self.expansions)
+            self._indices[id(e)] = index
+            self.expansions.append(e)
+            self.bodies.append(None)
+        return index
+
+    def _compile_node(self, e):
+        # Compile an expansion into a new list of items and return its index.
+        index = self.index_of(e)
+        e._automaton_compiled = True
+        body = []
+        self.bodies[index] = body
+        self._stack.append((index, body))
+        e._compile_instructions(self)
+        self._stack.pop()
+        return index
+
+    def _emit(self, item):
+        self._stack[-1][1].append(item)
+
+    def compile_root(self, e):
+        """
+        Compile the root expansion of a tree and return its index.
+
+        :param e: Expansion
+        :returns: int
+        """
+        return self._compile_node(e)
+
+    def compile(self, e):
+        """
+        Compile an expansion so that its match data is recorded.
+
+        :param e: Expansion
+        """
+        self._emit((_NODE, self._compile_node(e)))
+
+    def compile_reference(self, rule):
+        """
+        Compile a call to the expansion of a referenced rule. The rule's expansion
+        is compiled the first time it is referenced.
+
+        :param rule: Rule
+        """
+        index = self._indices.get(id(rule.expansion))
+        if index is None:
+            index = self.compile_root(rule.expansion)
+        self.references[self._stack[-1][0]] = index
+        self._emit((_NODE, index))
+
+    def emit_words(self, words, case_sensitive):
+        """
+        Emit an item for matching a sequence of words. The matched words are used
+        as match values for the expansion being compiled.
+
+        :param words: list
+        :param case_sensitive: bool
+        """
+        words = list(words)
+        expected = tuple(words if case_sensitive else
+                         [word.lower() for word in words])
+        self._emit((_WORDS, expected, case_sensitive))
+        self.fixed_words[self._stack[-1][0]] = words
+
+    def emit_dictation(self, word_pattern, stop_words, single_word):
+        """
+        Emit an item for matching one or more dictation words.
+
+        :param word_pattern: compiled regular expression for dictation words
+        :param stop_words: set of lowercase words to stop matching on
+        :param single_word: whether to match only one word
+        """
+        self._emit((_DICTATION, word_pattern, frozenset(stop_words), single_word))
+
+    def emit_alternatives(self, alternatives):
+        """
+        Emit an item for matching one of a list of expansions. Alternatives
+        earlier in the list have higher priority.
+
+        :param alternatives: list
+        """
+        if not alternatives:
+            self.emit_fail()
+            return
+
+        indices = [self._compile_node(e) for e in alternatives]
+        self._set_costs(alternatives)
+        self._emit((_ALTERNATIVES, indices))
+
+    def emit_literal_alternatives(self, literals, case_sensitive):
+        """
+        Emit an item for matching one of a list of literals using a table of first
+        words, so that the number of literals doesn't affect matching time. Longer
+        literals have higher priority, then literals earlier in the list.
+
+        :param literals: list
+        :param case_sensitive: bool
+        """
+        if not literals:
+            self.emit_fail()
+            return
+
+        # Sort the literals by priority, ignoring any that are the same as one
+        # with higher priority.
+        entries, seen = [], set()
+        for e in literals:
+            index = self.index_of(e)
+            e._automaton_compiled = True
+            words = e._text.split()
+            self.fixed_words[index] = words
+            if not case_sensitive:
+                words = [word.lower() for word in words]
+            words = tuple(words)
+            if words not in seen:
+                seen.add(words)
+                entries.append((index, words))
+        entries.sort(key=lambda entry: len(entry[1]), reverse=True)
+        self._set_costs(literals)
+
+        # Build the table of literals by first word. Empty literals are matched
+        # last.
+        table, empty = {}, []
+        for index, words in entries:
+            if words:
+                table.setdefault(words[0], []).append((index, words))
+            else:
+                empty.append(index)
+        self._emit((_LITERALS, table, empty, case_sensitive))
+
+    def _set_costs(self, alternatives):
+        # Set the cost of matching each alternative of the expansion being
+        # compiled from its weight, if the expansion has weights. Costs are
+        # negative log probabilities, so more likely alternatives cost less.
+        weights = getattr(self.expansions[self._stack[-1][0]], "weights", None)
+        if not weights:
+            return
+        total = sum(weights[e] for e in alternatives)
+        for e in alternatives:
+            self.costs[self._indices[id(e)]] = -math.log(weights[e] / total)
+
+    def emit_optional(self, e):
+        """
+        Emit an item for optionally matching an expansion.
+
+        :param e: Expansion
+        """
+        self._emit((_OPTIONAL, self._compile_node(e)))
+
+    def emit_repetition(self, repeat, allow_zero, allow_many=True):
+        """
+        Emit an item for matching repetitions of a repeat expansion's child. The
+        match data of each repetition is recorded.
+
+        :param repeat: Repeat
+        :param allow_zero: whether zero repetitions are allowed
+        :param allow_many: whether more than one repetition is allowed
+        """
+        index = self._stack[-1][0]
+        child = self._compile_node(repeat.child)
+        self.repetitions[index] = child
+        self._emit((_REPETITION, index, child, allow_zero, allow_many))
+
+    def emit_fail(self):
+        """
+        Emit an item that never matches.
+        """
+        self._emit((_FAIL,))
+
+
+class ChartParser(Automaton):
+    """
+    Chart parser compiled from an expansion tree.
+
+    Chart parsers are created by the ``Rule`` and ``Expansion`` matching methods
+    as necessary; they are invalidated in the same way as automata. They have the
+    same matching methods as the ``Automaton`` class.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: root Expansion
+        """
+        # Import locally to avoid import cycles.
+        from .expansions import flat_map_expansion
+
+        compiler = ChartCompiler()
+        compiler.compile_root(root)
+        self.root = root
+        self._bodies = compiler.bodies
+        self._expansions = compiler.expansions
+        self._indices = compiler._indices
+        self._fixed_words = compiler.fixed_words
+        self._costs = compiler.costs
+
+        # Collect the expansions in the tree and the trees of referenced rules,
+        # and the trees of repeated expansions with their indices, for resetting
+        # match data. Referenced trees are only collected once, so recursive
+        # references are allowed.
+        def collect(e):
+            result, stack, seen = [], [e], set()
+            while stack:
+                x = stack.pop()
+                if id(x) in seen:
+                    continue
+                seen.add(id(x))
+                for y in flat_map_expansion(x, shallow=True):
+                    index = self._indices.get(id(y))
+                    if index is None:
+                        continue
+                    result.append((y, index))
+                    if index in compiler.references:
+                        stack.append(self._expansions[
+                            compiler.references[index]])
+            return result
+
+        self._tree = [e for e, _ in collect(root)]
+        self._resets = _get_resets(self._tree)
+        self._repetitions = dict(
+            (index, collect(self._expansions[child]))
+            for index, child in compiler.repetitions.items()
+        )
+
+        # The current_match value used for each expansion if it isn't matched.
+        self._unmatched_values = [e._correct_current_match(None)
+                                  for e in self._expansions]
+
+    def _simulate(self, words, complete, nonempty=False):
+        # Return the position and derivation of the preferred match or None.
+        n = len(words)
+        for position, derivation in _Chart(self._bodies, words).parse(0, 0):
+            if complete and position == n or \
+                    not complete and (position or not nonempty):
+                return position, derivation
+        return None
+
+    def _events(self, derivation):
+        # Get the events of a derivation in order. Derivations of expansions are
+        # (_NODE, index, start, end, items) tuples, where items is a linked list
+        # of the derivations of each item in reverse order. Derivations of repeat
+        # items are (_REPETITION, index, repetitions) tuples, where repetitions is
+        # a linked list of child derivations in order.
+        events = []
+        stack = [(False, derivation)]
+        while stack:
+            is_event, d = stack.pop()
+            if is_event:
+                events.append(d)
+            elif d is None:
+                continue
+            elif d[0] == _NODE:
+                _, index, start, end, items = d
+                events.append((_OPEN, index, start))
+                stack.append((True, (_CLOSE, index, end)))
+                while items is not None:
+                    items, item = items
+                    stack.append((False, item))
+            else:
+                _, index, repetitions = d
+                pending = []
+                while repetitions is not None:
+                    child, repetitions = repetitions
+                    pending.extend([(True, (_BEGIN_REPETITION, index, None)),
+                                    (False, child),
+                                    (True, (_END_REPETITION, index, None))])
+                stack.extend(reversed(pending))
+        return events
+
+    def iter_parses(self, speech, limit=None, max_work=DEFAULT_MAX_WORK):
+        """
+        Match a speech string completely and yield a ``MatchResult`` for each
+        distinct way it matches.
+
+        Parses are yielded in order of the weights of the alternatives they use,
+        with the most likely parses first. Parses that are equally likely are
+        yielded in order of priority, so the first parse is the same as the
+        result of :meth:`match`. Parses of each expansion at each position are
+        only found once and are shared by the parses that use them.
+
+        Parses where a rule's expansion contains itself without matching more
+        words are skipped, as there would be infinitely many of them.
+
+        :param speech: str | sequence of words
+        :param limit: maximum number of parses to yield (default: no limit)
+        :param max_work: maximum number of steps to use for finding and
+            evaluating parses, after which no more parses are yielded, or None
+            for no maximum (default: ``DEFAULT_MAX_WORK``)
+        :returns: generator
+        """
+        speech, words, offsets = _tokenize(speech)
+        chart = _Chart(self._bodies, words, max_work)
+        parses = _Parses(self, chart)
+        seen = set()
+        k = 0
+        while limit is None or len(seen) < limit:
+            try:
+                parse = parses.get((_NODE, 0, 0, len(words)), k)
+                if parse is None:
+                    return
+
+                # Count the steps of evaluating the parse and comparing its match
+                # data with earlier parses, one for each event.
+                events = self._events(parse[1])
+                chart.count_work(len(events))
+            except _WorkLimitReached:
+                return
+            k += 1
+
+            # Yield parses with different match data only.
+            values, repetitions = self._evaluate_events(events, words, offsets)
+            key = (_freeze_values(values),
+                   tuple(sorted((index, tuple(_freeze_values(r) for r in rs))
+                                for index, rs in repetitions.items())))
+            if key not in seen:
+                seen.add(key)
+                yield MatchResult(self, speech, values, repetitions)
+
+
+def _freeze_values(values):
+    # Get a hashable version of the words matched by each expansion.
+    return frozenset((index, matched.start, matched.end)
+                     for index, matched in values.items())
+
+
+class _Chart(object):
+    """
+    Memoized results of matching the items of compiled expansions with a list of
+    words.
+
+    Results are lists of (end, derivation) tuples in order of priority, with one
+    tuple for each word position where matching can stop. Results are computed
+    by generators that yield the keys of other results they need, so that deeply
+    nested matches don't use Python's call stack. Rules that reference
+    themselves without matching any words first are handled by computing the
+    results of the referencing expansions repeatedly, starting with no results
+    for the recursive reference, until no more positions are found.
+    """
+
+    def __init__(self, bodies, words, max_work=None):
+        self.bodies = bodies
+        self.words = words
+        self.max_work = max_work
+        self.work = 0
+        self._lowered = [word.lower() for word in words]
+        self._memo = {}
+        self._active = {}
+        self._seeds = {}
+        self._lowest = _NO_DEPTH
+
+    def count_work(self, steps=1):
+        """
+        Count one or more steps of work.
+
+        :param steps: int
+        :raises: _WorkLimitReached
+        """
+        self.work += steps
+        if self.max_work is not None and self.work > self.max_work:
+            raise _WorkLimitReached()
+
+    def parse(self, index, start):
+        """
+        Get the results of matching a compiled expansion from a word position.
+
+        :param index: int
+        :param start: int
+        :returns: list
+        """
+        return self.get((_NODE, index, start))
+
+    def ends(self, key):
+        """
+        Get the positions in order of priority where matching for a key stops.
+
+        :param key: tuple
+        :returns: list
+        """
+        return [end for end, _ in self.get(key)]
+
+    def get(self, key):
+        """
+        Get the results for a key, which is either (_NODE, index, start) for an
+        expansion or (_REPETITION, child, allow_many, start, first) for the
+        repetitions of a repeat's child.
+
+        :param key: tuple
+        :returns: list
+        """
+        result = self._lookup(key)
+        if result is not None:
+            return result
+
+        # Each frame is a list of a key, the generator computing its results, its
+        # depth, the depth of the outermost key that the results of enclosing
+        # frames depend on and the positions of the last results used for
+        # recursive keys.
+        stack = [self._push(key)]
+        value = None
+        while True:
+            if self.max_work is not None:
+                self.count_work()
+            frame = stack[-1]
+            request = frame[1].send(value)
+            if not isinstance(request, list):
+                # Compute the results of another key if necessary.
+                value = self._lookup(request)
+                if value is None:
+                    stack.append(self._push(request))
+                continue
+
+            # Compute the results again while they depend on themselves and more
+            # positions are found.
+            key, _, depth, outer_lowest, seed_ends = frame
+            ends = set(end for end, _ in request)
+            if self._lowest == depth and not ends <= seed_ends:
+                frame[1] = self._compute(key)
+                frame[4] = ends
+                self._seeds[key] = request
+                self._lowest = _NO_DEPTH
+                value = None
+                continue
+
+            # Results that depend on the results of an outer key aren't final
+            # until the outer key is.
+            stack.pop()
+            del self._active[key]
+            self._seeds.pop(key, None)
+            lowest = self._lowest
+            if lowest >= depth:
+                self._memo[key] = request
+                lowest = _NO_DEPTH
+            self._lowest = min(outer_lowest, lowest)
+            if not stack:
+                return request
+            value = request
+
+    def _lookup(self, key):
+        # Get memoized results or None. Use the results found so far for keys
+        # that are being computed and record the depth of the outermost such key
+        # that results depend on.
+        result = self._memo.get(key)
+        if result is not None:
+            return result
+
+        depth = self._active.get(key)
+        if depth is not None:
+            self._lowest = min(self._lowest, depth)
+            return self._seeds.get(key, [])
+        return None
+
+    def _push(self, key):
+        depth = len(self._active)
+        self._active[key] = depth
+        frame = [key, self._compute(key), depth, self._lowest, set()]
+        self._lowest = _NO_DEPTH
+        return frame
+
+    def _compute(self, key):
+        if key[0] == _NODE:
+            return self._match_node(*key[1:])
+        return self._match_repetitions(*key[1:])
+
+    def match_leaf(self, item, position):
+        """
+        Get the results of matching an item that doesn't contain other items
+        from a word position.
+
+        :param item: tuple
+        :param position: int
+        :returns: list
+        """
+        kind = item[0]
+        words, lowered = self.words, self._lowered
+        if kind == _WORDS:
+            _, expected, case_sensitive = item
+            end = position + len(expected)
+            actual = (words if case_sensitive else lowered)[position:end]
+            return [(end, None)] if tuple(actual) == expected else []
+        elif kind == _DICTATION:
+            _, word_pattern, stop_words, single_word = item
+            end = position
+            while (end < len(words) and lowered[end] not in stop_words and
+                   word_pattern.match(words[end])):
+                end += 1
+                if single_word:
+                    break
+            return [(i, None) for i in range(end, position, -1)]
+
+        _, table, empty, case_sensitive = item
+        results = []
+        if position < len(words):
+            actual = words if case_sensitive else lowered
+            for i, expected in table.get(actual[position], ()):
+                end = position + len(expected)
+                if tuple(actual[position:end]) == expected:
+                    results.append((end, (_NODE, i, position, end, None)))
+        for i in empty:
+            results.append((position, (_NODE, i, position, position, None)))
+        return results
+
+    def _match_node(self, index, start):
+        # Match the items of an expansion in sequence, keeping the first result
+        # for each position after each item.
+        results = [(start, None)]
+        for item in self.bodies[index]:
+            kind = item[0]
+            next_results, seen = [], set()
+            for position, items in results:
+                if kind == _NODE:
+                    item_results = yield (_NODE, item[1], position)
+                elif kind in _LEAF_ITEMS:
+                    item_results = self.match_leaf(item, position)
+                elif kind == _ALTERNATIVES:
+                    item_results, ends = [], set()
+                    for i in item[1]:
+                        alternative_results = yield (_NODE, i, position)
+                        for end, derivation in alternative_results:
+                            if end not in ends:
+                                ends.add(end)
+                                item_results.append((end, derivation))
+                elif kind == _OPTIONAL:
+                    item_results = yield (_NODE, item[1], position)
+                    if all(end != position for end, _ in item_results):
+                        item_results = item_results + [(position, None)]
+                elif kind == _REPETITION:
+                    _, i, child, allow_zero, allow_many = item
+                    repetition_results = yield (_REPETITION, child, allow_many,
+                                                position, True)
+                    item_results = [(end, (_REPETITION, i, repetitions))
+                                    for end, repetitions in repetition_results]
+                    if allow_zero and all(end != position
+                                          for end, _ in item_results):
+                        item_results.append((position, None))
+                else:
+                    item_results = []
+
+                for end, derivation in item_results:
+                    if end not in seen:
+                        seen.add(end)
+                        next_results.append((end, (items, derivation)))
+
+            results = next_results
+            if not results:
+                break
+
+        yield [(end, (_NODE, index, start, end, items))
+               for end, items in results]
+
+    def _match_repetitions(self, child, allow_many, position, first):
+        # Match one or more repetitions of an expansion, preferring more
+        # repetitions. Only the first repetition can match no words; it isn't
+        # repeated.
+        results, seen = [], set()
+        child_results = yield (_NODE, child, position)
+        for end, derivation in child_results:
+            if end == position and not first:
+                continue
+            if allow_many and end != position:
+                next_results = yield (_REPETITION, child, allow_many, end, False)
+                for next_end, repetitions in next_results:
+                    if next_end not in seen:
+                        seen.add(next_end)
+                        results.append((next_end, (derivation, repetitions)))
+            if end not in seen:
+                seen.add(end)
+                results.append((end, (derivation, None)))
+        yield results
+
+
+class _Parses(object):
+    """
+    Lazily enumerated parses of the items of compiled expansions, using the
+    results of a chart.
+
+    Parses are found for nodes of a graph: (_NODE, index, start, end) for the
+    parses of an expansion, (_SEQUENCE, index, item, start, end) for the parses
+    of the items of an expansion from the given item, (_ITEM, index, item, start,
+    end) for the parses of an item and (_REPETITION, child, allow_many, start,
+    end, first) for repetitions of a repeat's child. Each node has a list of
+    edges, which are (cost, nodes, value) tuples, where a parse of each of the
+    nodes of an edge is combined into a parse of the node with the edge.
+
+    The k-th best parse of each node is found lazily, only finding the parses
+    of other nodes as necessary, and is kept so that it can be used by every
+    node that needs it. Like the chart, parses are found by generators so that
+    deeply nested parses don't use Python's call stack.
+    """
+
+    def __init__(self, parser, chart):
+        self._chart = chart
+        self._bodies = chart.bodies
+        self._costs = parser._costs
+        self._suffix_ends = {}
+
+        # The state of each node is a list of its edges, a heap of candidate
+        # (cost, edge index, parse indices) tuples, the parses found so far as
+        # (cost, derivation) tuples, the set of candidates seen and the last
+        # candidate used, for which the next candidates haven't been added yet.
+        self._states = {}
+        self._busy = set()
+
+    def _found(self, node, k):
+        # Get the k-th best parse of a node if it has been found.
+        state = self._states.get(node)
+        if state is not None and k < len(state[2]):
+            return state[2][k]
+        return None
+
+    def get(self, node, k):
+        """
+        Get the k-th best parse of a node as a (cost, derivation) tuple, or None
+        if it has fewer parses.
+
+        :param node: tuple
+        :param k: int
+        :returns: tuple | None
+        :raises: _WorkLimitReached
+        """
+        stack = [(node, self._find(node, k))]
+        self._busy.add(node)
+        value = None
+        while True:
+            self._chart.count_work()
+            request = stack[-1][1].send(value)
+            if isinstance(request, list):
+                # The generator has finished.
+                self._busy.discard(stack.pop()[0])
+                if not stack:
+                    return request[0]
+                value = request[0]
+                continue
+
+            # Find a parse of another node if necessary. Parses of nodes that
+            # are being found by generators on the stack are only used if they
+            # have been found already, so that parses don't contain themselves.
+            other, j = request
+            value = self._found(other, j)
+            if value is None and other not in self._busy:
+                stack.append((other, self._find(other, j)))
+                self._busy.add(other)
+
+    def _find(self, node, k):
+        # Generator yielding (node, k) requests and then a list of the k-th best
+        # parse of a node or None.
+        state = self._states.get(node)
+        if state is None:
+            edges = self._edges(node)
+            heap, seen = [], set()
+            for i, (cost, nodes, _) in enumerate(edges):
+                indices = (0,) * len(nodes)
+                seen.add((i, indices))
+                for other in nodes:
+                    parse = yield (other, 0)
+                    if parse is None:
+                        break
+                    cost += parse[0]
+                else:
+                    heapq.heappush(heap, (round(cost, 9), i, indices))
+            state = [edges, heap, [], seen, None]
+            self._states[node] = state
+
+        edges, heap, found, seen, _ = state
+        while len(found) <= k:
+            # Add the candidates after the last one used, which use the next
+            # parse of one of its nodes.
+            last = state[4]
+            state[4] = None
+            if last is not None:
+                _, i, indices = last
+                cost, nodes, _ = edges[i]
+                for n in range(len(nodes)):
+                    next_indices = (indices[:n] + (indices[n] + 1,) +
+                                    indices[n + 1:])
+                    if (i, next_indices) in seen:
+                        continue
+                    seen.add((i, next_indices))
+                    total = cost
+                    for other, j in zip(nodes, next_indices):
+                        parse = yield (other, j)
+                        if parse is None:
+                            break
+                        total += parse[0]
+                    else:
+                        heapq.heappush(heap, (round(total, 9), i, next_indices))
+
+            if not heap:
+                break
+
+            # Use the best candidate.
+            candidate = heapq.heappop(heap)
+            cost, i, indices = candidate
+            _, nodes, value = edges[i]
+            derivations = [self._states[other][2][j][1]
+                           for other, j in zip(nodes, indices)]
+            found.append((cost, self._build(node, value, derivations)))
+            state[4] = candidate
+
+        yield [found[k] if k < len(found) else None]
+
+    def _build(self, node, value, derivations):
+        # Combine parses of the nodes of an edge into a derivation.
+        if not derivations:
+            return value
+
+        kind = node[0]
+        if kind == _NODE:
+            # Convert the linked list of item derivations into the reversed
+            # linked list used by chart derivations.
+            _, index, start, end = node
+            items, sequence = None, derivations[0]
+            while sequence is not None:
+                item, sequence = sequence
+                items = (items, item)
+            return _NODE, index, start, end, items
+        elif kind == _ITEM:
+            if value is None:
+                return derivations[0]
+            return _REPETITION, value, derivations[0]
+        return derivations[0], derivations[1] if len(derivations) > 1 else None
+
+    def _item_ends(self, index, k, start):
+        # Get the positions where matching an item of an expansion stops.
+        chart = self._chart
+        item = self._bodies[index][k]
+        kind = item[0]
+        if kind == _NODE:
+            return chart.ends((_NODE, item[1], start))
+        elif kind in _LEAF_ITEMS:
+            return [end for end, _ in chart.match_leaf(item, start)]
+        elif kind == _ALTERNATIVES:
+            ends = []
+            for i in item[1]:
+                ends.extend(end for end in chart.ends((_NODE, i, start))
+                            if end not in ends)
+            return ends
+        elif kind == _OPTIONAL:
+            ends = chart.ends((_NODE, item[1], start))
+            return ends if start in ends else ends + [start]
+        elif kind == _REPETITION:
+            _, _, child, allow_zero, allow_many = item
+            ends = chart.ends((_REPETITION, child, allow_many, start, True))
+            if allow_zero and start not in ends:
+                ends.append(start)
+            return ends
+        return []
+
+    def _get_suffix_ends(self, index, k, start):
+        # Get the set of positions where matching the items of an expansion from
+        # the given item stops.
+        key = (index, k, start)
+        ends = self._suffix_ends.get(key)
+        if ends is None:
+            if k == len(self._bodies[index]):
+                ends = frozenset([start])
+            else:
+                ends = frozenset().union(*[
+                    self._get_suffix_ends(index, k + 1, end)
+                    for end in self._item_ends(index, k, start)
+                ])
+            self._suffix_ends[key] = ends
+        return ends
+
+    def _edges(self, node):
+        # Get the edges of a node in order of priority.
+        chart = self._chart
+        kind = node[0]
+        if kind == _NODE:
+            _, index, start, end = node
+            return [(0.0, ((_SEQUENCE, index, 0, start, end),), None)]
+
+        elif kind == _SEQUENCE:
+            _, index, k, start, end = node
+            if k == len(self._bodies[index]):
+                return [(0.0, (), None)] if start == end else []
+            return [(0.0, ((_ITEM, index, k, start, middle),
+                           (_SEQUENCE, index, k + 1, middle, end)), None)
+                    for middle in self._item_ends(index, k, start)
+                    if end in self._get_suffix_ends(index, k + 1, middle)]
+
+        elif kind == _REPETITION:
+            _, child, allow_many, start, end, first = node
+            edges = []
+            for middle in chart.ends((_NODE, child, start)):
+                if middle == start and not first:
+                    continue
+                if (allow_many and middle != start and end in chart.ends(
+                        (_REPETITION, child, allow_many, middle, False))):
+                    edges.append((0.0, ((_NODE, child, start, middle),
+                                        (_REPETITION, child, allow_many,
+                                         middle, end, False)), None))
+                if middle == end:
+                    edges.append((0.0, ((_NODE, child, start, end),), None))
+            return edges
+
+        # Get the edges of an item.
+        _, index, k, start, end = node
+        item = self._bodies[index][k]
+        kind = item[0]
+        if kind == _NODE:
+            return [(0.0, ((_NODE, item[1], start, end),), None)]
+        elif kind == _LITERALS:
+            return [(self._costs.get(derivation[1], 0.0), (), derivation)
+                    for position, derivation in chart.match_leaf(item, start)
+                    if position == end]
+        elif kind in _LEAF_ITEMS:
+            return [(0.0, (), None)]
+        elif kind == _ALTERNATIVES:
+            return [(self._costs.get(i, 0.0), ((_NODE, i, start, end),), None)
+                    for i in item[1] if end in chart.ends((_NODE, i, start))]
+        elif kind == _OPTIONAL:
+            ends = chart.ends((_NODE, item[1], start))
+            edges = []
+            if end in ends:
+                edges.append((0.0, ((_NODE, item[1], start, end),), None))
+            if end == start and start not in ends:
+                edges.append((0.0, (), None))
+            return edges
+        elif kind == _REPETITION:
+            _, repeat, child, allow_zero, allow_many = item
+            ends = chart.ends((_REPETITION, child, allow_many, start, True))
+            edges = []
+            if end in ends:
+                edges.append((0.0, ((_REPETITION, child, allow_many, start, end,
+                                     True),), repeat))
+            if allow_zero and end == start and start not in ends:
+                edges.append((0.0, (), None))
+            return edges
+        return []
@@ -3,19 +3,142 @@ This module contains classes for compiling and matching JSpeech Grammar Format r
 expansions.
 """
 
+import collections
 import functools
 import math
 import random
 import re
+import threading
 from copy import deepcopy
 
 import pyparsing
 from six import string_types, integer_types
 
+from .automata import Automaton, MatchingBackend, _MatchedWords, \
+    _set_deferred_match_data
+from .charts import ChartParser
 from .errors import CompilationError, GrammarError
+from .regexes import RegexMatcher
+from .vocabulary import _get_speech_words
 from . import references
 
 
+def _get_joined_length(tokens):
+    # Get the length of a list of tokens joined with spaces.
+    return sum(len(token) for token in tokens) + max(len(tokens) - 1, 0)
+
+
+# Pairs of RuleRefs being compared by the current thread.
+_compared_refs = threading.local()
+
+
+class _MatchedExpansions(threading.local):
+    """
+    Log of the expansions whose parser elements have matched in the current
+    thread, in order. Repeat expansions use it to find the expansions matched by
+    each repetition without traversing the repeated expansion tree. The log is
+    cleared before speech is matched with a parser element.
+    """
+    def __init__(self):
+        self.log = []
+
+    def clear(self):
+        del self.log[:]
+
+
+_matched_expansions = _MatchedExpansions()
+
+
+class _MatchMemo(threading.local):
+    """
+    Bounded table of the results of matching referenced rule expansions at
+    positions in the speech being matched in the current thread. The table is
+    only used while ``Expansion.matches`` matches speech with a parser element
+    for a rule whose grammar has a ``match_memo_size`` value greater than 0.
+    """
+    def __init__(self):
+        self.table = None
+        self.max_size = 0
+
+    def begin(self, max_size):
+        self.table = collections.OrderedDict() if max_size > 0 else None
+        self.max_size = max_size
+
+    def end(self):
+        self.table = None
+
+    def put(self, key, value):
+        # Add a value, removing the oldest value if the table is full.
+        table = self.table
+        table[key] = value
+        if len(table) > self.max_size:
+            table.popitem(last=False)
+
+
+_match_memo = _MatchMemo()
+
+
+class _MemoizedElement(pyparsing.ParseElementEnhance):
+    """
+    ``pyparsing.ParseElementEnhance`` subclass for matching a referenced rule's
+    root expansion, using results memoized for the current match if possible.
+
+    Results are memoized for each referenced expansion, position and whether
+    parse actions are used. The match data set by parse actions is memoized with
+    the expansions that set it and is set again when a result is reused.
+    Failures are memoized too. Without a memo table, the expansion's element is
+    used directly.
+    """
+    def __init__(self, expansion):
+        super(_MemoizedElement, self).__init__(expansion.matcher_element)
+        self._expansion_id = id(expansion)
+
+    def parseImpl(self, instring, loc, doActions=True):
+        memo = _match_memo
+        if memo.table is None:
+            return self.expr._parse(instring, loc, doActions, callPreParse=False)
+
+        key = (self._expansion_id, loc, doActions)
+        value = memo.table.get(key)
+        log = _matched_expansions.log
+        if value is not None:
+            if isinstance(value, pyparsing.ParseBaseException):
+                raise value
+
+            # Set the memoized match data and log the expansions as matched.
+            # Matching slices are set even if parse actions are not used.
+            end, tokens, match_data = value
+            for e, current_match, matching_slice, repetitions in match_data:
+                if doActions:
+                    e._current_match = current_match
+                    if repetitions is not None:
+                        e._repetitions_matched = list(repetitions)
+                e._matching_slice = matching_slice
+                log.append(e)
+            return end, tokens.copy()
+
+        start = len(log)
+        try:
+            end, tokens = self.expr._parse(instring, loc, doActions,
+                                           callPreParse=False)
+        except pyparsing.ParseBaseException as exc:
+            memo.put(key, exc)
+            raise
+
+        # Keep the match data of each expansion that matched, once each.
+        match_data, seen = [], set()
+        for e in log[start:]:
+            if id(e) in seen:
+                continue
+            seen.add(id(e))
+            repetitions = (list(e._repetitions_matched)
+                           if isinstance(e, Repeat) else None)
+            match_data.append((e, e._current_match, e._matching_slice,
+                               repetitions))
+        memo.put(key, (end, tokens.copy(), match_data))
+        return end, tokens
+
+
 class TraversalOrder(object):
     PreOrder, PostOrder = list(range(2))
 
@@ -49,6 +172,24 @@ def map_expansion(e, func=lambda x: x, order=TraversalOrder.PreOrder,
                                          TraversalOrder.PostOrder))
 
 
+def _visit_expansions_once(e, func):
+    # Call func on each expansion in an expansion tree in pre-order, like
+    # map_expansion, but only visit the tree of each referenced rule once. Rules
+    # referenced many times would otherwise be visited once per reference.
+    visited = set()
+    stack = [e]
+    while stack:
+        x = stack.pop()
+        func(x)
+        if isinstance(x, NamedRuleRef):
+            referenced = x.referenced_rule.expansion
+            if id(referenced) not in visited:
+                visited.add(id(referenced))
+                stack.append(referenced)
+        else:
+            stack.extend(reversed(x.children))
+
+
 def find_expansion(e, func=lambda x: x, order=TraversalOrder.PreOrder,
                    shallow=False):
     """
@@ -408,13 +549,33 @@ class Expansion(object):
         # Internal member for the parser element used during matching.
         self._matcher_element = None
 
+        # Internal members for the automaton, chart parser and regular expression
+        # matcher used during matching if this is a root expansion and whether
+        # this expansion has been compiled into any of them.
+        self._automaton = None
+        self._chart_parser = None
+        self._regex_matcher = None
+        self._automaton_compiled = False
+
+        # Internal member for the words that speech matching this expansion can
+        # start with.
+        self._first_words = None
+
+        # Internal member for the number of words and the words required by speech
+        # matching this expansion.
+        self._match_bounds = None
+
+        # Internal member increased each time this expansion or a descendant is
+        # changed.
+        self._version = 0
+        self.rule = None
+
         # Set children, letting the setter handle validation.
         self._children = None
         self.children = children
 
         self._current_match = None
         self._matching_slice = None
-        self.rule = None
 
         # Internal member used for caching calculations. Initially None as this
         # member is only used on root expansions, no sense in creating lots of
@@ -601,14 +762,34 @@ class Expansion(object):
 
         :returns: str | None
         """
-        return self._current_match
+        _set_deferred_match_data()
+        value = self._current_match
+        if isinstance(value, _MatchedWords):
+            # Join the matched words the first time the value is used.
+            value = self._correct_current_match(value)
+            self._current_match = value
+        return value
 
     @current_match.setter
     def current_match(self, value):
         self._set_current_match(value)
 
     def _set_current_match(self, value):
-        if isinstance(value, string_types):
+        _set_deferred_match_data()
+        self._current_match = self._correct_current_match(value)
+
+    def _set_matched_words(self, matched):
+        # Set the match data of this expansion to words matched by a backend. The
+        # current_match value and matching slice are created when they are used.
+        self._current_match = matched
+        self._matching_slice = matched
+
+    def _correct_current_match(self, value):
+        # Return the value to use for current_match.
+        if isinstance(value, _MatchedWords):
+            # Matched words never contain whitespace.
+            value = value.join()
+        elif isinstance(value, string_types):
             # Ensure that string values have only one space between words
             value = " ".join([x.strip() for x in value.split()])
         elif value is not None:
@@ -620,7 +801,7 @@ class Expansion(object):
             else:
                 value = None
 
-        self._current_match = value
+        return value
 
     @property
     def matching_slice(self):
@@ -629,20 +810,26 @@ class Expansion(object):
 
         :rtype: slice
         """
-        return self._matching_slice
+        _set_deferred_match_data()
+        value = self._matching_slice
+        if isinstance(value, _MatchedWords):
+            value = value.get_slice()
+            self._matching_slice = value
+        return value
 
     @matching_slice.setter
     def matching_slice(self, value):
         if not isinstance(value, slice) and value is not None:
             raise TypeError("matching_slice must be a slice or None")
 
+        _set_deferred_match_data()
         self._matching_slice = value
 
     def reset_for_new_match(self):
         """
         Call ``reset_match_data`` for this expansion and all of its descendants.
         """
-        map_expansion(self, lambda x: x.reset_match_data())
+        _visit_expansions_once(self, lambda x: x.reset_match_data())
 
     def reset_match_data(self):
         """
@@ -666,32 +853,59 @@ class Expansion(object):
 
             <rule> = [test] test;
 
-        :param speech: str
-        :returns: str
-        """
-        # Match the string using this expansion's parser element.
-        speech = speech.strip()
+        Ambiguous rule expansions can be matched if the rule's grammar uses the
+        automaton, chart or regular expression matching backend. Expansions of
+        rules that reference themselves can only be matched with the chart
+        backend.
+
+        Speech can also be a sequence of words, or of word IDs from the
+        vocabulary of the rule's grammar, in which case a tuple of the remaining
+        words is returned.
+
+        :param speech: str | sequence of words or word IDs
+        :returns: str | tuple
+        """
+        # Use another backend instead if the rule's grammar is set to use it.
+        rule = self.rule
+        speech = _get_speech_words(speech, rule.grammar if rule else None)
+        backend = rule.matching_backend if rule else MatchingBackend.Pyparsing
+        if backend == MatchingBackend.Automaton:
+            return self._get_automaton().matches_prefix(speech)
+        elif backend == MatchingBackend.Chart:
+            return self._get_chart_parser().matches_prefix(speech)
+        elif backend == MatchingBackend.Regex:
+            return self._get_regex_matcher().matches_prefix(speech)
+
+        # Match the string using this expansion's parser element. Parse actions
+        # set match data directly, so set any deferred match data first.
+        _set_deferred_match_data()
+        is_string = isinstance(speech, string_types)
+        speech = speech.strip() if is_string else " ".join(speech)
+        _matched_expansions.clear()
+        grammar = rule.grammar if rule else None
+        _match_memo.begin(grammar.match_memo_size if grammar else 0)
         try:
-            result = " ".join(
-                self.matcher_element.parseString(speech).asList()
-            )
+            tokens = self.matcher_element.parseString(speech).asList()
         except pyparsing.ParseException:
-            result = ""
+            tokens = []
+        finally:
+            _match_memo.end()
 
         # Return the difference between the result and speech. The result can be
         # shorter than speech, which means the match wasn't complete.
-        remaining = speech[len(result):].strip()
+        remaining = speech[_get_joined_length(tokens):].strip()
 
         # Do a second pass of the expansion tree for post-processing.
         def process(x):
-            # Remove partial matches.
+            # Remove partial matches. Check the parent's value without joining
+            # matched words.
             if (x.parent and not isinstance(x, NamedRuleRef) and not
-                    x.parent.current_match):
+                    x.parent._current_match):
                 x.current_match = None
                 x.matching_slice = None
 
-        map_expansion(self, process)
-        return remaining
+        _visit_expansions_once(self, process)
+        return remaining if is_string else tuple(remaining.split())
 
     def invalidate_matcher(self):
         """
@@ -702,28 +916,48 @@ class Expansion(object):
         This only needs to be called manually if modifying an expansion tree *after*
         matching with a Dictation expansion.
         """
-        # Return early if _matcher_element hasn't been set.
-        if not self._matcher_element:
-            return
+        # Set match data deferred for trees that could include this expansion
+        # before the trees change.
+        _set_deferred_match_data()
+
+        # Set _matcher_element, the automaton, the chart parser, the regular
+        # expression matcher and the first words to None for this expansion and
+        # each ancestor, but not any other subtrees (they are unaffected). Also
+        # increase their version numbers.
+        e, root = self, self
+        while e is not None:
+            e._matcher_element = None
+            e._automaton = None
+            e._chart_parser = None
+            e._regex_matcher = None
+            e._automaton_compiled = False
+            e._first_words = None
+            e._match_bounds = None
+            e._version += 1
+            e, root = e.parent, e
+
+        # If at the root expansion of a rule, let the rule's grammar invalidate any
+        # RuleRefs or NamedRuleRefs that reference the rule. References are found
+        # using an index and are invalidated before they are next used for
+        # matching.
+        rule = root.rule
+        if rule and rule.expansion is root:
+            rule._expansion_changed()
 
-        # Set _matcher_element to None for this expansion and each ancestor, but not
-        # any other subtrees (they are unaffected).
-        self._matcher_element = None
-        if self.parent:
-            self.parent.invalidate_matcher()
-
-        # If at the root expansion, call invalidate_matcher for any RuleRefs or
-        # NamedRuleRefs that reference this rule. To make things simple, this is
-        # is only done if this expansion belongs to a rule in a grammar.
-        elif self.rule and self.rule.grammar:
-            def process(x):
-                if isinstance(x, NamedRuleRef) and x.name == self.rule.name:
-                    x.invalidate_matcher()
-
-            # Invalidate each reference to this rule. Use shallow=True because every
-            # rule in the grammar will be processed, no need to process rules twice.
-            for r in self.rule.grammar.rules:
-                map_expansion(r.expansion, process, shallow=True)
+    @property
+    def _matcher_cached(self):
+        # Whether a parser element, an automaton, a chart parser, the first words
+        # or the match bounds have been set for this expansion.
+        return bool(self._matcher_element or self._automaton_compiled or
+                    self._first_words is not None or
+                    self._match_bounds is not None)
+
+    def _update_references(self):
+        # Invalidate references to changed rules in the grammar of this
+        # expansion's rule, if there is one.
+        rule = self.rule
+        if rule and rule.grammar:
+            rule.grammar._update_references()
 
     @property
     def matcher_element(self):
@@ -733,6 +967,7 @@ class Expansion(object):
 
         :returns: pyparsing.ParserElement
         """
+        self._update_references()
         if not self._matcher_element:
             element = self._make_matcher_element()
             self._matcher_element = element
@@ -740,8 +975,121 @@ class Expansion(object):
             element = self._matcher_element
         return element
 
+    def _get_automaton(self):
+        # Get the automaton used to match speech with this expansion as the root,
+        # compiling it if necessary.
+        self._update_references()
+        automaton = self._automaton
+        if automaton is None:
+            automaton = Automaton(self)
+            self._automaton = automaton
+        return automaton
+
+    def _get_chart_parser(self):
+        # Get the chart parser used to match speech with this expansion as the
+        # root, compiling it if necessary.
+        self._update_references()
+        parser = self._chart_parser
+        if parser is None:
+            parser = ChartParser(self)
+            self._chart_parser = parser
+        return parser
+
+    def _get_regex_matcher(self):
+        # Get the regular expression matcher used to match speech with this
+        # expansion as the root, compiling it if necessary. Use the chart parser
+        # instead if the expansion references its rule.
+        self._update_references()
+        matcher = self._regex_matcher
+        if matcher is None:
+            try:
+                matcher = RegexMatcher(self)
+            except GrammarError:
+                matcher = self._get_chart_parser()
+            self._regex_matcher = matcher
+        return matcher
+
+    def _compile_instructions(self, compiler):
+        """
+        Method used by the automaton, chart and regular expression matching
+        backends to compile this expansion using an ``AutomatonCompiler``, a
+        ``ChartCompiler`` or a ``RegexCompiler``.
+
+        Subclasses should implement this method for automaton, chart and regular
+        expression matching functionality.
+
+        :param compiler: AutomatonCompiler | ChartCompiler | RegexCompiler
+        """
+        raise NotImplementedError()
+
+    def _get_first_words(self, rules=()):
+        """
+        Get the words that speech matching this expansion can start with.
+
+        The result is a tuple of a frozenset of lowercase words, whether this
+        expansion can match without any words and whether it can start with any
+        word. Results are cached until ``invalidate_matcher`` is called.
+
+        :param rules: tuple of the rules being processed, used to check for
+            recursive references.
+        :returns: tuple
+        """
+        result = self._first_words
+        if result is None:
+            result = self._make_first_words(rules)
+            self._first_words = result
+        return result
+
+    def _make_first_words(self, rules):
+        """
+        Method used by ``_get_first_words`` to calculate the first words of this
+        expansion.
+
+        Subclasses should implement this method. This implementation allows any
+        word.
+
+        :param rules: tuple
+        :returns: tuple
+        """
+        return frozenset(), True, True
+
+    def _get_match_bounds(self, rules=()):
+        """
+        Get the bounds of speech matching this expansion.
+
+        The result is a tuple of the minimum number of words, the maximum number
+        of words or None if there is no maximum, and a frozenset of lowercase
+        words that every match contains. Results are cached until
+        ``invalidate_matcher`` is called.
+
+        :param rules: tuple of the rules being processed, used to check for
+            recursive references.
+        :returns: tuple
+        """
+        result = self._match_bounds
+        if result is None:
+            result = self._make_match_bounds(rules)
+            self._match_bounds = result
+        return result
+
+    def _make_match_bounds(self, rules):
+        """
+        Method used by ``_get_match_bounds`` to calculate the match bounds of this
+        expansion.
+
+        Subclasses should implement this method. This implementation allows any
+        number of words.
+
+        :param rules: tuple
+        :returns: tuple
+        """
+        return 0, None, frozenset()
+
     def _parse_action(self, tokens):
-        self.current_match = " ".join(tokens.asList())
+        # Keep the matched tokens. They are joined if current_match is used.
+        tokens_list = tokens.asList()
+        self._current_match = _MatchedWords(tokens_list, None, 0,
+                                            len(tokens_list))
         return tokens
 
     def _make_matcher_element(self):
@@ -761,16 +1109,18 @@ class Expansion(object):
 
         # Set a new function and use the original function for returning values.
         def postParse(instring, loc, tokenlist):
+            # Get the length of the matched string without joining tokens.
             if isinstance(tokenlist, pyparsing.ParseResults):
-                s = " ".join(tokenlist.asList())
+                length = _get_joined_length(tokenlist.asList())
             elif isinstance(tokenlist, list):
-                s = "".join(tokenlist)
+                length = sum(len(token) for token in tokenlist)
             elif isinstance(tokenlist, string_types):
-                s = tokenlist
+                length = len(tokenlist)
             else:
                 raise TypeError("postParse received invalid tokenlist %s"
                                 % tokenlist)
-            self.matching_slice = slice(loc - len(s), loc)
+            self._matching_slice = slice(loc - length, loc)
+            _matched_expansions.log.append(self)
             return closure(instring, loc, tokenlist)
 
         element.postParse = postParse
@@ -913,8 +1263,15 @@ class Expansion(object):
         return item in flat_map_expansion(self)
 
     def __getstate__(self):
+        _set_deferred_match_data()
         state = self.__dict__.copy()
         state['_matcher_element'] = None
+        state['_automaton'] = None
+        state['_chart_parser'] = None
+        state['_regex_matcher'] = None
+        state['_automaton_compiled'] = False
+        state['_first_words'] = None
+        state['_match_bounds'] = None
         return state
 
     @property
@@ -1108,7 +1465,7 @@ class BaseExpansionRef(references.BaseRef, Expansion):
 
     @staticmethod
     def valid(name):
-        return references.optionally_qualified_name.matches(name)
+        return references.optionally_qualified_name_matcher.matches(name)
 
     def compile(self, ignore_tags=False):
         self.validate_compilable()
@@ -1166,10 +1523,43 @@ class NamedRuleRef(BaseExpansionRef):
 
     def _make_matcher_element(self):
         # Wrap the parser element for the referenced rule's root expansion so that
-        # the current match value for the NamedRuleRef is also set.
-        return self._set_matcher_element_attributes(pyparsing.And([
-            self.referenced_rule.expansion.matcher_element
-        ]))
+        # the current match value for the NamedRuleRef is also set. The wrapping
+        # element memoizes results if the grammar's match_memo_size is set.
+        return self._set_matcher_element_attributes(_MemoizedElement(
+            self.referenced_rule.expansion
+        ))
+
+    def _compile_instructions(self, compiler):
+        # Compile the referenced rule's expansion in place.
+        compiler.compile_reference(self.referenced_rule)
+
+    def _make_first_words(self, rules):
+        # Use the first words of the referenced rule. Allow any word for references
+        # that cannot be resolved yet and for recursive references.
+        try:
+            rule = self.referenced_rule
+        except GrammarError:
+            if self.rule and self.rule.grammar:
+                self.rule.grammar._first_word_index.unresolved_names.add(self.name)
+            return frozenset(), True, True
+
+        if any(r is rule for r in rules):
+            return frozenset(), True, True
+        return rule.expansion._get_first_words(rules + (rule,))
+
+    def _make_match_bounds(self, rules):
+        # Use the match bounds of the referenced rule. Allow any speech for
+        # references that cannot be resolved yet and for recursive references.
+        try:
+            rule = self.referenced_rule
+        except GrammarError:
+            if self.rule and self.rule.grammar:
+                self.rule.grammar._first_word_index.unresolved_names.add(self.name)
+            return 0, None, frozenset()
+
+        if any(r is rule for r in rules):
+            return 0, None, frozenset()
+        return rule.expansion._get_match_bounds(rules + (rule,))
 
     def __hash__(self):
         return super(NamedRuleRef, self).__hash__()
@@ -1188,8 +1578,18 @@ class NullRef(BaseExpansionRef):
     def _make_matcher_element(self):
         return self._set_matcher_element_attributes(pyparsing.Empty())
 
-    def _set_current_match(self, value):
-        self._current_match = ""
+    def _compile_instructions(self, compiler):
+        # NULL matches without consuming any words.
+        pass
+
+    def _make_first_words(self, rules):
+        return frozenset(), True, False
+
+    def _make_match_bounds(self, rules):
+        return 0, 0, frozenset()
+
+    def _correct_current_match(self, value):
+        return ""
 
     @staticmethod
     def valid(name):
@@ -1217,8 +1617,18 @@ class VoidRef(BaseExpansionRef):
     def _make_matcher_element(self):
         return self._set_matcher_element_attributes(pyparsing.NoMatch())
 
-    def _set_current_match(self, value):
-        self._current_match = None
+    def _compile_instructions(self, compiler):
+        compiler.emit_fail()
+
+    def _make_first_words(self, rules):
+        return frozenset(), False, False
+
+    def _make_match_bounds(self, rules):
+        # VOID never matches, so any bounds will do.
+        return 0, 0, frozenset()
+
+    def _correct_current_match(self, value):
+        return None
 
     @staticmethod
     def valid(name):
@@ -1320,6 +1730,33 @@ class Sequence(VariableChildExpansion):
             child.matcher_element for child in self.children
         ]))
 
+    def _compile_instructions(self, compiler):
+        for child in self.children:
+            compiler.compile(child)
+
+    def _make_first_words(self, rules):
+        # Use the first words of each child up to and including the first child
+        # that cannot match without any words.
+        words, any_word = set(), False
+        for child in self.children:
+            child_words, nullable, child_any_word = child._get_first_words(rules)
+            words.update(child_words)
+            any_word = any_word or child_any_word
+            if not nullable:
+                return frozenset(words), False, any_word
+        return frozenset(words), True, any_word
+
+    def _make_match_bounds(self, rules):
+        # Matches contain a match of each child.
+        min_words, max_words, required = 0, 0, set()
+        for child in self.children:
+            child_min, child_max, child_required = child._get_match_bounds(rules)
+            min_words += child_min
+            if max_words is not None:
+                max_words = None if child_max is None else max_words + child_max
+            required.update(child_required)
+        return min_words, max_words, frozenset(required)
+
     def __hash__(self):
         return super(Sequence, self).__hash__()
 
@@ -1331,9 +1768,9 @@ class Literal(Expansion):
     def __init__(self, text, case_sensitive=False):
         # Set _text and use the text setter to validate the input.
         self._text = ""
-        self.text = text
         self._case_sensitive = bool(case_sensitive)
         super(Literal, self).__init__([])
+        self.text = text
 
     def __str__(self):
         return "%s('%s')" % (self.__class__.__name__, self.text)
@@ -1383,6 +1820,7 @@ class Literal(Expansion):
             raise TypeError("expected string, got %s instead" % value)
 
         self._text = value
+        self.invalidate_matcher()
 
     def generate(self):
         """
@@ -1445,6 +1883,21 @@ class Literal(Expansion):
             matcher_cls = pyparsing.CaselessLiteral
         return self._set_matcher_element_attributes(matcher_cls(text))
 
+    def _compile_instructions(self, compiler):
+        # Match each word of the text. Like the pyparsing literal elements, the
+        # original text is used as the match value.
+        compiler.emit_words(self._text.split(), self.case_sensitive)
+
+    def _make_first_words(self, rules):
+        words = self._text.split()
+        if not words:
+            return frozenset(), True, False
+        return frozenset([words[0].lower()]), False, False
+
+    def _make_match_bounds(self, rules):
+        words = self._text.split()
+        return len(words), len(words), frozenset(word.lower() for word in words)
+
     def __eq__(self, other):
         return (super(Literal, self).__eq__(other) and self.text == other.text and
                 self.case_sensitive == other.case_sensitive)
@@ -1466,8 +1919,20 @@ class RuleRef(NamedRuleRef):
         return self._referenced_rule
 
     def __eq__(self, other):
-        return (super(RuleRef, self).__eq__(other) and
-                self.referenced_rule == other.referenced_rule)
+        if not super(RuleRef, self).__eq__(other):
+            return False
+
+        # Compare the referenced rules, treating references that are already being
+        # compared as equal so that references to recursive rules can be compared.
+        pairs = _compared_refs.__dict__.setdefault("pairs", set())
+        key = (id(self), id(other))
+        if key in pairs:
+            return True
+        pairs.add(key)
+        try:
+            return self.referenced_rule == other.referenced_rule
+        finally:
+            pairs.discard(key)
 
     def __copy__(self):
         e = type(self)(self.referenced_rule)
@@ -1492,8 +1957,17 @@ class Repeat(SingleChildExpansion):
     """
     def __init__(self, expansion):
         super(Repeat, self).__init__(expansion)
+
+        # List of dictionaries of the IDs of the expansions matched by each
+        # repetition to (expansion, current_match, matching_slice) tuples. IDs are
+        # used because hashing expansions traverses their trees. Values can be
+        # words matched by a backend, which are only joined when they are used.
         self._repetitions_matched = []
 
+        # Position in the log of matched expansions where the repetition being
+        # matched by the parser element started.
+        self._repetition_start = 0
+
     def compile(self, ignore_tags=False):
         super(Repeat, self).compile()
         compiled = self.child.compile(ignore_tags)
@@ -1523,6 +1997,7 @@ class Repeat(SingleChildExpansion):
 
         :returns: int
         """
+        _set_deferred_match_data()
         return len(self._repetitions_matched)
 
     def get_expansion_matches(self, e):
@@ -1531,9 +2006,16 @@ class Repeat(SingleChildExpansion):
 
         :returns: list
         """
+        _set_deferred_match_data()
         if e.is_descendant_of(self):
-            return [values[e]["current_match"] for values in
-                    self._repetitions_matched]
+            # Expansions not matched by a repetition have no values.
+            result = []
+            for values in self._repetitions_matched:
+                value = values.get(id(e), (e, None, None))[1]
+                if value is None or isinstance(value, _MatchedWords):
+                    value = e._correct_current_match(value)
+                result.append(value)
+            return result
         else:
             return []
 
@@ -1543,9 +2025,15 @@ class Repeat(SingleChildExpansion):
 
         :returns: list
         """
+        _set_deferred_match_data()
         if e.is_descendant_of(self):
-            return [values[e]["matching_slice"] for values in
-                    self._repetitions_matched]
+            result = []
+            for values in self._repetitions_matched:
+                value = values.get(id(e), (e, None, None))[2]
+                if isinstance(value, _MatchedWords):
+                    value = value.get_slice()
+                result.append(value)
+            return result
         else:
             return []
 
@@ -1557,47 +2045,83 @@ class Repeat(SingleChildExpansion):
         if self._repetitions_matched:
             # Restore the last repetition's match values.
             last = self._repetitions_matched[len(self._repetitions_matched) - 1]
-            restore_current_matches(self.child, last, False)
+            for e, current_match, matching_slice in last.values():
+                if current_match is not None:
+                    e._current_match = current_match
+                if matching_slice is not None:
+                    e._matching_slice = matching_slice
         return tokens
 
     def _make_matcher_element(self):
-        # Define an extra parse action for the child's matcher element.
+        # Define parse actions for recording the match data of each repetition.
+        # Only expansions logged as matched since the repetition started are
+        # recorded and reset, so the repeated expansion tree isn't traversed.
+        def begin(tokens):
+            self._repetition_start = len(_matched_expansions.log)
+            return tokens
+
         def f(tokens):
             if tokens.asList():
-                # Add current match values to the _repetitions_matched list.
-                self._repetitions_matched.append(save_current_matches(self.child))
+                # Add the match values of this repetition to the
+                # _repetitions_matched list.
+                log = _matched_expansions.log
+                matched = log[self._repetition_start:]
+                values = dict((id(e), (e, e._current_match, e._matching_slice))
+                              for e in matched)
+                self._repetitions_matched.append(values)
 
                 # Wipe current match values for the next repetition (if any).
-                self.child.reset_for_new_match()
+                for e, _, _ in values.values():
+                    e.reset_match_data()
             return tokens
 
-        # Get the child's matcher element and add the extra parse action.
-        child_element = self.child.matcher_element.addParseAction(f)
+        # Get the child's matcher element and add the extra parse actions.
+        child_element = pyparsing.And([
+            pyparsing.Empty().setParseAction(begin),
+            self.child.matcher_element.addParseAction(f)
+        ])
 
         # Determine the parser element type to use.
         type_ = pyparsing.ZeroOrMore if self.is_optional else pyparsing.OneOrMore
 
-        # Handle the special case of a repetition ancestor, e.g. ((a b)+)+
-        rep = self.repetition_ancestor
-        if rep:
-            # Check if there are no other branches.
-            c = rep.child
-            only_branch = True
-            while c is not self:
-                if len(c.children) > 1:
-                    only_branch = False
-                    break
-                else:
-                    c = c.children[0]
-
-            # Use an And element instead if self is the only branch because
-            # it makes no sense to repeat a repeat like this!
-            if only_branch:
-                type_ = pyparsing.And
-                child_element = [child_element]
+        # Use an And element instead if this is the only branch of a repetition
+        # ancestor because it makes no sense to repeat a repeat like this!
+        if self._is_only_repeated_branch:
+            type_ = pyparsing.And
+            child_element = [child_element]
 
         return self._set_matcher_element_attributes(type_(child_element))
 
+    def _compile_instructions(self, compiler):
+        if self._is_only_repeated_branch:
+            compiler.emit_repetition(self, allow_zero=False, allow_many=False)
+        else:
+            compiler.emit_repetition(self, allow_zero=self.is_optional)
+
+    def _make_first_words(self, rules):
+        return self.child._get_first_words(rules)
+
+    def _make_match_bounds(self, rules):
+        # Repeats have no maximum unless the child can only match no words.
+        min_words, max_words, required = self.child._get_match_bounds(rules)
+        return min_words, None if max_words != 0 else 0, required
+
+    @property
+    def _is_only_repeated_branch(self):
+        # Whether this expansion is the only branch of a repetition ancestor, as in
+        # the special case ((a b)+)+.
+        rep = self.repetition_ancestor
+        if not rep:
+            return False
+
+        # Check if there are no other branches.
+        c = rep.child
+        while c is not self:
+            if len(c.children) > 1:
+                return False
+            c = c.children[0]
+        return True
+
     def reset_match_data(self):
         super(Repeat, self).reset_match_data()
         self._repetitions_matched = []
@@ -1638,6 +2162,14 @@ class KleeneStar(Repeat):
     def __hash__(self):
         return super(KleeneStar, self).__hash__()
 
+    def _make_first_words(self, rules):
+        words, _, any_word = self.child._get_first_words(rules)
+        return words, True, any_word
+
+    def _make_match_bounds(self, rules):
+        _, max_words, _ = self.child._get_match_bounds(rules)
+        return 0, None if max_words != 0 else 0, frozenset()
+
 
 class OptionalGrouping(SingleChildExpansion):
     """
@@ -1659,6 +2191,17 @@ class OptionalGrouping(SingleChildExpansion):
             pyparsing.Optional(self.child.matcher_element)
         )
 
+    def _compile_instructions(self, compiler):
+        compiler.emit_optional(self.child)
+
+    def _make_first_words(self, rules):
+        words, _, any_word = self.child._get_first_words(rules)
+        return words, True, any_word
+
+    def _make_match_bounds(self, rules):
+        _, max_words, _ = self.child._get_match_bounds(rules)
+        return 0, max_words, frozenset()
+
     @property
     def is_optional(self):
         return True
@@ -1686,6 +2229,51 @@ class RequiredGrouping(Sequence):
         return super(RequiredGrouping, self).__hash__()
 
 
+class _LiteralAlternativesElement(pyparsing.Or):
+    """
+    ``pyparsing.Or`` subclass for matching one of many pyparsing ``Literal`` or
+    ``CaselessLiteral`` elements.
+
+    Like ``pyparsing.Or``, the longest matching literal is used and ties go to the
+    literal that comes first. Instead of trying each literal, candidate strings are
+    looked up in dictionaries of literals with the same length, so the time taken
+    doesn't depend on the number of literals.
+    """
+    def __init__(self, exprs):
+        super(_LiteralAlternativesElement, self).__init__(exprs)
+
+        # Map each length to dictionaries of case-sensitive and case-insensitive
+        # strings to the first (priority, element) pair using them.
+        tables = {}
+        for priority, expr in enumerate(exprs):
+            exact, caseless = tables.setdefault(expr.matchLen, ({}, {}))
+            if isinstance(expr, pyparsing.CaselessLiteral):
+                caseless.setdefault(expr.match, (priority, expr))
+            else:
+                exact.setdefault(expr.match, (priority, expr))
+
+        # Store the tables sorted by length (longest to shortest).
+        self._tables = sorted(tables.items(), reverse=True,
+                              key=lambda item: item[0])
+
+    def parseImpl(self, instring, loc, doActions=True):
+        # Skip whitespace as the literal elements would.
+        loc = self.preParse(instring, loc)
+        for length, (exact, caseless) in self._tables:
+            text = instring[loc:loc + length]
+            if len(text) < length:
+                continue
+
+            candidates = [exact.get(text), caseless.get(text.upper())]
+            candidates = [c for c in candidates if c is not None]
+            if candidates:
+                # Parse with the literal element so that its actions are used.
+                _, expr = min(candidates, key=lambda c: c[0])
+                return expr._parse(instring, loc, doActions)
+
+        raise pyparsing.ParseException(instring, loc, self.errmsg, self)
+
+
 class AlternativeSet(VariableChildExpansion):
     """
     Class for a set of expansions, one of which can be spoken.
@@ -1830,8 +2418,9 @@ class AlternativeSet(VariableChildExpansion):
                     return child.generate()
         return random.choice(self.children).generate()
 
-    def _make_matcher_element(self):
-        # Return an element that can match the alternatives.
+    def _get_matchable_alternatives(self):
+        # Get a list of the alternatives that can be matched in the order that they
+        # should be tried.
         if self._weights:
             self._validate_weights()
 
@@ -1845,11 +2434,57 @@ class AlternativeSet(VariableChildExpansion):
             children = [e for e, _ in sorted(children, key=lambda x: x[1])]
             children.reverse()
         else:
-            children = self.children
+            children = list(self.children)
+        return children
 
-        return self._set_matcher_element_attributes(pyparsing.Or([
-            e.matcher_element for e in children
-        ]))
+    def _make_matcher_element(self):
+        # Return an element that can match the alternatives. Use dictionary lookups
+        # if every alternative is a non-empty literal.
+        alternatives = self._get_matchable_alternatives()
+        elements = [e.matcher_element for e in alternatives]
+        if alternatives and all(type(e) is Literal and e.text
+                                for e in alternatives):
+            element = _LiteralAlternativesElement(elements)
+        else:
+            element = pyparsing.Or(elements)
+        return self._set_matcher_element_attributes(element)
+
+    def _compile_instructions(self, compiler):
+        # The pyparsing Or element prefers the longest matching alternative. Use a
+        # word trie, which prefers longer literals, if every alternative is a
+        # literal with the same case sensitivity. Otherwise try longer literal
+        # alternatives first so that automata prefer the same ones.
+        alternatives = self._get_matchable_alternatives()
+        if all(type(e) is Literal for e in alternatives):
+            case_sensitive = set(e.case_sensitive for e in alternatives)
+            if len(case_sensitive) == 1:
+                compiler.emit_literal_alternatives(alternatives,
+                                                   case_sensitive.pop())
+                return
+
+            alternatives.sort(key=lambda e: len(e.text.split()), reverse=True)
+        compiler.emit_alternatives(alternatives)
+
+    def _make_first_words(self, rules):
+        words, nullable, any_word = set(), False, False
+        for e in self._get_matchable_alternatives():
+            child_words, child_nullable, child_any_word = e._get_first_words(rules)
+            words.update(child_words)
+            nullable = nullable or child_nullable
+            any_word = any_word or child_any_word
+        return frozenset(words), nullable, any_word
+
+    def _make_match_bounds(self, rules):
+        # Matches contain a match of one alternative, so only words required by
+        # every alternative are required.
+        bounds = [e._get_match_bounds(rules)
+                  for e in self._get_matchable_alternatives()]
+        if not bounds:
+            return 0, 0, frozenset()
+        maxima = [max_words for _, max_words, _ in bounds]
+        return (min(min_words for min_words, _, _ in bounds),
+                None if None in maxima else max(maxima),
+                frozenset.intersection(*[required for _, _, required in bounds]))
 
     def __eq__(self, other):
         return (
@@ -16,12 +16,69 @@ from ..expansions import (
     Repeat,
     Sequence,
     TraversalOrder,
+    _matched_expansions,
     find_expansion,
 )
 
 # Define the regular expression used for dictation words.
 _word_regex_str = r"[\w\d?,\.\-_!;:']+"
 
+# Define a compiled pattern for matching whole dictation words with automata.
+_word_pattern = re.compile(r"%s$" % _word_regex_str, re.UNICODE)
+
+# Define a compiled pattern for matching dictation words at positions in strings.
+_word_pattern_prefix = re.compile(_word_regex_str, re.UNICODE)
+
+
+class _DictationWordsElement(pyparsing.Token):
+    """
+    pyparsing ``Token`` subclass for matching one or more dictation words, stopping
+    before any word that starts with one of the given literals.
+
+    This matches the same words as ``pyparsing.OneOrMore(word, stopOn=...)`` with
+    an ``Or`` element of ``Literal`` stop elements. Instead of trying each
+    literal before each word, strings are looked up in sets of literals with the
+    same length, so the time taken doesn't depend on the number of literals.
+    """
+    def __init__(self, stop_literals):
+        super(_DictationWordsElement, self).__init__()
+        self.name = "dictation"
+        self.errmsg = "Expected " + self.name
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+
+        # Map each length to the set of stop literals with that length.
+        tables = {}
+        for literal in stop_literals:
+            tables.setdefault(len(literal), set()).add(literal)
+        self._tables = sorted(tables.items())
+
+    def _at_stop_literal(self, instring, loc):
+        for length, literals in self._tables:
+            if instring[loc:loc + length] in literals:
+                return True
+        return False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        words = []
+        match_word = _word_pattern_prefix.match
+        while True:
+            # Skip whitespace and stop before the next word if it starts with one
+            # of the stop literals.
+            start = self.preParse(instring, loc)
+            if self._tables and self._at_stop_literal(instring, start):
+                break
+
+            match = match_word(instring, start)
+            if not match:
+                break
+            words.append(match.group())
+            loc = match.end()
+
+        if not words:
+            raise pyparsing.ParseException(instring, loc, self.errmsg, self)
+        return loc, pyparsing.ParseResults(words)
+
 
 def _collect_from_leaves(e, backtrack):
     result = []
@@ -140,6 +197,11 @@ class Dictation(Literal):
         super(Dictation, self).__init__("")
         self._use_current_match = False
 
+        # Internal members for the set of next possible literals and the root
+        # expansion and version it was collected for.
+        self._next_literals = None
+        self._next_literals_key = None
+
     def __str__(self):
         return "%s()" % self.__class__.__name__
 
@@ -151,6 +213,12 @@ class Dictation(Literal):
     def __deepcopy__(self, memo=None):
         return self.__copy__()
 
+    def __getstate__(self):
+        state = super(Dictation, self).__getstate__()
+        state['_next_literals'] = None
+        state['_next_literals_key'] = None
+        return state
+
     def __hash__(self):
         # A Dictation hash is a hash of the class name and each ancestor's string
         # representation.
@@ -204,10 +272,31 @@ class Dictation(Literal):
                 result = pyparsing.Literal(self.current_match)
 
             # Set the parse action and return the element.
-            return result.setParseAction(self._parse_action)
+            return result.setParseAction(self._current_match_parse_action)
+
+        # Otherwise get the set of next possible literals.
+        next_literals = self._get_next_literals()
 
-        # Otherwise build a list of next possible literals. Make the required stack
-        # of child-parent pairs.
+        # Check if there is a next dictation literal. If there is, only match one
+        # word for this expansion.
+        if _word_regex_str in next_literals:
+            result = pyparsing.Regex(_word_regex_str, re.UNICODE)
+
+        # Otherwise build an element to match one or more words stopping on any of
+        # the next literals so that they aren't matched as dictation. If there are
+        # no literals ahead, words are matched without restrictions.
+        else:
+            result = _DictationWordsElement(next_literals)
+
+        return self._set_matcher_element_attributes(result)
+
+    def _current_match_parse_action(self, tokens):
+        # Log this expansion as matched so that Repeat ancestors record its value.
+        _matched_expansions.log.append(self)
+        return self._parse_action(tokens)
+
+    def _get_next_literals(self):
+        # Make the required stack of child-parent pairs.
         stack = []
         p1, p2 = self, self.parent
         while p1 and p2:
@@ -217,32 +306,51 @@ class Dictation(Literal):
             p1 = p1.parent
             p2 = p2.parent
 
-        # Build a list of next literals using the stack.
-        next_literals, _ = _collect_next_literals(stack, 0, True, False)
-
-        # De-duplicate the list.
-        next_literals = set(next_literals)
+        # Return the cached set if the tree hasn't changed since it was collected.
+        # Changing any expansion in the tree increases the root's version.
+        # Roots are compared by identity because comparing them for equality
+        # compares their trees.
+        root, key = p1, self._next_literals_key
+        if key is not None and key[0] is root and key[1] == root._version:
+            return self._next_literals
 
-        word = pyparsing.Regex(_word_regex_str, re.UNICODE)
-        if next_literals:
-            # Check if there is a next dictation literal. If there is, only match
-            # one word for this expansion.
-            if _word_regex_str in next_literals:
-                result = word
+        # Build a list of next literals using the stack and de-duplicate it.
+        next_literals, _ = _collect_next_literals(stack, 0, True, False)
+        next_literals = frozenset(next_literals)
+        self._next_literals = next_literals
+        self._next_literals_key = (root, root._version)
+        return next_literals
 
-            # Otherwise build an element to match one or more words stopping on
-            # any of the next literals so that they aren't matched as dictation.
+    def _compile_instructions(self, compiler):
+        # Handle the case where use_current_match is True.
+        if self.use_current_match is True:
+            current_match = self.current_match
+            if current_match is None:
+                compiler.emit_fail()
             else:
-                next_literals = list(map(pyparsing.Literal, next_literals))
-                result = pyparsing.OneOrMore(
-                    word, stopOn=pyparsing.Or(next_literals)
-                )
-        else:
-            # Handle the case of no literals ahead by allowing one or more Unicode
-            # words without restrictions.
-            result = pyparsing.OneOrMore(word)
-
-        return self._set_matcher_element_attributes(result)
+                compiler.emit_words(current_match.split(), True)
+            return
+
+        # Otherwise match one or more words, stopping on any of the next literals
+        # so that they aren't matched as dictation. Only match one word if there is
+        # a next dictation literal.
+        next_literals = self._get_next_literals()
+        single_word = _word_regex_str in next_literals
+        compiler.emit_dictation(_word_pattern,
+                                [literal.lower() for literal in next_literals
+                                 if literal != _word_regex_str],
+                                single_word)
+
+    def _make_first_words(self, rules):
+        # Dictation can start with any word.
+        return frozenset(), False, True
+
+    def _make_match_bounds(self, rules):
+        # Dictation matches one or more words, or the words of the current match
+        # if it is used instead.
+        if self.use_current_match:
+            return 0, None, frozenset()
+        return 1, None, frozenset()
 
     @property
     def matching_regex_pattern(self):
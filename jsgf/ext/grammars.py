@@ -8,6 +8,7 @@ from six import string_types
 from .expansions import dictation_in_expansion, expand_dictation_expansion
 from .rules import SequenceRule
 from jsgf import GrammarError, Grammar, Rule
+from jsgf.vocabulary import _get_speech_words
 
 
 class DictationGrammar(Grammar):
@@ -39,6 +40,24 @@ class DictationGrammar(Grammar):
         self._jsgf_only_grammar = Grammar(name=self.name,
                                           case_sensitive=self.case_sensitive)
 
+    @Grammar.matching_backend.setter
+    def matching_backend(self, value):
+        # Also set the backend of the grammar used for JSGF only rules.
+        Grammar.matching_backend.fset(self, value)
+        self._jsgf_only_grammar.matching_backend = value
+
+    @Grammar.lazy_match_data.setter
+    def lazy_match_data(self, value):
+        # Also defer match data for the grammar used for JSGF only rules.
+        Grammar.lazy_match_data.fset(self, value)
+        self._jsgf_only_grammar.lazy_match_data = value
+
+    @Grammar.match_memo_size.setter
+    def match_memo_size(self, value):
+        # Also memoize results for the grammar used for JSGF only rules.
+        Grammar.match_memo_size.fset(self, value)
+        self._jsgf_only_grammar.match_memo_size = value
+
     @property
     def rules(self):
         """
@@ -239,11 +258,13 @@ class DictationGrammar(Grammar):
         Find each visible rule passed to the grammar that matches the `speech`
         string. Also set matches for the original rule.
 
-        :param speech: str
+        :param speech: str | sequence of words or word IDs
         :param advance_sequence_rules: whether to call ``set_next()`` for successful
             sequence rule matches.
         :returns: list
         """
+        speech = _get_speech_words(speech, self)
+
         # Match against each match rule and remove any rules that didn't match
         result = self.match_rules
         for rule in tuple(result):
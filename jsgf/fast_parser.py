@@ -0,0 +1,1120 @@
+# encoding=utf-8
+"""
+This module contains alternative versions of the parser functions in the
+:ref:`parser module <jsgf-parser>` that do not use pyparsing's recursive grammar
+elements.
+
+Grammar strings are read left to right by a hand-written scanner using regular
+expressions for words, names, weights and tags. Expansions are built by an
+iterative precedence parser that keeps open groupings and partially parsed
+alternative sets and sequences on an explicit stack. This means that there is no
+limit on the length of alternative sets or sequences, or on how deeply groupings
+can be nested. This parser is also a lot faster than the pyparsing one, which
+makes a difference when loading large grammars.
+
+The functions in this module take the same arguments, produce the same objects and
+raise the same exceptions as their counterparts in the parser module. For
+example::
+
+    >>> from jsgf import fast_parser
+    >>> fast_parser.parse_expansion_string("/10/ hello | /20/ hi {greeting}")
+    ParsedAlternativeSet(Literal('hello'), Literal('hi'))
+
+``ParseException`` is still used for syntax errors so that code catching parser
+errors works with either module.
+
+The rules of large grammar files can also be parsed in worker processes by
+passing the ``workers`` argument to :func:`parse_grammar_file`. Passing the
+``lazy_rules`` argument instead only parses the names of rules up front, keeping
+the text of each rule's expansion until the expansion is used.
+
+"""
+
+import multiprocessing
+import re
+
+from pyparsing import ParseException
+from six import integer_types, raise_from, string_types
+
+from .errors import GrammarError
+from .expansions import (AlternativeSet, Literal, NamedRuleRef, NullRef,
+                         OptionalGrouping, RequiredGrouping, Sequence, VoidRef)
+from .grammars import Grammar, Import
+from .parse_cache import _decode_rules, _encode_rules
+from .parser import (GrammarHeader, ParsedAlternativeSet, WeightedExpansion,
+                     _apply_unary_operators, _combine_tokens, _post_process)
+from .references import (_comment_str, _grammar_name_str, _import_name_str,
+                         _qualified_name_str, _skip_whitespace,
+                         _skip_whitespace_and_comments, _whitespace_str)
+from .rules import Rule, _ExpansionSource
+
+
+#: Minimum number of characters of rule definitions that are sent to a worker
+#: process at a time when parsing grammars with worker processes.
+MIN_PART_SIZE = 16384
+
+# Regular expressions for the scanner's tokens. These use the same patterns as the
+# pyparsing elements in the references and parser modules. Whitespace and C++ style
+# comments are skipped before most tokens.
+_word = re.compile(r"[\w\-\']+", re.UNICODE)
+_name = re.compile(_qualified_name_str, re.UNICODE)
+_import_name = re.compile(_import_name_str, re.UNICODE)
+_grammar_name = re.compile(_grammar_name_str, re.UNICODE)
+_comment = re.compile(r"%s(?:%s)" % (_whitespace_str, _comment_str))
+_comment_only = re.compile(_comment_str)
+_statement_end = re.compile(r";|<|/\*|//")
+_name_chars = re.compile(r"[\w\+\-;:\|/\\\(\)\[\]@#%!\^&~\$\.]*", re.UNICODE)
+_real = re.compile(r"[+-]?(?:\d+(?:[eE][+-]?\d+)|"
+                   r"(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+_integer = re.compile(r"[+-]?\d+")
+_tag_text = re.compile(r"([\w\-\\']|\\{|\\})+", re.UNICODE)
+_version = re.compile(r"(v|V)(\d+\.\d+|\d+\.|\.\d+)")
+_header = re.compile(r"#JSGF", re.IGNORECASE)
+_public = re.compile(r"public(?![A-Za-z0-9_$])", re.IGNORECASE)
+_import = re.compile(r"import(?![A-Za-z0-9_$])", re.IGNORECASE)
+
+
+class _PendingSequence(object):
+    """
+    Sequence being built by the parser from right to left.
+
+    Items are stored in reverse order so that new items can be appended.
+    """
+    __slots__ = ("items", "flat", "result")
+
+    def __init__(self, items, flat):
+        self.items = items
+        self.flat = flat
+        self.result = None
+
+
+class _PendingAlternatives(object):
+    """
+    Alternative set being built by the parser from right to left.
+
+    Children and (child, weight) pairs are stored in reverse order so that new
+    alternatives can be appended.
+    """
+    __slots__ = ("children", "weights", "result")
+
+    def __init__(self, children, weights):
+        self.children = children
+        self.weights = weights
+        self.result = None
+
+
+def _is_untagged_sequence(e):
+    return isinstance(e, Sequence) and not e.tag
+
+
+def _flatten(e):
+    """
+    Return the list of expansions that e flattens to in a sequence chain.
+
+    This is the non-recursive version of the parser module's sequence flattening.
+    """
+    result = []
+    stack = [e]
+    while stack:
+        e = stack.pop()
+        if _is_untagged_sequence(e):
+            stack.extend(reversed(e.children))
+        else:
+            result.append(e)
+    return result
+
+
+def _flatten_pending(seq):
+    if not seq.flat:
+        items = []
+        for item in seq.items:
+            if _is_untagged_sequence(item):
+                items.extend(reversed(_flatten(item)))
+            else:
+                items.append(item)
+        seq.items = items
+        seq.flat = True
+
+
+def _pending_alternatives(e):
+    # Return e as a pending alternative set. e is either one already or an
+    # AlternativeSet.
+    if isinstance(e, _PendingAlternatives):
+        return e
+    return _PendingAlternatives(list(reversed(e.children)),
+                                list(reversed(list(e.weights.items()))))
+
+
+def _sequence(x, v):
+    """
+    Return the (pending) sequence of x and v, flattening sequence chains in the same
+    way as the parser module's post-processing.
+    """
+    if isinstance(v, _PendingSequence):
+        _flatten_pending(v)
+        seq = v
+    elif isinstance(v, Sequence):
+        seq = _PendingSequence(list(reversed(_flatten(v))), True)
+    else:
+        return _PendingSequence([v, x], not _is_untagged_sequence(x))
+
+    seq.items.extend(reversed(_flatten(x)))
+    return seq
+
+
+def _materialize(e):
+    """
+    Return the expansion for a pending sequence or alternative set, or e itself if
+    it is already an expansion.
+    """
+    if isinstance(e, _PendingSequence):
+        if e.result is None:
+            e.result = Sequence(*[_materialize(x) for x in reversed(e.items)])
+    elif isinstance(e, _PendingAlternatives):
+        if e.result is None:
+            children = [_materialize(x) for x in reversed(e.children)]
+            e.result = ParsedAlternativeSet(*children)
+            e.result.weights = [(_materialize(x), weight)
+                                for x, weight in reversed(e.weights)]
+    else:
+        return e
+    return e.result
+
+
+def _finish_level(lst):
+    """
+    Combine the tokens for one level of the right-recursive expansion grammar used
+    by the parser module, i.e. an atom, any unary operators and the value of the
+    next level, if any.
+
+    :param lst: list
+    :returns: Expansion | _PendingSequence | _PendingAlternatives
+    """
+    _apply_unary_operators(lst)
+    x = lst[0]
+    n = len(lst)
+    tail = lst[-1]
+    simple_tail = n > 1 and not isinstance(tail, string_types + integer_types +
+                                           (float,))
+    if n == 1:
+        if isinstance(x, WeightedExpansion):
+            raise GrammarError("weights cannot be used outside of alternative sets")
+        return x
+
+    elif n == 2 and simple_tail:
+        # Handle sequences.
+        if isinstance(x, WeightedExpansion):
+            raise GrammarError("weights cannot be used outside of alternative sets")
+
+        # Place x in a sequence with the first alternative if the next level is an
+        # alternative set. See _combine_tokens() in the parser module.
+        if not isinstance(x, RequiredGrouping) and \
+                isinstance(tail, (_PendingAlternatives, AlternativeSet)):
+            alternatives = _pending_alternatives(tail)
+            alternatives.children[-1] = _sequence(x, alternatives.children[-1])
+            return alternatives
+        return _sequence(x, tail)
+
+    elif n in (3, 4) and simple_tail and lst[1] == "|" and \
+            (n == 3 or isinstance(lst[2], integer_types + (float,))):
+        # Handle alternative sets.
+        if isinstance(tail, (_PendingAlternatives, AlternativeSet)) and \
+                not getattr(tail, "tag", ""):
+            alternatives = _pending_alternatives(tail)
+        else:
+            alternatives = _PendingAlternatives([tail], [])
+        if n == 4:
+            alternatives.weights.append((alternatives.children[-1], lst[2]))
+        if isinstance(x, WeightedExpansion):
+            alternatives.weights.append((x.child, x.weight))
+            x.child.parent = None
+            x = x.child
+        alternatives.children.append(x)
+        return alternatives
+
+    # Fall back on the parser module's functions for anything else, such as
+    # leftover tokens from tags with multiple words.
+    lst = [_materialize(token) for token in lst]
+    return _post_process([_combine_tokens(lst)])[0]
+
+
+def _finish_levels(lst, levels):
+    """
+    Combine the last level of a grouping with the levels on its left.
+
+    :param lst: list of tokens for the last level
+    :param levels: list of token lists for the levels on the left
+    :returns: Expansion | _PendingSequence | _PendingAlternatives
+    """
+    value = _finish_level(lst)
+    while levels:
+        lst = levels.pop()
+        lst.append(value)
+        value = _finish_level(lst)
+    return value
+
+
+class _Parser(object):
+    """
+    Hand-written scanner and parser for JSGF grammar strings.
+    """
+
+    def __init__(self, string, lazy_rules=False):
+        self.string = string
+        self.lazy_rules = lazy_rules
+
+    def error(self, loc, msg):
+        return ParseException(self.string, loc, msg)
+
+    def skip(self, loc):
+        # Skip whitespace and comments.
+        return _skip_whitespace_and_comments.match(self.string, loc).end()
+
+    def match(self, pattern, loc, name, skip=True):
+        # Match a regular expression after any whitespace and comments.
+        if skip:
+            loc = self.skip(loc)
+        m = pattern.match(self.string, loc)
+        if not m:
+            raise self.error(loc, "Expected %s" % name)
+        return m
+
+    def expect(self, loc, literal):
+        # Return the location after the given literal.
+        loc = self.skip(loc)
+        if not self.string.startswith(literal, loc):
+            raise self.error(loc, "Expected \"%s\"" % literal)
+        return loc + len(literal)
+
+    def expect_end(self, loc, skip=True):
+        if skip:
+            loc = self.skip(loc)
+        else:
+            loc = _skip_whitespace.match(self.string, loc).end()
+        if loc != len(self.string):
+            raise self.error(loc, "Expected end of text")
+
+    def match_line_delimiter(self, loc):
+        """
+        Return the location after a semicolon or a newline, or None if there isn't
+        one.
+
+        Newlines are only line delimiters if there is nothing but spaces and
+        comments between them and the previous token.
+        """
+        s = self.string
+        i = self.skip(loc)
+        if s.startswith(";", i):
+            return i + 1
+
+        i = loc
+        m = _comment.match(s, i)
+        while m:
+            i = m.end()
+            m = _comment.match(s, i)
+        while s[i:i+1] in (" ", "\t", "\r"):
+            i += 1
+        if s.startswith("\n", i):
+            return i + 1
+        return None
+
+    def parse_line_delimiters(self, loc):
+        # Parse one or more line delimiters.
+        result = self.match_line_delimiter(loc)
+        if result is None:
+            raise self.error(loc, "Expected line end")
+        while result is not None:
+            loc = result
+            result = self.match_line_delimiter(loc)
+        return loc
+
+    def find_statement_end(self, loc):
+        """
+        Return the location after the first semicolon after a location that is not
+        in a comment or a rule name, or -1 if there isn't one or if it could be in
+        a comment or rule name that is not complete.
+
+        Parsing a statement never looks past this semicolon, except to match line
+        delimiters after it.
+        """
+        s = self.string
+        i = loc
+        while True:
+            m = _statement_end.search(s, i)
+            if not m:
+                return -1
+            c = m.group()
+            if c == ";":
+                return m.end()
+            elif c == "<":
+                # Skip the name, which may contain semicolons. Any comments before
+                # it must be complete.
+                i = self.skip(m.end())
+                if s.startswith("/*", i):
+                    return -1
+                i = _name_chars.match(s, i).end()
+                if i == len(s):
+                    return -1
+            else:
+                # Skip the comment if it is complete.
+                comment = _comment_only.match(s, m.start())
+                if not comment or comment.end() == len(s):
+                    return -1
+                i = comment.end()
+
+    def find_rule_header(self, loc, end):
+        """
+        Return the location after the ">" of the first rule name followed by "="
+        between two locations that is not in a comment, or -1 if there isn't one.
+        """
+        s = self.string
+        i = loc
+        while True:
+            m = _statement_end.search(s, i, end)
+            if not m:
+                return -1
+            c = m.group()
+            if c == "<":
+                i = self.skip(m.end())
+                if i >= end:
+                    return -1
+                i = _name_chars.match(s, i, end).end()
+                if i < end and s[i] == ">":
+                    i += 1
+                    if s.startswith("=", self.skip(i)):
+                        return i
+            elif c == ";":
+                i = m.end()
+            else:
+                comment = _comment_only.match(s, m.start(), end)
+                if not comment:
+                    return -1
+                i = comment.end()
+
+    def parse_weight(self, loc):
+        """
+        Parse an optional alternative weight.
+
+        :returns: tuple (weight or None, end location)
+        """
+        s = self.string
+        i = self.skip(loc)
+        if not s.startswith("/", i):
+            return None, loc
+        i = self.skip(i + 1)
+        m = _real.match(s, i)
+        if m:
+            weight = float(m.group())
+        else:
+            m = self.match(_integer, i, "alternative weight", False)
+            weight = int(m.group())
+        return weight, self.expect(m.end(), "/")
+
+    def parse_reference(self, loc):
+        # Parse a rule reference starting at a left angled bracket.
+        m = self.match(_name, loc + 1, "rule name")
+        name = m.group()
+        end = self.expect(m.end(), ">")
+        if name == "NULL":
+            return NullRef(), end
+        elif name == "VOID":
+            return VoidRef(), end
+        return NamedRuleRef(name), end
+
+    def parse_literal(self, m):
+        # Parse one or more words starting with the given match.
+        s = self.string
+        words = []
+        while m:
+            words.append(m.group())
+            end = m.end()
+            m = _word.match(s, self.skip(end))
+        return Literal(" ".join(words)), end
+
+    def parse_operators(self, loc, lst):
+        """
+        Parse any tags and unary operators, adding their tokens to lst.
+
+        :returns: end location
+        """
+        s = self.string
+        while True:
+            i = self.skip(loc)
+            c = s[i:i+1]
+            if c in ("+", "*") and c:
+                lst.append(c)
+                loc = i + 1
+            elif c == "{":
+                tokens = [c]
+                try:
+                    m = self.match(_tag_text, i + 1, "tag text")
+                    while m:
+                        tokens.append(m.group())
+                        end = m.end()
+                        m = _tag_text.match(s, self.skip(end))
+                    end = self.expect(end, "}")
+                except ParseException:
+                    return loc
+                tokens.append("}")
+                lst.extend(tokens)
+                loc = end
+            else:
+                return loc
+
+    def parse_expansion(self, loc):
+        """
+        Parse an expansion.
+
+        The stack contains one entry for each open grouping: the closing character
+        (or None for the top level), the grouping's weight, the list of levels
+        waiting for the value of the level on their right and the end location of
+        each level. Levels are token lists like those used by the parser module's
+        root expansion element.
+
+        :returns: tuple (Expansion, end location)
+        """
+        s = self.string
+        stack = [(None, None, [], [])]
+        try:
+            while True:
+                # Parse an atom, opening any groupings.
+                weight, loc = self.parse_weight(loc)
+                i = self.skip(loc)
+                c = s[i:i+1]
+                if c in ("(", "[") and c:
+                    stack.append((")" if c == "(" else "]", weight, [], []))
+                    loc = i + 1
+                    continue
+                elif c == "<":
+                    atom, loc = self.parse_reference(i)
+                else:
+                    m = _word.match(s, i)
+                    if not m:
+                        raise self.error(i, "Expected expansion")
+                    atom, loc = self.parse_literal(m)
+
+                # Apply operators and handle the next level. Close groupings until
+                # there is another level to parse.
+                while True:
+                    if weight is not None:
+                        atom = WeightedExpansion(atom, weight)
+                    lst = [atom]
+                    loc = self.parse_operators(loc, lst)
+                    _, _, levels, ends = stack[-1]
+                    i = self.skip(loc)
+                    c = s[i:i+1]
+                    if c == "|" or c and (c in "<([/" or _word.match(s, i)):
+                        levels.append(lst)
+                        ends.append(loc)
+                        if c == "|":
+                            lst.append(c)
+                            weight, loc = self.parse_weight(i + 1)
+                            if weight is not None:
+                                lst.append(weight)
+                        break
+
+                    # Combine this grouping's levels from right to left.
+                    value = _finish_levels(lst, levels)
+                    closing, weight, _, _ = stack.pop()
+                    value = _materialize(value)
+                    if closing is None:
+                        return value, loc
+                    loc = self.expect(loc, closing)
+                    if closing == ")":
+                        atom = RequiredGrouping(value)
+                    else:
+                        atom = OptionalGrouping(value)
+        except ParseException:
+            result = self.unwind(stack)
+            if result is None:
+                raise
+            return result
+
+    @staticmethod
+    def unwind(stack):
+        """
+        Backtrack after a syntax error in the same way as the pyparsing parser.
+
+        When the next level of an expansion fails to parse, pyparsing combines the
+        levels parsed before it and goes on from where they end. This can raise
+        other errors or, at the top level, return an expansion. Inner groupings
+        always fail after this because their closing characters cannot be where
+        the failed level started.
+
+        :param stack: list
+        :returns: tuple (Expansion, end location) | None
+        """
+        while stack:
+            closing, _, levels, ends = stack.pop()
+            if not levels:
+                # The grouping's first atom failed to parse.
+                continue
+
+            # Discard the alternative set operator and weight tokens of the level
+            # whose next level failed to parse, if any.
+            lst, end = levels.pop(), ends.pop()
+            if "|" in lst:
+                del lst[lst.index("|"):]
+            value = _materialize(_finish_levels(lst, levels))
+            if closing is None:
+                return value, end
+
+    def parse_rule(self, loc):
+        """
+        Parse a rule definition.
+
+        If ``lazy_rules`` is set, only the rule's visibility and name are parsed.
+        The text of its expansion and line delimiters is kept until the rule's
+        expansion is first used.
+
+        :returns: tuple (Rule, end location)
+        """
+        i = self.skip(loc)
+        m = _public.match(self.string, i)
+        visible = bool(m)
+        if m:
+            i = m.end()
+        i = self.expect(i, "<")
+        m = self.match(_name, i, "rule name")
+        i = self.expect(self.expect(m.end(), ">"), "=")
+        if self.lazy_rules:
+            return self.scan_rule_body(m.group(), visible, i)
+        expansion, i = self.parse_expansion(i)
+        i = self.parse_line_delimiters(i)
+        return Rule(m.group(), visible, expansion), i
+
+    def scan_rule_body(self, name, visible, loc):
+        """
+        Find the end of a rule's expansion and line delimiters without parsing
+        them and return a rule that parses their text when it is first used.
+
+        Expansions end before the first semicolon that is not in a comment or a
+        rule name, or at the end of the string. The error that parsing the
+        expansion would raise is raised straight away if the text contains the
+        name and "=" of another rule definition, as the rule isn't terminated.
+
+        :returns: tuple (Rule, end location)
+        """
+        end = self.find_statement_end(loc)
+        if end == -1:
+            end = len(self.string)
+        header = self.find_rule_header(loc, end)
+        if header != -1:
+            raise self.error(header, "Expected line end")
+        source = _ExpansionSource(self.string[loc:end], _parse_rule_body)
+        i = self.match_line_delimiter(end)
+        while i is not None:
+            end = i
+            i = self.match_line_delimiter(end)
+        return Rule(name, visible, source), end
+
+    def parse_rules(self, loc, rules):
+        """
+        Parse rule definitions until one cannot be parsed, adding them to a list.
+        The error is raised if the list is empty.
+
+        :returns: tuple (list of rules, end location)
+        """
+        while True:
+            try:
+                rule, loc = self.parse_rule(loc)
+            except ParseException:
+                if not rules:
+                    raise
+                return rules, loc
+            rules.append(rule)
+
+    def parse_import(self, loc):
+        """
+        Parse an import statement.
+
+        :returns: tuple (Import, end location)
+        """
+        i = self.match(_import, loc, "\"import\"").end()
+        i = self.expect(i, "<")
+        m = self.match(_import_name, i, "import name")
+        i = self.parse_line_delimiters(self.expect(m.end(), ">"))
+        return Import(m.group()), i
+
+    def parse_header_line(self, loc):
+        """
+        Parse the grammar header line.
+
+        :returns: tuple ((version, character set, language), end location)
+        """
+        s = self.string
+
+        # Comments are not allowed before the line delimiter, except before the
+        # character set and language names.
+        i = _skip_whitespace.match(s, loc).end()
+        i = self.match(_header, i, "'#JSGF'", False).end()
+        i = _skip_whitespace.match(s, i).end()
+        m = self.match(_version, i, "version number", False)
+        version, i = m.group(), m.end()
+        header_words = []
+        for _ in range(2):
+            m = _word.match(s, self.skip(i))
+            header_words.append(m.group() if m else "")
+            if m:
+                i = m.end()
+        charset, language = header_words
+        i = self.parse_line_delimiters(i)
+
+        # Use the character set as the language instead if it is 2 characters long
+        # and no language was specified, like the parser module does.
+        if not language and len(charset) == 2:
+            language = charset
+            charset = ""
+        return (version[1:], charset, language), i
+
+    def parse_grammar_name(self, loc):
+        """
+        Parse the grammar name line.
+
+        :returns: tuple (name, end location)
+        """
+        i = self.expect(loc, "grammar")
+        m = self.match(_grammar_name, i, "grammar name")
+        return m.group(), self.parse_line_delimiters(m.end())
+
+    def split_rules(self, loc, size):
+        """
+        Split the string after a location into parts of at least ``size``
+        characters that start and end between rule definitions, unless the string
+        is invalid.
+
+        Parts end after a semicolon that is not in a comment or a rule name and
+        after any line delimiters following it.
+
+        :returns: list of (start, end) tuples
+        """
+        result = []
+        start = i = loc
+        while True:
+            i = self.find_statement_end(i)
+            if i == -1:
+                break
+            end = self.match_line_delimiter(i)
+            while end is not None:
+                i = end
+                end = self.match_line_delimiter(i)
+            if i - start >= size:
+                result.append((start, i))
+                start = i
+        if start < len(self.string) or not result:
+            result.append((start, len(self.string)))
+        return result
+
+    def parse_rules_in_workers(self, loc, workers):
+        """
+        Parse one or more rule definitions using a pool of worker processes.
+
+        Parts of the string are parsed in the worker processes. The first part
+        that cannot be parsed completely and the rest of the string are parsed in
+        the current process instead, so that errors are the same as when parsing
+        without worker processes.
+
+        :returns: tuple (list of rules, end location)
+        """
+        s = self.string
+        size = max((len(s) - loc) // (workers * 4), MIN_PART_SIZE)
+        parts = self.split_rules(loc, size)
+        if len(parts) < 2:
+            return self.parse_rules(loc, [])
+
+        # Receive the results for every part before closing the pool, even after
+        # a part fails. Terminating worker processes while parts are still being
+        # sent to them can leave the pool waiting forever.
+        rules = []
+        failed_loc = None
+        pool = multiprocessing.Pool(min(workers, len(parts)))
+        try:
+            results = pool.imap(_parse_rules_part,
+                                (s[start:end] for start, end in parts))
+            for (start, end), (data, stop) in zip(parts, results):
+                if failed_loc is not None:
+                    continue
+
+                # Stop using the results if the part has more than whitespace
+                # after the rules that could be parsed.
+                loc = start + stop
+                if _skip_whitespace.match(s, loc).end() < end:
+                    failed_loc = start
+                else:
+                    rules.extend(_decode_rules(data))
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        if failed_loc is not None:
+            return self.parse_rules(failed_loc, rules)
+        return rules, loc
+
+    def parse_grammar(self, workers=1):
+        """
+        Parse a grammar, using worker processes to parse the rules if ``workers``
+        is at least 2.
+
+        :returns: Grammar
+        """
+        values, i = self.parse_header_line(0)
+        name, i = self.parse_grammar_name(i)
+        header = GrammarHeader(*(values + (name,)))
+
+        # Parse import statements.
+        imports = []
+        while True:
+            try:
+                import_, i = self.parse_import(i)
+            except ParseException:
+                break
+            imports.append(import_)
+
+        # Parse one or more rules. Rules with unparsed expansions are quick to
+        # parse, so worker processes are not used for them.
+        if workers > 1 and not self.lazy_rules:
+            rules, i = self.parse_rules_in_workers(i, workers)
+        else:
+            rules, i = self.parse_rules(i, [])
+
+        # Create the grammar before checking for the end of the string so that
+        # errors are raised in the same order as the parser module.
+        result = _make_grammar(header, imports + rules)
+        self.expect_end(i, False)
+        return result
+
+
+class _StreamParser(_Parser):
+    """
+    Parser for reading grammar statements from a file in chunks.
+
+    Only the text that has not been parsed yet is kept in memory. Parse results are
+    only used once enough text has been read that more text could not change them.
+    Parse errors are raised with locations in the whole file.
+    """
+
+    def __init__(self, f, chunk_size, lazy_rules=False):
+        super(_StreamParser, self).__init__("", lazy_rules)
+        self.file = f
+        self.chunk_size = chunk_size
+        self.eof = False
+        self.loc = 0
+
+        # The number of characters and lines discarded so far, and the text
+        # discarded after the last discarded line.
+        self.discarded_chars = 0
+        self.discarded_lines = 0
+        self.discarded_line_start = ""
+
+    def read_more(self):
+        # Discard the parsed text and read more text from the file. The amount
+        # read grows with the length of the unparsed text so that long statements
+        # are not parsed too many times.
+        discarded = self.string[:self.loc]
+        self.discarded_chars += len(discarded)
+        lines = discarded.count("\n")
+        if lines:
+            self.discarded_lines += lines
+            self.discarded_line_start = discarded[discarded.rfind("\n") + 1:]
+        else:
+            self.discarded_line_start += discarded
+
+        s = self.string[self.loc:]
+        data = self.file.read(max(self.chunk_size, len(s)))
+        if not data:
+            self.eof = True
+        self.string = s + data
+        self.loc = 0
+
+    def is_complete(self, loc, end=None):
+        # Whether reading more text could change the result of parsing a
+        # statement at a location. If the parse succeeded, any line delimiters
+        # after the end location must also have been read.
+        if self.eof:
+            return True
+        statement_end = self.find_statement_end(loc)
+        if statement_end == -1:
+            return False
+        if end is None or end < statement_end:
+            return True
+        i = self.skip(end)
+        return i + 1 < len(self.string) and not self.string.startswith("/*", i)
+
+    def rebase_error(self, e):
+        """
+        Get a copy of a parse error for the unparsed text with its location in
+        the whole file.
+
+        The copy's string has the same number of characters and lines before the
+        unparsed text as the file, so its line and column numbers are the same as
+        they would be for the whole file.
+
+        :param e: ParseException
+        :returns: ParseException
+        """
+        line_start = self.discarded_line_start
+        padding = (self.discarded_chars - self.discarded_lines -
+                   len(line_start))
+        prefix = " " * padding + "\n" * self.discarded_lines + line_start
+        return ParseException(prefix + e.pstr, len(prefix) + e.loc, e.msg,
+                              e.parserElement)
+
+    def parse_next(self, method):
+        """
+        Parse the next statement at the current location using a method, reading
+        more text until the result is complete.
+
+        :returns: the parse result
+        """
+        while True:
+            try:
+                result, end = method(self.loc)
+            except ParseException as e:
+                # Raise the error if more text would not change the result.
+                if self.is_complete(self.loc):
+                    raise_from(self.rebase_error(e), None)
+            except (GrammarError, TypeError):
+                if self.is_complete(self.loc):
+                    raise
+            else:
+                if self.is_complete(self.loc, end):
+                    self.loc = end
+                    return result
+            self.read_more()
+
+    def iter_statements(self):
+        """
+        Parse the file, yielding the grammar header, imports and rules.
+        """
+        values = self.parse_next(self.parse_header_line)
+        name = self.parse_next(self.parse_grammar_name)
+        yield GrammarHeader(*(values + (name,)))
+
+        # Yield import statements.
+        while True:
+            try:
+                import_ = self.parse_next(self.parse_import)
+            except ParseException:
+                break
+            yield import_
+
+        # Yield one or more rules.
+        first = True
+        while True:
+            try:
+                rule = self.parse_next(self.parse_rule)
+            except ParseException:
+                if first:
+                    raise
+                break
+            first = False
+            yield rule
+
+        # Check that the rest of the file only contains whitespace.
+        s = self.string
+        while not self.eof and _skip_whitespace.match(s, self.loc).end() == len(s):
+            self.read_more()
+            s = self.string
+        try:
+            self.expect_end(self.loc, False)
+        except ParseException as e:
+            raise_from(self.rebase_error(e), None)
+
+
+def _parse_rule_body(s):
+    # Parse the expansion and line delimiters of a rule parsed with lazy_rules.
+    parser = _Parser(s)
+    expansion, end = parser.parse_expansion(0)
+    parser.expect_end(parser.parse_line_delimiters(end), False)
+    return expansion
+
+
+def _parse_rules_part(s):
+    # Parse the rules in part of a grammar string in a worker process. Return them
+    # in the compact form used by parse caches, which is faster to send back, and
+    # the location that parsing stopped at. Any error is raised again when the
+    # part is parsed in the main process.
+    parser = _Parser(s)
+    rules, i = [], 0
+    while True:
+        try:
+            rule, i = parser.parse_rule(i)
+        except Exception:
+            break
+        rules.append(rule)
+    return _encode_rules(rules), i
+
+
+def _make_grammar(header, statements):
+    # Create a Grammar object from a grammar header and imports and rules.
+    result = Grammar()
+    result.jsgf_version = header.jsgf_version
+    result.charset_name = header.charset_name
+    result.language_name = header.language_name
+    result.name = header.name
+    imports, rules = [], []
+    error = None
+    try:
+        for statement in statements:
+            if isinstance(statement, Import):
+                imports.append(statement)
+            else:
+                rules.append(statement)
+    except ParseException as e:
+        # Raise errors after the last rule once the rules have been added, like
+        # _Parser.parse_grammar() does.
+        error = e
+    result.add_imports(*imports)
+    result.add_rules(*rules)
+    if error is not None:
+        raise error
+    return result
+
+
+def parse_expansion_string(s):
+    """
+    Parse a string containing a JSGF expansion and return an ``Expansion`` object.
+
+    :param s: str
+    :returns: Expansion
+    :raises: ParseException, GrammarError
+    """
+    parser = _Parser(s)
+    expansion, end = parser.parse_expansion(0)
+    parser.expect_end(end)
+    return expansion
+
+
+def parse_rule_string(s):
+    """
+    Parse a string containing a JSGF rule definition and return a ``Rule`` object.
+
+    :param s: str
+    :returns: Rule
+    :raises: ParseException, GrammarError
+    """
+    parser = _Parser(s)
+    rule, end = parser.parse_rule(0)
+    parser.expect_end(end)
+    return rule
+
+
+def parse_grammar_string(s, lazy_rules=False):
+    """
+    Parse a JSGF grammar string and return a ``Grammar`` object with the defined
+    attributes, name, imports and rules.
+
+    If ``lazy_rules`` is ``True``, only the visibility and name of each rule are
+    parsed. The text of each rule's expansion is kept and parsed the first time
+    the expansion is used, for example when the rule is matched or compiled.
+    Errors in the text are raised then instead, with line and column numbers
+    relative to it. Rules that aren't terminated before the next rule definition
+    still raise an error straight away.
+
+    :param s: str
+    :param lazy_rules: bool
+    :returns: Grammar
+    :raises: ParseException, GrammarError
+    """
+    return _Parser(s, lazy_rules).parse_grammar()
+
+
+def valid_grammar(s):
+    """
+    Whether a string is a valid JSGF grammar string.
+
+    Note that this method will not return False for grammars that are otherwise
+    valid, but have out-of-scope imports.
+
+    :param s: str
+    :returns: bool
+    """
+    try:
+        parse_grammar_string(s)
+        return True
+    except (ParseException, GrammarError):
+        return False
+
+
+def iter_grammar_file(path, chunk_size=65536, lazy_rules=False):
+    """
+    Parse a JSGF grammar file incrementally, yielding a ``GrammarHeader`` tuple with
+    the grammar's header values and name, each ``Import`` object and then each
+    ``Rule`` object.
+
+    The file is read in chunks of roughly ``chunk_size`` characters and only the
+    text that has not been parsed yet is kept in memory. Errors in the file are
+    raised when they are reached.
+
+    If ``lazy_rules`` is ``True``, rule expansions are parsed the first time they
+    are used, as described in :func:`parse_grammar_string`.
+
+    :param path: str
+    :param chunk_size: int
+    :param lazy_rules: bool
+    :returns: generator
+    :raises: ParseException, GrammarError
+    """
+    with open(path, "r") as f:
+        parser = _StreamParser(f, chunk_size, lazy_rules)
+        for statement in parser.iter_statements():
+            yield statement
+
+
+def parse_grammar_file(path, lazy=False, cache_dir=None, workers=1,
+                       lazy_rules=False):
+    """
+    Parse a JSGF grammar file and a return a ``Grammar`` object with the defined
+    attributes, name, imports and rules.
+
+    This method will not attempt to import rules or grammars defined in other files,
+    that should be done by an import resolver, not a parser.
+
+    If ``lazy`` is ``True``, the file is read and parsed one statement at a time
+    using :func:`iter_grammar_file` instead of all at once.
+
+    If ``cache_dir`` is not ``None``, the grammar is loaded from a
+    :class:`~jsgf.parse_cache.ParseCache` in that directory if the file is
+    unchanged, and stored in it otherwise.
+
+    If ``workers`` is at least 2, the rule definitions are split into parts and
+    parsed in a pool of that many worker processes. ``lazy`` is ignored in
+    this case. Rules are added to the grammar in the same order and errors are
+    raised with the same line and column numbers as when parsing without worker
+    processes.
+
+    If ``lazy_rules`` is ``True``, rule expansions are parsed the first time they
+    are used, as described in :func:`parse_grammar_string`. ``workers`` is
+    ignored in this case. Cache entries store the text of expansions that have
+    not been parsed.
+
+    :param path: str
+    :param lazy: bool
+    :param cache_dir: str | None
+    :param workers: int
+    :param lazy_rules: bool
+    :returns: Grammar
+    :raises: ParseException, GrammarError
+    """
+    if cache_dir is not None:
+        from .parse_cache import ParseCache, _parse_expansions
+        result = ParseCache(cache_dir).parse_grammar_file(
+            path, lambda p: parse_grammar_file(p, lazy, workers=workers,
+                                               lazy_rules=lazy_rules)
+        )
+        if not lazy_rules:
+            _parse_expansions(result)
+        return result
+
+    if lazy and (workers < 2 or lazy_rules):
+        statements = iter_grammar_file(path, lazy_rules=lazy_rules)
+        return _make_grammar(next(statements), statements)
+
+    with open(path, "r") as f:
+        content = f.read()
+
+    return _Parser(content, lazy_rules).parse_grammar(workers)
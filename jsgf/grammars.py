@@ -3,13 +3,21 @@ This module contains classes for compiling, importing from and matching JSpeech
 Grammar Format grammars.
 """
 
+import collections
 import os
+import threading
 
-from six import string_types
+from six import string_types, get_unbound_function
 
 from . import references
-from .rules import Rule
+from .automata import AutomatonSet, MatchingBackend, _defer_match_data, \
+    _set_deferred_match_data
+from .batches import DEFAULT_CHUNK_SIZE, match_many
+from .expansions import Literal, NamedRuleRef, NullRef, Repeat, \
+    flat_map_expansion, map_expansion
+from .rules import Rule, _get_bounds_words
 from .errors import GrammarError, JSGFImportError
+from .vocabulary import Vocabulary, _get_speech_words
 
 
 class Import(references.BaseRef):
@@ -35,6 +43,16 @@ class Import(references.BaseRef):
     #: Default file extensions to consider during import resolution.
     grammar_file_exts = (".jsgf", ".jgram")
 
+    #: Directory of the :class:`~jsgf.parse_cache.ParseCache` used to avoid parsing
+    #: unchanged grammar files again during import resolution, or ``None`` to
+    #: always parse them.
+    parse_cache_dir = None
+
+    #: Whether to only parse the expansions of the rules of grammar files when
+    #: they are first used, for example when only a few of their rules are
+    #: imported.
+    lazy_rules = False
+
     def __init__(self, name):
         super(Import, self).__init__(name)
 
@@ -95,13 +113,17 @@ class Import(references.BaseRef):
             grammar_path1 = grammar_name + file_ext
             grammar_path2 = os.path.join(*grammar_name.split(".")) + file_ext
             if os.path.isfile(grammar_path1):
-                result = parse_grammar_file(grammar_path1)
+                result = parse_grammar_file(grammar_path1,
+                                            cache_dir=self.parse_cache_dir,
+                                            lazy_rules=self.lazy_rules)
                 break
 
             # Look for the file in sub-directories based on the grammar's full
             # name.
             elif os.path.isfile(grammar_path2):
-                result = parse_grammar_file(grammar_path2)
+                result = parse_grammar_file(grammar_path2,
+                                            cache_dir=self.parse_cache_dir,
+                                            lazy_rules=self.lazy_rules)
                 break
 
         # The grammar file doesn't exist, so raise an error.
@@ -178,7 +200,430 @@ class Import(references.BaseRef):
 
     @staticmethod
     def valid(name):
-        return references.import_name.matches(name)
+        return references.import_name_matcher.matches(name)
+
+
+def _uses_rule_matches(rule):
+    # Whether a rule uses the Rule.matches() method instead of an override.
+    return (get_unbound_function(type(rule).matches) is
+            get_unbound_function(Rule.matches))
+
+
+def _iter_match_expansions(rules):
+    # Yield each distinct expansion used by the rules, including expansions of
+    # referenced rules.
+    seen = set()
+    stack = [r.expansion for r in rules]
+    while stack:
+        e = stack.pop()
+        if id(e) in seen:
+            continue
+        seen.add(id(e))
+        yield e
+        if isinstance(e, NamedRuleRef):
+            try:
+                stack.append(e.referenced_rule.expansion)
+            except GrammarError:
+                pass
+        else:
+            stack.extend(e.children)
+
+
+def _reset_match_data(rules):
+    # Reset the match data of each distinct expansion used by the rules,
+    # including expansions of referenced rules.
+    for e in _iter_match_expansions(rules):
+        e.reset_match_data()
+
+
+def _save_match_data(rules):
+    # Get the match data of each distinct expansion used by the rules so that it
+    # can be restored later by _restore_match_data().
+    _set_deferred_match_data()
+    result = []
+    for e in _iter_match_expansions(rules):
+        repetitions = None
+        if isinstance(e, Repeat):
+            repetitions = list(e._repetitions_matched)
+        result.append((e, e._current_match, e._matching_slice, repetitions))
+    return result
+
+
+def _restore_match_data(match_data):
+    _set_deferred_match_data()
+    for e, current_match, matching_slice, repetitions in match_data:
+        e._current_match = current_match
+        e._matching_slice = matching_slice
+        if repetitions is not None:
+            e._repetitions_matched = list(repetitions)
+
+
+def _find_matching_rule_names(grammar, speech):
+    # Find the names of the rules matching speech. This is used for matching in
+    # worker processes.
+    return [r.name for r in grammar.find_matching_rules(speech)]
+
+
+def _matches_any_speech(rule):
+    # Rule.matches() returns True for any speech if the rule's expansion is
+    # optional or <NULL> because its current_match value cannot be None.
+    expansion = rule.expansion
+    return expansion.is_optional or isinstance(expansion, NullRef)
+
+
+#: Named tuple of the statistics returned by :attr:`Grammar.match_cache_info`.
+MatchCacheInfo = collections.namedtuple("MatchCacheInfo",
+                                        "hits misses max_size size")
+
+#: Named tuple of the statistics returned by :attr:`Grammar.prefilter_info`.
+PrefilterInfo = collections.namedtuple("PrefilterInfo", "checks pruned")
+
+
+class _MatchCache(object):
+    """
+    Least recently used cache of ``Grammar.find_matching_rules`` results and the
+    match data of the rules that were matched.
+
+    Entries are only used for the grammar generation they were added for. The
+    cache is cleared when the generation changes.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        self._entries.clear()
+
+    def get(self, key, generation):
+        """
+        Get the value for a key and mark it as recently used, or return None if
+        there is no value for the key and generation.
+
+        :param key: hashable key
+        :param generation: int
+        :returns: object | None
+        """
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, generation, value):
+        """
+        Add a value for a key and generation, removing the least recently used
+        entry if the cache is full.
+
+        :param key: hashable key
+        :param generation: int
+        :param value: object
+        """
+        if generation != self._generation:
+            return
+
+        self._entries[key] = value
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class MatchStream(object):
+    """
+    Object for matching speech with the rules of a grammar one word at a time,
+    such as the words of partial speech recognition hypotheses.
+
+    Matching state is kept between words, so each word takes time proportional
+    to the number of ways the rules can still match instead of the number of
+    words so far. Rules are matched with the automaton matching backend.
+
+    Streams are created by :meth:`Grammar.begin_stream`.
+    """
+
+    def __init__(self, rules, automaton_set, grammar=None):
+        """
+        :param rules: list of rules
+        :param automaton_set: AutomatonSet of the rules' automata
+        :param grammar: grammar whose vocabulary is used for word IDs
+        """
+        self.rules = list(rules)
+        self._stream = automaton_set.begin_stream()
+        self._grammar = grammar
+
+    @property
+    def words(self):
+        """
+        The words fed to this stream so far.
+
+        :returns: list
+        """
+        return self._stream.words
+
+    @property
+    def speech(self):
+        """
+        The words fed to this stream so far, separated by spaces.
+
+        :returns: str
+        """
+        return self._stream.speech
+
+    def feed(self, words):
+        """
+        Match one or more whitespace-separated words, or a sequence of words or
+        word IDs from the grammar's vocabulary.
+
+        :param words: str | sequence of words or word IDs
+        """
+        self._stream.feed(_get_speech_words(words, self._grammar))
+
+    @property
+    def viable_rules(self):
+        """
+        The rules that match the words so far or that could match them followed
+        by more words.
+
+        :returns: list
+        """
+        viable = set(self._stream.viable)
+        return [r for i, r in enumerate(self.rules)
+                if i in viable or _matches_any_speech(r)]
+
+    @property
+    def matching_rules(self):
+        """
+        The rules that match the words so far.
+
+        These are the rules that :meth:`Grammar.find_matching_rules` would return
+        for the words so far.
+
+        :returns: list
+        """
+        matched = set(self._stream.matched) if self._stream.words else ()
+        return [r for i, r in enumerate(self.rules)
+                if i in matched or _matches_any_speech(r)]
+
+    def match(self):
+        """
+        Get a list of ``MatchResult`` objects for the rules that match the words
+        so far, like :meth:`Grammar.match` does.
+
+        :returns: list
+        """
+        return [m for m in self._stream.match() if m is not None]
+
+
+class _ReferenceIndex(object):
+    """
+    Index of the ``NamedRuleRef`` expansions in the rules of a grammar by the
+    names they reference.
+
+    Rules are indexed lazily. Added rules are only scanned again if their
+    version has changed since they were last scanned. Rules with unparsed
+    expansions are not scanned until they are added again after being parsed,
+    as none of their references can have been used yet.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._references = {}
+        self._pending = {}
+        self._unparsed = {}
+
+    def __getstate__(self):
+        # Rules are indexed by ID, so only keep the rules and index them again
+        # after unpickling.
+        rules = [rule for rule, _, _ in self._entries.values()]
+        rules.extend(self._pending.values())
+        rules.extend(self._unparsed.values())
+        return {"rules": rules}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for rule in state["rules"]:
+            self._pending[id(rule)] = rule
+
+    def add(self, rule):
+        """
+        Add a rule to the index or index it again if it has changed.
+
+        :param rule: Rule
+        """
+        key = id(rule)
+        self._unparsed.pop(key, None)
+        self._pending[key] = rule
+
+    def remove(self, rule):
+        """
+        Remove a rule from the index.
+
+        :param rule: Rule
+        """
+        key = id(rule)
+        self._pending.pop(key, None)
+        self._unparsed.pop(key, None)
+        _, _, references = self._entries.pop(key, (None, None, ()))
+        for x in references:
+            refs = self._references[x.name]
+            refs.pop(id(x))
+            if not refs:
+                self._references.pop(x.name)
+
+    def _index_rule(self, key, rule):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == rule._version:
+            return
+
+        self.remove(rule)
+        references = []
+        def process(x):
+            if isinstance(x, NamedRuleRef):
+                references.append(x)
+                self._references.setdefault(x.name, {})[id(x)] = x
+
+        map_expansion(rule.expansion, process, shallow=True)
+        self._entries[key] = (rule, rule._version, references)
+
+    def references(self, name):
+        """
+        Get a list of the indexed references to a rule name.
+
+        :param name: str
+        :returns: list
+        """
+        while self._pending:
+            key, rule = self._pending.popitem()
+            if rule._expansion_source is not None:
+                self.remove(rule)
+                self._unparsed[key] = rule
+            else:
+                self._index_rule(key, rule)
+        return list(self._references.get(name, {}).values())
+
+
+class _FirstWordIndex(object):
+    """
+    Index of the rules in a grammar by the words that speech matching them can
+    start with.
+
+    Rules are indexed lazily using ``Expansion._get_first_words``. Rules that can
+    start with any word, such as rules using ``Dictation`` expansions, are always
+    candidates.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._words = {}
+        self._any_word = {}
+        self._nullable = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        #: Names of references that could not be resolved while indexing.
+        self.unresolved_names = set()
+
+    def __getstate__(self):
+        # Rules are indexed by ID, so only keep the rules and index them again
+        # after unpickling.
+        rules = [rule for rule, _ in self._entries.values()]
+        rules.extend(self._pending.values())
+        return {"rules": rules, "unresolved_names": self.unresolved_names}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for rule in state["rules"]:
+            self._pending[id(rule)] = rule
+        self.unresolved_names = state["unresolved_names"]
+
+    def __contains__(self, rule):
+        return id(rule) in self._entries or id(rule) in self._pending
+
+    def add(self, rule):
+        """
+        Add a rule to the index or re-index it.
+
+        :param rule: Rule
+        """
+        self.remove(rule)
+        self._pending[id(rule)] = rule
+
+    def remove(self, rule):
+        """
+        Remove a rule from the index.
+
+        :param rule: Rule
+        """
+        key = id(rule)
+        self._pending.pop(key, None)
+        self._any_word.pop(key, None)
+        self._nullable.pop(key, None)
+        _, words = self._entries.pop(key, (None, ()))
+        for word in words:
+            rules = self._words[word]
+            rules.pop(key)
+            if not rules:
+                self._words.pop(word)
+
+    def _index_pending(self):
+        # Index pending rules. This is locked so that rules can be matched from
+        # several threads at once.
+        if not self._pending:
+            return
+        with self._lock:
+            while self._pending:
+                key, rule = next(iter(self._pending.items()))
+                self._index_rule(key, rule)
+                self._pending.pop(key)
+
+    def _index_rule(self, key, rule):
+        try:
+            words, nullable, any_word = \
+                rule.expansion._get_first_words((rule,))
+        except GrammarError:
+            # Allow any word if the rule's expansion is invalid. Matching will
+            # raise the error instead.
+            words, nullable, any_word = frozenset(), True, True
+
+        if _matches_any_speech(rule):
+            nullable, any_word = True, True
+
+        self._entries[key] = (rule, words)
+        for word in words:
+            self._words.setdefault(word, {})[key] = rule
+        if any_word:
+            self._any_word[key] = rule
+        if nullable:
+            self._nullable[key] = rule
+
+    def candidates(self, speech):
+        """
+        Get a dictionary of IDs to indexed rules that could match a speech string.
+
+        :param speech: str | tuple of words
+        :returns: dict
+        """
+        self._index_pending()
+        if isinstance(speech, string_types):
+            words = speech.split(None, 1)
+        else:
+            words = speech
+        if not words:
+            return dict(self._nullable)
+        result = dict(self._any_word)
+        result.update(self._words.get(words[0].lower(), {}))
+        return result
 
 
 class Grammar(references.BaseRef):
@@ -211,6 +656,59 @@ class Grammar(references.BaseRef):
         self.jsgf_version, self.charset_name, self.language_name =\
             self.default_header_values
         self._case_sensitive = case_sensitive
+        self._matching_backend = MatchingBackend.Pyparsing
+        self._lazy_match_data = False
+        self._automaton_set = None
+        self._first_word_index = _FirstWordIndex()
+        self._reference_index = _ReferenceIndex()
+        self._match_cache = None
+        self._match_memo_size = 0
+        self._vocabulary = None
+
+        # Number of times rules were checked against speech using their match
+        # bounds and the number of times they were rejected.
+        self._prefilter_checks = 0
+        self._prefilter_pruned = 0
+
+        # Names of rules changed since references were last invalidated.
+        self._changed_names = set()
+
+        # Names of the grammar's rules while add_rules() is adding rules. This is
+        # used to check for duplicate names without listing them for each rule.
+        self._adding_rule_names = None
+
+        # Number of changes to the grammar or its rules that could change the
+        # results of matching. This is used to invalidate cached results.
+        self._generation = 0
+
+    def _changed(self):
+        # Record a change that could change matching results. Deferred match data
+        # is set first because it may depend on the grammar's rules.
+        _set_deferred_match_data()
+        self._generation += 1
+
+    def _expansion_changed(self, rule):
+        # Index a rule whose expansion has changed again and invalidate references
+        # to it before they are next used for matching.
+        self._first_word_index.add(rule)
+        self._reference_index.add(rule)
+        self._changed_names.add(rule.name)
+        self._changed()
+
+    def _expansion_parsed(self, rule):
+        # Index a rule whose unparsed expansion has been parsed. Matching results
+        # are unchanged.
+        self._reference_index.add(rule)
+
+    def _update_references(self):
+        # Invalidate the references to each changed rule that have been used for
+        # matching. Invalidating a reference changes its rule, so repeat until
+        # there are no more changed rules.
+        names = self._changed_names
+        while names:
+            for x in self._reference_index.references(names.pop()):
+                if x._matcher_cached:
+                    x.invalidate_matcher()
 
     @property
     def jsgf_header(self):
@@ -233,7 +731,7 @@ class Grammar(references.BaseRef):
 
     @staticmethod
     def valid(name):
-        return references.grammar_name.matches(name)
+        return references.grammar_name_matcher.matches(name)
 
     @property
     def case_sensitive(self):
@@ -257,6 +755,210 @@ class Grammar(references.BaseRef):
         for rule in self.rules:
             rule.case_sensitive = value
 
+    @property
+    def matching_backend(self):
+        """
+        The backend used to match speech with this grammar's rules.
+
+        This property can be ``MatchingBackend.Pyparsing`` (the default),
+        ``MatchingBackend.Automaton``, ``MatchingBackend.Chart`` or
+        ``MatchingBackend.Regex``. The automaton backend compiles each rule's
+        expansion tree into a token-level automaton and is much faster for large
+        rules. The chart backend memoizes the results of matching each expansion
+        at each word position and can also match rules that reference themselves.
+        The regular expression backend compiles each rule's expansion tree into
+        one pattern for Python's ``re`` module, which is fastest for rules
+        without ``Dictation`` expansions, and uses automata or chart parsers for
+        other rules. Each backend sets the same match data, such as
+        ``current_match`` and ``matching_slice`` values, except that the
+        automaton, chart and regular expression backends can also match
+        ambiguous rule expansions.
+
+        :rtype: int
+        :returns: matching backend
+        """
+        return self._matching_backend
+
+    @matching_backend.setter
+    def matching_backend(self, value):
+        if value not in (MatchingBackend.Pyparsing, MatchingBackend.Automaton,
+                         MatchingBackend.Chart, MatchingBackend.Regex):
+            raise ValueError("matching_backend should be %d for pyparsing, %d for "
+                             "automata, %d for chart parsers or %d for regular "
+                             "expressions"
+                             % (MatchingBackend.Pyparsing,
+                                MatchingBackend.Automaton,
+                                MatchingBackend.Chart,
+                                MatchingBackend.Regex))
+        self._matching_backend = value
+        self._changed()
+
+    @property
+    def lazy_match_data(self):
+        """
+        Whether to defer setting the match data of rule expansions until it is
+        used.
+
+        If this property is True, the ``matches`` method of this grammar's rules
+        and :meth:`find_matching_rules` only record which words were matched if
+        the grammar uses the automaton, chart or regular expression matching
+        backend. Values such as ``current_match``, ``matching_slice`` and
+        repetition data are set for each expansion the first time that the match
+        data of any expansion is used or changed. This makes matching faster when only the matching rules
+        are needed. Match data is the same as if it were set straight away.
+
+        The pyparsing matching backend always sets match data straight away.
+
+        The default value is False.
+
+        :rtype: bool
+        """
+        return self._lazy_match_data
+
+    @lazy_match_data.setter
+    def lazy_match_data(self, value):
+        self._lazy_match_data = bool(value)
+
+    @property
+    def match_cache_size(self):
+        """
+        Maximum number of results that :meth:`find_matching_rules` will cache.
+
+        The cache maps speech strings, with leading and trailing whitespace
+        removed, or sequences of words to the matching rules and the match data of each matched rule.
+        Match data is restored when a cached result is used. The least recently
+        used result is removed when the cache is full.
+
+        Cached results are not used after a rule is added, removed, enabled,
+        disabled or has its expansion or case sensitivity changed.
+
+        The default value is 0, which disables the cache. Setting this property
+        clears the cache.
+
+        :rtype: int
+        :returns: maximum cache size
+        """
+        if self._match_cache is None:
+            return 0
+        return self._match_cache.max_size
+
+    @match_cache_size.setter
+    def match_cache_size(self, value):
+        if value < 0:
+            raise ValueError("match_cache_size cannot be negative")
+        if value == 0:
+            self._match_cache = None
+        else:
+            self._match_cache = _MatchCache(value)
+
+    @property
+    def match_memo_size(self):
+        """
+        Maximum number of results of matching referenced rules that are memoized
+        while matching speech with the pyparsing backend.
+
+        Rules that reference the same rules many times can match the referenced
+        rules at the same positions in speech many times while trying
+        alternatives. If this property is greater than 0, the result of matching
+        each referenced rule at each position is kept, along with the match data
+        it sets, and is used again instead of matching the rule again. Results are
+        only kept while one speech string is matched and the oldest result is
+        removed when there are too many. pyparsing's global packrat setting is
+        not changed.
+
+        The default value is 0, which disables memoization.
+
+        :rtype: int
+        :returns: maximum number of memoized results
+        """
+        return self._match_memo_size
+
+    @match_memo_size.setter
+    def match_memo_size(self, value):
+        if value < 0:
+            raise ValueError("match_memo_size cannot be negative")
+        self._match_memo_size = value
+
+    @property
+    def match_cache_info(self):
+        """
+        Statistics for the :meth:`find_matching_rules` cache.
+
+        :returns: MatchCacheInfo named tuple of the number of hits, the number of
+            misses, the maximum size and the current size of the cache
+        :rtype: MatchCacheInfo
+        """
+        cache = self._match_cache
+        if cache is None:
+            return MatchCacheInfo(0, 0, 0, 0)
+        return MatchCacheInfo(cache.hits, cache.misses, cache.max_size,
+                              len(cache))
+
+    @property
+    def prefilter_info(self):
+        """
+        Statistics for the match bounds checks done by :meth:`find_matching_rules`
+        and ``Rule.matches``.
+
+        Each rule's minimum and maximum number of words and the words that every
+        match of the rule contains are calculated when the rule is first matched.
+        Speech outside of these bounds is rejected without matching. Match bounds
+        are only checked if the automaton, chart or regular expression matching
+        backend is used.
+
+        :returns: PrefilterInfo named tuple of the number of checks and the number
+            of times a rule was rejected
+        :rtype: PrefilterInfo
+        """
+        return PrefilterInfo(self._prefilter_checks, self._prefilter_pruned)
+
+    def reset_prefilter_info(self):
+        """
+        Reset the statistics returned by :attr:`prefilter_info`.
+        """
+        self._prefilter_checks = 0
+        self._prefilter_pruned = 0
+
+    def _count_prefilter_checks(self, checks, pruned):
+        self._prefilter_checks += checks
+        self._prefilter_pruned += pruned
+
+    def clear_match_cache(self):
+        """
+        Remove each result cached by :meth:`find_matching_rules`.
+        """
+        if self._match_cache is not None:
+            self._match_cache.clear()
+
+    @property
+    def vocabulary(self):
+        """
+        Table of words and integer word IDs used for matching speech given as a
+        sequence of word IDs.
+
+        The vocabulary is created when this property is first used and contains
+        the words of the literals of this grammar's rules at that time. Words are
+        added by :py:meth:`~jsgf.vocabulary.Vocabulary.encode` as necessary. The
+        same vocabulary can be used by several grammars by setting this property.
+
+        :returns: Vocabulary
+        """
+        if self._vocabulary is None:
+            vocabulary = Vocabulary()
+            for rule in self.rules:
+                for e in flat_map_expansion(rule.expansion):
+                    if isinstance(e, Literal):
+                        for word in e.text.split():
+                            vocabulary.add(word)
+            self._vocabulary = vocabulary
+        return self._vocabulary
+
+    @vocabulary.setter
+    def vocabulary(self, value):
+        if not isinstance(value, Vocabulary):
+            raise TypeError("vocabulary must be a Vocabulary object")
+        self._vocabulary = value
+
     def compile(self):
         """
         Compile this grammar's header, imports and rules into a string that can be
@@ -443,6 +1145,13 @@ class Grammar(references.BaseRef):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_automaton_set'] = None
+        if self._match_cache is not None:
+            state['_match_cache'] = _MatchCache(self._match_cache.max_size)
+        return state
+
     def add_rules(self, *rules):
         """
         Add multiple rules to the grammar.
@@ -453,8 +1162,14 @@ class Grammar(references.BaseRef):
         :param rules: rules
         :raises: GrammarError
         """
-        for r in rules:
-            self.add_rule(r)
+        # Rules cannot be renamed while they are being added, so the names of
+        # existing and added rules can be kept in a set.
+        self._adding_rule_names = set(self.rule_names)
+        try:
+            for r in rules:
+                self.add_rule(r)
+        finally:
+            self._adding_rule_names = None
 
     def add_imports(self, *imports):
         """
@@ -479,7 +1194,10 @@ class Grammar(references.BaseRef):
             raise TypeError("object '%s' was not a JSGF Rule object" % rule)
 
         # Check if the same rule is already in the grammar.
-        if rule.name in self.rule_names:
+        rule_names = self._adding_rule_names
+        if rule_names is None:
+            rule_names = self.rule_names
+        if rule.name in rule_names:
             if rule in self.rules:
                 # Silently return if the rule is comparable to another in the
                 # grammar.
@@ -492,7 +1210,22 @@ class Grammar(references.BaseRef):
         rule.case_sensitive = self.case_sensitive
 
         self._rules.append(rule)
+        if self._adding_rule_names is not None:
+            self._adding_rule_names.add(rule.name)
         rule.grammar = self
+        self._first_word_index.add(rule)
+        self._reference_index.add(rule)
+        self._changed_names.add(rule.name)
+        self._retry_unresolved_first_words()
+        self._changed()
+
+    def _retry_unresolved_first_words(self):
+        # Re-index rules with references that could not be resolved while indexing
+        # by invalidating the references.
+        names = self._first_word_index.unresolved_names
+        self._changed_names.update(names)
+        names.clear()
+        self._update_references()
 
     def add_import(self, _import):
         """
@@ -505,15 +1238,233 @@ class Grammar(references.BaseRef):
 
         if _import not in self._imports:
             self._imports.append(_import)
+            self._retry_unresolved_first_words()
+            self._changed()
 
     def find_matching_rules(self, speech):
         """
         Find each visible rule in this grammar that matches the `speech` string.
 
-        :param speech: str
+        If the grammar uses the automaton, chart or regular expression matching
+        backend, rules are only matched if they can start with the first word of
+        `speech`. This is checked using an index of the words that each rule can
+        start with. Rules are also skipped if `speech` has too few or too many
+        words for them or is missing a word that every match requires. See
+        :attr:`prefilter_info`. Match data is reset for any skipped rules that
+        matched previously. The pyparsing backend doesn't match speech word by
+        word, so every rule is matched if it is used.
+
+        If the grammar uses the automaton matching backend, every rule is matched
+        in one pass over the words of `speech`.
+
+        Results are cached if :attr:`match_cache_size` is set. Match data is set
+        when it is next used if :attr:`lazy_match_data` is set.
+
+        Speech can also be a sequence of words or of word IDs from
+        :attr:`vocabulary`, which is matched without splitting strings.
+
+        :param speech: str | sequence of words or word IDs
+        :returns: list
+        """
+        speech = _get_speech_words(speech, self)
+        self._update_references()
+        rules = [r for r in self.match_rules if r.visible]
+
+        # Skip rules that cannot start with the first word of speech and rules
+        # that speech is outside of the match bounds of. Rules that aren't indexed
+        # or that override Rule.matches() are never skipped, nor are rules that
+        # match any speech. The index is only used with backends that match
+        # speech word by word; pyparsing can match words that are run together.
+        token_based = self._matching_backend != MatchingBackend.Pyparsing
+        index = self._first_word_index
+        candidates = index.candidates(speech) if token_based else None
+        bounds_words = _get_bounds_words(speech)
+        tried, skipped, bounded = [], [], set()
+        checks, pruned = 0, 0
+        cacheable = self._match_cache is not None
+        lazy = self._lazy_match_data and \
+            self._matching_backend != MatchingBackend.Pyparsing
+        for r in rules:
+            uses_rule_matches = _uses_rule_matches(r)
+            if r not in index or not uses_rule_matches:
+                tried.append(r)
+                cacheable = cacheable and uses_rule_matches
+                continue
+
+            # Match bounds are also only checked with word-based backends, like
+            # Rule.matches() does.
+            candidate = not token_based or id(r) in candidates
+            if candidate and token_based and not _matches_any_speech(r):
+                checks += 1
+                if r._within_match_bounds(bounds_words):
+                    bounded.add(id(r))
+                else:
+                    pruned += 1
+                    candidate = False
+            if candidate:
+                tried.append(r)
+            elif lazy or r.was_matched:
+                skipped.append(r)
+        self._count_prefilter_checks(checks, pruned)
+
+        # Checking whether skipped rules matched would set deferred match data,
+        # so defer checking and resetting them instead.
+        if lazy and skipped:
+            _defer_match_data([r.expansion for r in skipped],
+                              lambda: _reset_match_data(
+                                  [r for r in skipped if r.was_matched]),
+                              replaces=False)
+        else:
+            _reset_match_data(skipped)
+
+        # Use a cached result if there is one. Results are not cached if any rule
+        # overrides Rule.matches() because such rules may keep their own state.
+        if cacheable:
+            key = (speech.strip() if isinstance(speech, string_types) else speech,
+                   tuple(map(id, tried)))
+            generation = self._generation
+            cached = self._match_cache.get(key, generation)
+            if cached is not None:
+                result, match_data = cached
+                _restore_match_data(match_data)
+                return list(result)
+
+            # Otherwise reset the match data of the active rules to try, including
+            # referenced rules, so that the saved match data doesn't depend on
+            # earlier matches.
+            active = [r for r in tried if r.active]
+            _reset_match_data(active)
+
+        if self._matching_backend == MatchingBackend.Automaton:
+            result = self._find_matching_rules_at_once(rules, tried, speech,
+                                                       lazy)
+        else:
+            # Match bounds have already been checked for the rules in 'bounded'.
+            result = [r for r in tried
+                      if (r._matches(speech, False) if id(r) in bounded
+                          else r.matches(speech))]
+
+        if cacheable:
+            self._match_cache.put(key, generation,
+                                  (tuple(result), _save_match_data(active)))
+        return result
+
+    def find_matching_rules_many(self, speech_strings, workers=None,
+                                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Find the visible rules in this grammar that match each string of an
+        iterable and yield a list of matching rules for each string in order.
+
+        Large batches are matched using a pool of worker processes which each
+        receive a copy of this grammar once. Match data is not set for strings
+        matched in worker processes. Small batches are matched in this process
+        using :meth:`find_matching_rules`.
+
+        :param speech_strings: iterable of speech strings
+        :param workers: number of worker processes to use (default: the number of
+            CPUs)
+        :param chunk_size: number of speech strings to send to a worker process at
+            a time
+        :returns: generator
+        """
+        rules = dict((r.name, r) for r in self.match_rules)
+        for names in match_many(self, _find_matching_rule_names, speech_strings,
+                                workers, chunk_size):
+            yield [rules[name] for name in names]
+
+    def match(self, speech):
+        """
+        Match speech with each visible rule in this grammar and return a list of
+        ``MatchResult`` objects for the rules that matched.
+
+        Unlike :meth:`find_matching_rules`, this method doesn't set match data on
+        rule expansions, so a grammar can be matched from several threads at once.
+        Speech is matched with the chart matching backend if this grammar uses it
+        and with the automaton matching backend otherwise.
+
+        :param speech: str | sequence of words or word IDs
         :returns: list
         """
-        return [r for r in self.match_rules if r.visible and r.matches(speech)]
+        speech = _get_speech_words(speech, self)
+        self._update_references()
+        rules = [r for r in self.match_rules if r.visible]
+
+        # Only skip rules using the first word index if the grammar's backend
+        # matches speech word by word, like find_matching_rules() does.
+        if self._matching_backend != MatchingBackend.Pyparsing:
+            index = self._first_word_index
+            candidates = index.candidates(speech)
+            tried = [r for r in rules if id(r) in candidates or r not in index]
+        else:
+            tried = rules
+
+        # Match the rules to try in one pass like find_matching_rules() does,
+        # unless the chart backend is used.
+        matched = {}
+        if self._matching_backend != MatchingBackend.Chart:
+            combined, automaton_set = self._get_automaton_set(rules)
+            tried_ids = set(map(id, tried))
+            indices = [i for i, r in enumerate(combined) if id(r) in tried_ids]
+            matched = dict(zip(map(id, combined),
+                               automaton_set.match(speech, indices)))
+        result = []
+        for r in tried:
+            m = matched[id(r)] if id(r) in matched else r.match(speech)
+            if m is not None:
+                result.append(m)
+        return result
+
+    def begin_stream(self):
+        """
+        Start matching speech with the visible rules of this grammar one word at a
+        time.
+
+        Only rules that use the ``Rule.matches`` method are matched. Changes made
+        to the grammar or its rules after this method is called are not used by
+        the stream.
+
+        :returns: MatchStream
+        """
+        self._update_references()
+        rules = [r for r in self.match_rules if r.visible]
+        combined, automaton_set = self._get_automaton_set(rules)
+        return MatchStream(combined, automaton_set, self)
+
+    def _get_automaton_set(self, rules):
+        # Get the active rules that use Rule.matches() and a combined automaton of
+        # the rules. The automaton is created if the rules or their automata have
+        # changed since it was last used.
+        combined = [r for r in rules if r.active and _uses_rule_matches(r)]
+        automata = [r.expansion._get_automaton() for r in combined]
+        automaton_set = self._automaton_set
+        if automaton_set is None or not automaton_set.uses(automata):
+            automaton_set = AutomatonSet(automata)
+            self._automaton_set = automaton_set
+        return combined, automaton_set
+
+    def _find_matching_rules_at_once(self, rules, tried, speech, defer=False):
+        # Match the rules to try that are active and use Rule.matches() in one pass
+        # using a combined automaton of every such rule. Other rules are matched
+        # separately in the same order.
+        combined, automaton_set = self._get_automaton_set(rules)
+
+        # Rule.matches() returns False for empty matches of required expansions
+        # and True for rules that match any speech, so do the same here.
+        tried_ids = set(map(id, tried))
+        indices = [i for i, r in enumerate(combined) if id(r) in tried_ids]
+        matched = automaton_set.matches(speech, indices, defer)
+        non_empty = bool(speech.strip() if isinstance(speech, string_types)
+                         else speech)
+        matched = dict((id(r), (m and non_empty) or _matches_any_speech(r))
+                       for r, m in zip(combined, matched))
+        result = []
+        for r in tried:
+            if id(r) in matched:
+                if matched[id(r)]:
+                    result.append(r)
+            elif r.matches(speech):
+                result.append(r)
+        return result
 
     def find_tagged_rules(self, tag, include_hidden=False):
         """
@@ -601,7 +1552,7 @@ class Grammar(references.BaseRef):
         if not isinstance(name, string_types):
             raise TypeError("string expected, got %r instead" % name)
 
-        if not references.optionally_qualified_name.matches(name):
+        if not references.optionally_qualified_name_matcher.matches(name):
             raise GrammarError("%r is not a valid JSGF reference name" % name)
 
         for rule in self.rules:
@@ -688,8 +1639,15 @@ class Grammar(references.BaseRef):
             raise GrammarError("Cannot remove rule '%s' as it is referenced by "
                                "another rule." % rule)
 
+        # Invalidate references to the rule before removing it.
+        rule.expansion.invalidate_matcher()
+        self._first_word_index.remove(rule)
+        self._reference_index.remove(rule)
         self._rules.remove(rule)
+        if self._adding_rule_names is not None:
+            self._adding_rule_names.discard(rule.name)
         rule.grammar = None
+        self._changed()
 
     def enable_rule(self, rule):
         """
@@ -711,8 +1669,10 @@ class Grammar(references.BaseRef):
         if rule_name not in self.rule_names:
             raise GrammarError("'%s' is not a rule in Grammar '%s'" % (rule, self))
 
-        # Enable the rule
-        self.get_rule_from_name(rule_name).enable()
+        # Enable the rule and index it again.
+        rule = self.get_rule_from_name(rule_name)
+        rule.enable()
+        self._first_word_index.add(rule)
 
     def disable_rule(self, rule):
         """
@@ -732,8 +1692,10 @@ class Grammar(references.BaseRef):
         if rule_name not in self.rule_names:
             raise GrammarError("'%s' is not a rule in Grammar '%s'" % (rule, self))
 
-        # Disable the rule
-        self.get_rule_from_name(rule_name).disable()
+        # Disable the rule and remove it from the index.
+        rule = self.get_rule_from_name(rule_name)
+        rule.disable()
+        self._first_word_index.remove(rule)
 
     def remove_import(self, _import):
         """
@@ -743,6 +1705,7 @@ class Grammar(references.BaseRef):
         """
         if _import in self._imports:
             self._imports.remove(_import)
+            self._changed()
         elif isinstance(_import, Import):
             raise GrammarError("%r is not an import statement in Grammar '%r'"
                                % (_import, self.name))
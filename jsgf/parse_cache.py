@@ -0,0 +1,306 @@
+"""
+This module contains the ``ParseCache`` class for storing parsed grammar files in a
+directory, so that unchanged files don't need to be parsed again.
+
+Cache entries are keyed on the path of each grammar file and store its size,
+modification time and content hash along with a compact form of the parsed
+grammar. An entry is used if the file's size and modification time are unchanged,
+or if its contents are. Entries are also keyed on the source code of this
+package, so that upgrading it invalidates old entries.
+
+Entries are written to temporary files which are then renamed, so that processes
+sharing a cache directory never read partially written entries.
+
+Entries are stored using the :mod:`pickle` module, so cache directories should
+not be writable by untrusted users.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from .expansions import (AlternativeSet, KleeneStar, Literal, NamedRuleRef, NullRef,
+                         OptionalGrouping, Repeat, RequiredGrouping, Sequence,
+                         VoidRef)
+from .grammars import Grammar, Import
+from .parser import ParsedAlternativeSet
+from .rules import Rule, _ExpansionSource
+
+#: Version number of the cache entry format.
+CACHE_FORMAT_VERSION = 2
+
+# Expansion classes that can be stored in cache entries. Their indices are used
+# in the stored expansion trees.
+_EXPANSION_TYPES = (Literal, NamedRuleRef, NullRef, VoidRef, Sequence,
+                    ParsedAlternativeSet, AlternativeSet, OptionalGrouping,
+                    RequiredGrouping, Repeat, KleeneStar)
+_TYPE_CODES = dict((t, i) for i, t in enumerate(_EXPANSION_TYPES))
+_LITERAL, _NAMED_REF = _TYPE_CODES[Literal], _TYPE_CODES[NamedRuleRef]
+_NO_ARGUMENT_TYPES = frozenset([_TYPE_CODES[NullRef], _TYPE_CODES[VoidRef]])
+_ALTERNATIVE_SET_TYPES = frozenset([_TYPE_CODES[ParsedAlternativeSet],
+                                    _TYPE_CODES[AlternativeSet]])
+
+# Hash of this package's source code, set when it is first needed.
+_source_hash = None
+
+
+def _get_source_hash():
+    global _source_hash
+    if _source_hash is None:
+        h = hashlib.sha1(("%d" % CACHE_FORMAT_VERSION).encode())
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(package_dir)):
+            if name.endswith(".py"):
+                with open(os.path.join(package_dir, name), "rb") as f:
+                    h.update(f.read())
+        _source_hash = h.hexdigest()
+    return _source_hash
+
+
+def _encode_expansion(expansion):
+    # Return a list of (type code, tag, text or name, number of children, weights)
+    # tuples for an expansion tree, in post-order so that it can be decoded with a
+    # stack. Weights are stored as (child index, weight) pairs, or as (encoded
+    # expansion, weight) pairs for keys that are not children.
+    nodes = []
+    stack = [(expansion, False)]
+    while stack:
+        e, visited = stack.pop()
+        if not visited:
+            stack.append((e, True))
+            stack.extend((child, False) for child in reversed(e.children))
+            continue
+
+        code = _TYPE_CODES[type(e)]
+        value = None
+        if code == _LITERAL:
+            value = e.text
+        elif code == _NAMED_REF:
+            value = e.name
+        weights = None
+        if code in _ALTERNATIVE_SET_TYPES and e.weights:
+            weights = []
+            for key, weight in e.weights.items():
+                for i, child in enumerate(e.children):
+                    if child is key:
+                        weights.append((i, weight))
+                        break
+                else:
+                    weights.append((_encode_expansion(key), weight))
+        nodes.append((code, e.tag, value, len(e.children), weights))
+    return nodes
+
+
+def _decode_expansion(nodes):
+    # Build an expansion tree from the tuples returned by _encode_expansion().
+    stack = []
+    for code, tag, value, n, weights in nodes:
+        if code == _LITERAL:
+            e = Literal(value)
+        elif code == _NAMED_REF:
+            e = NamedRuleRef(value)
+        elif code in _NO_ARGUMENT_TYPES:
+            e = _EXPANSION_TYPES[code]()
+        else:
+            children = stack[len(stack) - n:]
+            del stack[len(stack) - n:]
+            cls = _EXPANSION_TYPES[code]
+            if cls is ParsedAlternativeSet:
+                # Bypass the unravelling of nested alternative sets done when
+                # parsing, which has already been done.
+                e = ParsedAlternativeSet.__new__(ParsedAlternativeSet)
+                AlternativeSet.__init__(e, *children)
+            else:
+                e = cls(*children)
+            for key, weight in weights or ():
+                if isinstance(key, list):
+                    e.weights[_decode_expansion(key)] = weight
+                else:
+                    e.set_weight(key, weight)
+        if tag:
+            e.tag = tag
+        stack.append(e)
+    return stack[0]
+
+
+def _encode_rules(rules):
+    # Unparsed expansions are stored as they are.
+    result = []
+    for r in rules:
+        source = r._expansion_source
+        if source is None:
+            source = _encode_expansion(r.expansion)
+        result.append((r.name, r.visible, source))
+    return result
+
+
+def _decode_rules(data):
+    return [Rule(name, visible, source if isinstance(source, _ExpansionSource)
+                 else _decode_expansion(source))
+            for name, visible, source in data]
+
+
+def _parse_expansions(grammar):
+    # Parse the rule expansions of a cached grammar that were stored unparsed,
+    # raising any errors.
+    for rule in grammar.rules:
+        if rule._expansion_source is not None:
+            rule._parse_expansion_source()
+
+
+def _encode_grammar(grammar):
+    return (grammar.jsgf_version, grammar.charset_name, grammar.language_name,
+            grammar.name, [i.name for i in grammar.imports],
+            _encode_rules(grammar.rules))
+
+
+def _decode_grammar(data):
+    version, charset, language, name, imports, rules = data
+    result = Grammar()
+    result.jsgf_version = version
+    result.charset_name = charset
+    result.language_name = language
+    result.name = name
+    result.add_imports(*[Import(import_name) for import_name in imports])
+    result.add_rules(*_decode_rules(rules))
+    return result
+
+
+def _file_info(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ParseCache(object):
+    """
+    Cache of parsed grammar files stored in a directory.
+
+    The directory is created if it doesn't exist. Each process using the cache
+    should create its own ``ParseCache`` object.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: path of the cache directory
+        :type directory: str
+        """
+        self.directory = directory
+
+    def _entry_path(self, path):
+        key = "%s\0%s" % (_get_source_hash(), os.path.abspath(path))
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle"
+        return os.path.join(self.directory, name)
+
+    def _read_entry(self, entry_path):
+        # Return the file information and grammar data of an entry, or None if it
+        # doesn't exist or couldn't be read.
+        try:
+            with open(entry_path, "rb") as f:
+                info = pickle.load(f)
+                return info, pickle.load(f)
+        except Exception:
+            return None
+
+    def _write_entry(self, entry_path, info, data):
+        # Write the entry to a temporary file and then rename it, replacing any
+        # existing entry.
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(info, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            getattr(os, "replace", os.rename)(temp_path, entry_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def load(self, path):
+        """
+        Return the cached grammar for a grammar file, or None if there isn't a
+        valid entry for it.
+
+        :param path: path of the grammar file
+        :type path: str
+        :returns: Grammar | None
+        """
+        entry_path = self._entry_path(path)
+        entry = self._read_entry(entry_path)
+        if entry is None:
+            return None
+
+        # Use the entry if the file's size and modification time are unchanged.
+        (size, mtime, content_hash), data = entry
+        file_info = _file_info(path)
+        if file_info != (size, mtime):
+            # Otherwise, use it if the file's contents are unchanged and update the
+            # entry's file information.
+            if file_info[0] != size or _hash_file(path) != content_hash:
+                return None
+            self._write_entry(entry_path, file_info + (content_hash,), data)
+        return _decode_grammar(data)
+
+    def store(self, path, grammar):
+        """
+        Store a grammar parsed from a grammar file.
+
+        The entry is not stored if the file changes while it is being hashed.
+
+        :param path: path of the grammar file
+        :type path: str
+        :param grammar: grammar parsed from the file
+        :type grammar: Grammar
+        """
+        file_info = _file_info(path)
+        content_hash = _hash_file(path)
+        if _file_info(path) != file_info:
+            return
+        self._write_entry(self._entry_path(path), file_info + (content_hash,),
+                          _encode_grammar(grammar))
+
+    def parse_grammar_file(self, path, parse_file):
+        """
+        Return the cached grammar for a grammar file, or parse the file with a
+        function and store the result.
+
+        :param path: path of the grammar file
+        :type path: str
+        :param parse_file: function to parse the file with
+        :type parse_file: callable
+        :returns: Grammar
+        """
+        result = self.load(path)
+        if result is None:
+            # Don't store the result if the file changed while it was parsed.
+            file_info = _file_info(path)
+            result = parse_file(path)
+            if _file_info(path) == file_info:
+                self.store(path, result)
+        return result
+
+    def clear(self):
+        """
+        Remove every cache entry in the cache directory, including entries made by
+        other versions of this package.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -45,6 +45,9 @@ This workaround could be done automatically in a future release.
 This limitation also applies to long sequences, but it is much more difficult to
 reach the limit.
 
+The :ref:`fast_parser module <jsgf-fast-parser>` has versions of this module's
+functions that do not have this limitation. They are also a lot faster.
+
 
 =========================
 Extended Backus–Naur form
@@ -88,6 +91,7 @@ I've not included comments for simplicity; they can be used pretty much anywhere
 
 """
 
+import collections
 import re
 
 from pyparsing import (Literal as PPLiteral, Suppress, OneOrMore, pyparsing_common,
@@ -105,6 +109,12 @@ from .references import (optionally_qualified_name, import_name, grammar_name,
 from .rules import Rule
 
 
+#: Named tuple of the header values and name of a grammar, which is the first value
+#: yielded by :func:`iter_grammar_file`.
+GrammarHeader = collections.namedtuple(
+    "GrammarHeader", "jsgf_version charset_name language_name name"
+)
+
 # Define angled brackets that don't appear in the output.
 langle, rangle = map(Suppress, "<>")
 
@@ -243,9 +253,13 @@ def _post_process(tokens):
     return list(map(transform, tokens))
 
 
-def _transform_tokens(tokens):
-    lst = tokens.asList()
+def _apply_unary_operators(lst):
+    """
+    Apply tags and unary repeat operators in a list of root expansion tokens to the
+    expansion on the left. The list is modified in place.
 
+    :param lst: list
+    """
     # Handle tags.
     while "{" in lst:
         # Remove braces and tag text from the left and assign the text to the
@@ -287,6 +301,15 @@ def _transform_tokens(tokens):
         else:
             lst[0] = cls(lst[0])
 
+
+def _combine_tokens(lst):
+    """
+    Combine a list of root expansion tokens, with unary operators already applied,
+    into one expansion.
+
+    :param lst: list
+    :returns: Expansion
+    """
     # Handle atoms by returning the only token.
     if len(lst) == 1:
         return lst[0]
@@ -316,6 +339,12 @@ def _transform_tokens(tokens):
     raise TypeError("unhandled tokens %s" % lst)
 
 
+def _transform_tokens(tokens):
+    lst = tokens.asList()
+    _apply_unary_operators(lst)
+    return _combine_tokens(lst)
+
+
 def _ref_action(tokens):
     if tokens[0] == "NULL":
         return NullRef()
@@ -448,11 +477,9 @@ def get_grammar_parser():
         result.name = name
 
         # Add the remaining imports/rules to the grammar.
-        for token in tokens[4:]:
-            if isinstance(token, Import):
-                result.add_import(token)
-            else:
-                result.add_rule(token)
+        statements = tokens[4:]
+        result.add_imports(*[x for x in statements if isinstance(x, Import)])
+        result.add_rules(*[x for x in statements if not isinstance(x, Import)])
 
         # Return the new grammar object.
         return result
@@ -516,15 +543,28 @@ def parse_rule_string(s):
     return rule_parser.parseString(s, True).asList()[0]
 
 
-def parse_grammar_string(s):
+def parse_grammar_string(s, lazy_rules=False):
     """
     Parse a JSGF grammar string and return a ``Grammar`` object with the defined
     attributes, name, imports and rules.
 
+    If ``lazy_rules`` is ``True``, the grammar is parsed using the
+    :ref:`fast_parser module <jsgf-fast-parser>` and only the visibility and name
+    of each rule are parsed. The text of each rule's expansion is kept and parsed
+    the first time the expansion is used, for example when the rule is matched or
+    compiled. Errors in the text are raised then instead, with line and column
+    numbers relative to it. Rules that aren't terminated before the next rule
+    definition still raise an error straight away.
+
     :param s: str
+    :param lazy_rules: bool
     :returns: Grammar
     :raises: ParseException, GrammarError
     """
+    if lazy_rules:
+        from .fast_parser import parse_grammar_string as parse_string
+        return parse_string(s, lazy_rules)
+
     return grammar_parser.parseString(s, True).asList()[0]
 
 
@@ -546,7 +586,30 @@ def valid_grammar(s):
         return False
 
 
-def parse_grammar_file(path):
+def iter_grammar_file(path, chunk_size=65536):
+    """
+    Parse a JSGF grammar file incrementally, yielding a ``GrammarHeader`` tuple with
+    the grammar's header values and name, each ``Import`` object and then each
+    ``Rule`` object.
+
+    The file is read in chunks of roughly ``chunk_size`` characters and only the
+    text that has not been parsed yet is kept in memory. Errors in the file are
+    raised when they are reached.
+
+    Statements are parsed with the :ref:`fast_parser module <jsgf-fast-parser>`,
+    which produces the same objects as this module.
+
+    :param path: str
+    :param chunk_size: int
+    :returns: generator
+    :raises: ParseException, GrammarError
+    """
+    from .fast_parser import iter_grammar_file as iter_file
+    return iter_file(path, chunk_size)
+
+
+def parse_grammar_file(path, lazy=False, cache_dir=None, workers=1,
+                       lazy_rules=False):
     """
     Parse a JSGF grammar file and a return a ``Grammar`` object with the defined
     attributes, name, imports and rules.
@@ -554,15 +617,49 @@ def parse_grammar_file(path):
     This method will not attempt to import rules or grammars defined in other files,
     that should be done by an import resolver, not a parser.
 
+    If ``lazy`` is ``True``, the file is read and parsed one statement at a time
+    using :func:`iter_grammar_file` instead of all at once. This uses a lot less
+    memory for large files.
+
+    If ``cache_dir`` is not ``None``, the grammar is loaded from a
+    :class:`~jsgf.parse_cache.ParseCache` in that directory if the file is
+    unchanged, and stored in it otherwise.
+
+    If ``workers`` is at least 2, the rule definitions are split into parts and
+    parsed in a pool of that many worker processes using the
+    :ref:`fast_parser module <jsgf-fast-parser>`. ``lazy`` is ignored in
+    this case. Rules are added to the grammar in the same order and errors are
+    raised with the same line and column numbers as when parsing without worker
+    processes.
+
+    If ``lazy_rules`` is ``True``, rule expansions are parsed the first time they
+    are used, as described in :func:`parse_grammar_string`. ``workers`` is
+    ignored in this case. Cache entries store the text of expansions that have
+    not been parsed.
+
     :param path: str
+    :param lazy: bool
+    :param cache_dir: str | None
+    :param workers: int
+    :param lazy_rules: bool
     :returns: Grammar
     :raises: ParseException, GrammarError
     """
-    # Read all lines from the file, join them and call parse_grammar_string.
-    # Note that lines should retain any newline characters or semicolons.
-    with open(path, "r") as f:
-        lines = f.readlines()
+    if cache_dir is not None:
+        from .parse_cache import ParseCache, _parse_expansions
+        result = ParseCache(cache_dir).parse_grammar_file(
+            path, lambda p: parse_grammar_file(p, lazy, workers=workers,
+                                               lazy_rules=lazy_rules)
+        )
+        if not lazy_rules:
+            _parse_expansions(result)
+        return result
 
-    content = "".join(lines)
+    if lazy or workers > 1 or lazy_rules:
+        from .fast_parser import parse_grammar_file as parse_file
+        return parse_file(path, lazy, workers=workers, lazy_rules=lazy_rules)
+
+    with open(path, "r") as f:
+        content = f.read()
 
     return parse_grammar_string(content)
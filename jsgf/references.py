@@ -18,8 +18,8 @@ reserved_names = Combine(PPLiteral("NULL") ^ PPLiteral("VOID"))
 
 # This will match one or more alphanumeric Unicode characters and/or any of the
 # following special characters: +-:;,=|/\()[]@#%!^&~$
-base_name = Regex(r"[\w\+\-;:\|/\\\(\)\[\]@#%!\^&~\$]+", re.UNICODE)\
-    .setName("base name")
+_base_name_str = r"[\w\+\-;:\|/\\\(\)\[\]@#%!\^&~\$]+"
+base_name = Regex(_base_name_str, re.UNICODE).setName("base name")
 
 # A qualified name is a base name plus one or more base names joined by dots,
 # i.e. Java package syntax.
@@ -37,13 +37,59 @@ import_name = Combine((qualified_name + Optional(".*")) ^ (base_name + ".*"))
 # Grammar names cannot include semicolons because the declared grammar name parser
 # will gobble any semicolon after the name that isn't separated by whitespace,
 # leading to a parser error.
-_grammar_base_name = Regex(r"[\w\+\-:\|/\\\(\)\[\]@#%!\^&~\$]+", re.UNICODE)\
-    .setName("base name")
+_grammar_base_name_str = r"[\w\+\-:\|/\\\(\)\[\]@#%!\^&~\$]+"
+_grammar_base_name = Regex(_grammar_base_name_str, re.UNICODE).setName("base name")
 grammar_name = Combine(_grammar_base_name ^ Combine(
     _grammar_base_name + OneOrMore("." + _grammar_base_name)))\
     .setName("grammar name")
 
 
+# Define regular expressions for skipping whitespace and C++ style comments.
+_whitespace_str = r"[ \t\n\r]*"
+_comment_str = r"/\*(?:[^*]|\*(?!/))*\*/|//(?:\\\n|[^\n])*"
+_skip_whitespace = re.compile(_whitespace_str)
+_skip_whitespace_and_comments = re.compile(
+    r"(?:%s(?:%s))*%s" % (_whitespace_str, _comment_str, _whitespace_str)
+)
+
+
+class _NameMatcher(object):
+    """
+    Class for checking names with a regular expression in the same way as the
+    matches() method of the equivalent pyparsing element, which is a lot slower.
+    """
+    def __init__(self, pattern, skip):
+        self._regex = re.compile(pattern, re.UNICODE)
+        self._skip = skip
+
+    def matches(self, name):
+        """
+        Whether the name matches.
+
+        :param name: str
+        :returns: bool
+        """
+        # Expand tabs and allow whitespace (or comments) around the name like
+        # pyparsing does.
+        s = ("%s" % name).expandtabs()
+        m = self._regex.match(s, self._skip.match(s).end())
+        return bool(m) and self._skip.match(s, m.end()).end() == len(s)
+
+
+# Define name matchers. The parser module makes the pyparsing elements for rule
+# reference, import and grammar names ignore comments, so these do too.
+_qualified_name_str = r"%s(?:\.%s)*" % (_base_name_str, _base_name_str)
+_import_name_str = r"%s(?:\.%s)+(?:\.\*)?|%s\.\*" % (
+    _base_name_str, _base_name_str, _base_name_str)
+_grammar_name_str = r"%s(?:\.%s)*" % (_grammar_base_name_str, _grammar_base_name_str)
+base_name_matcher = _NameMatcher(_base_name_str, _skip_whitespace)
+reserved_names_matcher = _NameMatcher("NULL|VOID", _skip_whitespace)
+optionally_qualified_name_matcher = _NameMatcher(_qualified_name_str,
+                                                 _skip_whitespace_and_comments)
+import_name_matcher = _NameMatcher(_import_name_str, _skip_whitespace_and_comments)
+grammar_name_matcher = _NameMatcher(_grammar_name_str, _skip_whitespace_and_comments)
+
+
 class BaseRef(object):
     """
     Base class for JSGF rule and grammar references.
@@ -96,4 +142,5 @@ class BaseRef(object):
         :param name: str
         :returns: bool
         """
-        return base_name.matches(name) and not reserved_names.matches(name)
+        return (base_name_matcher.matches(name) and
+                not reserved_names_matcher.matches(name))
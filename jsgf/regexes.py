@@ -0,0 +1,366 @@
+"""
+This module contains classes for matching speech strings with expansion trees
+using regular expressions.
+
+The regular expression matching backend compiles expansion trees, including the
+trees of referenced rules, into a single pattern for Python's ``re`` module,
+using the same ``_compile_instructions`` methods as automata. Each word of a
+pattern is followed by a space and speech is matched as its words joined with
+spaces, so matching is done by the ``re`` module without splitting speech into
+words for each expansion. Capturing groups are used for each expansion so that
+their spans can be used as match data, except for the expansions of repeats.
+
+Regular expressions prefer the same matches as automata: optional expansions and
+repeats are greedy and alternatives are tried in the order used by
+``AlternativeSet``. The regular expression backend will also find matches for
+ambiguous expansions such as ``[test] test``.
+
+Some expansion trees cannot be matched this way. Trees containing ``Dictation``
+expansions or both case sensitive and case insensitive literals are matched with
+an automaton instead. The ``re`` module only records the last repetition of a
+group, so the words matched by each repeat are matched again with an automaton
+of the repeat to get the match data of its repetitions. Rules that reference
+themselves are matched with a chart parser.
+
+The backend can be selected for a grammar's rules by setting the
+:py:attr:`~jsgf.grammars.Grammar.matching_backend` property::
+
+    grammar.matching_backend = MatchingBackend.Regex
+
+Note that regular expressions can backtrack a lot for very ambiguous rules, such
+as rules with many optional expansions that can match the same words. The
+automaton backend should be used for such rules.
+
+"""
+
+import re
+
+from .automata import Automaton, _LITERAL, _MatchedWords
+
+# Type of the match objects returned by compiled patterns.
+_MatchType = type(re.match("", ""))
+
+
+class _UnsupportedTree(Exception):
+    """
+    Exception raised when an expansion tree cannot be compiled into a regular
+    expression.
+    """
+
+
+class RegexCompiler(object):
+    """
+    Class used to compile expansion trees into regular expression patterns.
+
+    This class implements the same methods as ``AutomatonCompiler`` that are
+    called by the ``Expansion._compile_instructions`` method.
+    """
+
+    def __init__(self, indices, capture=True):
+        """
+        :param indices: dictionary of expansion IDs to the indices used for
+            expansions by an automaton
+        :param capture: whether to use a capturing group for each expansion
+            that isn't inside a repeat
+        """
+        self.groups = []
+        self.case_sensitive = set()
+        self._indices = indices
+        self._capture = capture
+        self._repeat_depth = 0
+        self._parts = []
+
+    def _begin_group(self, e):
+        # Begin a group for an expansion, which is a capturing group unless it
+        # is inside a repeat.
+        if self._capture and not self._repeat_depth:
+            self.groups.append(self._indices[id(e)])
+            self._parts.append("(")
+        else:
+            self._parts.append("(?:")
+
+    @property
+    def pattern(self):
+        """
+        The compiled pattern string.
+
+        :returns: str
+        """
+        return "".join(self._parts)
+
+    def compile(self, e):
+        """
+        Compile an expansion so that its match data is recorded.
+
+        :param e: Expansion
+        """
+        self._begin_group(e)
+        e._compile_instructions(self)
+        self._parts.append(")")
+
+    def compile_reference(self, rule):
+        """
+        Compile the expansion of a referenced rule in place.
+
+        :param rule: Rule
+        """
+        # Trees are compiled into automata first, which checks that references
+        # aren't recursive.
+        self.compile(rule.expansion)
+
+    def _emit_words(self, words, case_sensitive):
+        self.case_sensitive.add(case_sensitive)
+        for word in words:
+            if not case_sensitive:
+                word = word.lower()
+            self._parts.append(re.escape(word) + " ")
+
+    def emit_words(self, words, case_sensitive):
+        """
+        Emit a pattern for matching a sequence of words.
+
+        :param words: list
+        :param case_sensitive: bool
+        """
+        self._emit_words(words, case_sensitive)
+
+    def emit_dictation(self, word_pattern, stop_words, single_word):
+        """
+        Dictation expansions are not compiled into patterns.
+
+        :raises: _UnsupportedTree
+        """
+        raise _UnsupportedTree("dictation cannot be matched with a regular "
+                               "expression")
+
+    def emit_alternatives(self, alternatives):
+        """
+        Emit a pattern for matching one of a list of expansions. Alternatives
+        earlier in the list have higher priority.
+
+        :param alternatives: list
+        """
+        if not alternatives:
+            self.emit_fail()
+            return
+
+        self._parts.append("(?:")
+        for i, e in enumerate(alternatives):
+            if i > 0:
+                self._parts.append("|")
+            self.compile(e)
+        self._parts.append(")")
+
+    def emit_literal_alternatives(self, literals, case_sensitive):
+        """
+        Emit a pattern for matching one of a list of literals. Like the word tries
+        of automata, longer literals have higher priority, then literals earlier
+        in the list.
+
+        :param literals: list
+        :param case_sensitive: bool
+        """
+        if not literals:
+            self.emit_fail()
+            return
+
+        # Only the first of any literals with the same words can be matched.
+        seen = set()
+        unique = []
+        for e in literals:
+            words = e._text.split()
+            key = tuple(words if case_sensitive else
+                        [word.lower() for word in words])
+            if key not in seen:
+                seen.add(key)
+                unique.append((e, words))
+        unique.sort(key=lambda x: len(x[1]), reverse=True)
+
+        self._parts.append("(?:")
+        for i, (e, words) in enumerate(unique):
+            if i > 0:
+                self._parts.append("|")
+            self._begin_group(e)
+            self._emit_words(words, case_sensitive)
+            self._parts.append(")")
+        self._parts.append(")")
+
+    def emit_optional(self, e):
+        """
+        Emit a pattern for optionally matching an expansion.
+
+        :param e: Expansion
+        """
+        self.compile(e)
+        self._parts.append("?")
+
+    def emit_repetition(self, repeat, allow_zero, allow_many=True):
+        """
+        Emit a pattern for matching repetitions of a repeat expansion's child.
+        Groups inside the repeat don't capture, as only their last repetition
+        would be recorded.
+
+        :param repeat: Repeat
+        :param allow_zero: whether zero repetitions are allowed
+        :param allow_many: whether more than one repetition is allowed
+        """
+        self._repeat_depth += 1
+        self.compile(repeat.child)
+        self._repeat_depth -= 1
+        if allow_many:
+            self._parts.append("*" if allow_zero else "+")
+        elif allow_zero:
+            self._parts.append("?")
+
+    def emit_fail(self):
+        """
+        Emit a pattern that never matches.
+        """
+        self._parts.append("(?!)")
+
+
+class RegexMatcher(Automaton):
+    """
+    Regular expression matcher compiled from an expansion tree.
+
+    Regular expression matchers are created by the ``Rule`` and ``Expansion``
+    matching methods as necessary; they are invalidated in the same way as
+    automata. They have the same matching methods as the ``Automaton`` class and
+    use an automaton for expansion trees that cannot be matched with a regular
+    expression.
+
+    Match data of expansions inside repeats is found by matching the words of
+    each repeat again with an automaton of the repeat. Other match data is
+    taken from the groups of the regular expression.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: root Expansion
+        :raises: GrammarError
+        """
+        super(RegexMatcher, self).__init__(root)
+
+        # An automaton for each repeat that isn't inside another repeat and this
+        # matcher's index of each expansion of the automaton, by the index of the
+        # repeat. They are created when first used.
+        self._repeat_automata = {}
+
+        compiler = RegexCompiler(self._indices)
+        try:
+            compiler.compile(root)
+            if len(compiler.case_sensitive) > 1:
+                raise _UnsupportedTree("literals with different case "
+                                       "sensitivity cannot be matched with one "
+                                       "regular expression")
+            pattern = compiler.pattern
+            self._pattern = re.compile(pattern + r"\Z", re.UNICODE)
+            self._prefix_pattern = re.compile(pattern, re.UNICODE)
+        except (_UnsupportedTree, re.error, AssertionError, OverflowError,
+                RuntimeError):
+            # Use the automaton instead. Older versions of Python raise
+            # AssertionError for patterns with too many groups and RuntimeError
+            # for patterns nested too deeply.
+            self._pattern = None
+            self._prefix_pattern = None
+        self._groups = compiler.groups
+        self._case_sensitive = True in compiler.case_sensitive
+
+    @property
+    def pattern(self):
+        """
+        The compiled regular expression used to match speech completely, or None
+        if the automaton is used instead.
+
+        :returns: compiled regular expression | None
+        """
+        return self._pattern
+
+    def _simulate(self, words, complete, nonempty=False):
+        # Return the position and path of the preferred match or None. The path is
+        # the match object if match data can be taken from its groups.
+        pattern = self._pattern if complete else self._prefix_pattern
+        if pattern is None:
+            return super(RegexMatcher, self)._simulate(words, complete,
+                                                       nonempty)
+
+        # Match words joined with spaces and followed by one. Words containing
+        # spaces cannot be joined this way.
+        if not self._case_sensitive:
+            words = [word.lower() for word in words]
+        text = " ".join(words) + " " if words else ""
+        if text.count(" ") != len(words):
+            return super(RegexMatcher, self)._simulate(words, complete,
+                                                       nonempty)
+
+        m = pattern.match(text)
+        if m is None:
+            return None
+
+        # Use the automaton to find non-empty matches if the preferred match is
+        # empty.
+        if nonempty and not complete and not m.end():
+            return super(RegexMatcher, self)._simulate(words, complete,
+                                                       nonempty)
+
+        # Use the automaton to find the path of the match if the groups cannot be
+        # used.
+        if not self._groups:
+            return super(RegexMatcher, self)._simulate(words, complete,
+                                                       nonempty)
+        return text.count(" ", 0, m.end()), m
+
+    def _evaluate(self, path, words, offsets):
+        # Get the _MatchedWords of each expansion from the spans of the groups of a
+        # match object. If an expansion has more than one group because its rule is
+        # referenced more than once, the value of the last group is used, as in
+        # automaton paths.
+        if not isinstance(path, _MatchType):
+            return super(RegexMatcher, self)._evaluate(path, words, offsets)
+
+        text = path.string
+        fixed_words = self._fixed_words
+        tokens = list(words)
+        spans = []
+        for group, index in enumerate(self._groups, 1):
+            i, j = path.span(group)
+            if i < 0:
+                continue
+            start = text.count(" ", 0, i)
+            spans.append((index, start, start + text.count(" ", i, j)))
+
+        # Evaluate the events of matching the words of each repeat with its
+        # automaton, then use the spans of the other groups.
+        events = []
+        for index, start, end in spans:
+            if index in self._repetitions:
+                events.extend(self._get_repeat_events(index, words, start, end))
+        values, repetitions = self._evaluate_events(events, words, offsets,
+                                                    tokens)
+        for index, start, end in spans:
+            if index in fixed_words:
+                tokens[start:end] = fixed_words[index]
+            values[index] = _MatchedWords(tokens, offsets, start, end)
+        return values, repetitions
+
+    def _get_repeat_events(self, index, words, start, end):
+        # Match the words matched by a repeat with an automaton of the repeat and
+        # return the events of the match, using the indices and positions of this
+        # matcher's automaton.
+        repeat_automaton = self._repeat_automata.get(index)
+        if repeat_automaton is None:
+            automaton = Automaton(self._expansions[index])
+            indices = [self._indices[id(e)] for e in automaton._expansions]
+            repeat_automaton = (automaton, indices)
+            self._repeat_automata[index] = repeat_automaton
+
+        automaton, indices = repeat_automaton
+        result = automaton._simulate(list(words[start:end]), True)
+        events = []
+        for op, i, position in automaton._events(result[1]):
+            if op == _LITERAL:
+                i = (indices[i[0]], i[1])
+            else:
+                i = indices[i]
+            events.append((op, i, position + start))
+        return events
@@ -5,10 +5,41 @@ This module contains classes for compiling and matching JSpeech Grammar Format
 rules.
 """
 
+from collections import namedtuple
+import threading
+
+from six import string_types
+
+from .automata import MatchingBackend, _set_deferred_match_data, _tokenize
+from .batches import DEFAULT_CHUNK_SIZE, match_many
+from .charts import DEFAULT_MAX_WORK
 from .errors import GrammarError
 from . import references
 from .expansions import Expansion, Literal, NamedRuleRef, filter_expansion, \
     map_expansion, TraversalOrder
+from .vocabulary import _get_speech_words
+
+
+# Unparsed text of a rule's expansion and the function used to parse it the first
+# time the expansion is used. Passing one as a rule's expansion defers parsing.
+_ExpansionSource = namedtuple("_ExpansionSource", "text parse")
+
+# Lock used so that rule expansions are only parsed once when rules are used from
+# several threads at once.
+_parse_lock = threading.Lock()
+
+
+def _rule_matches(rule, speech):
+    # Whether speech matches a rule. This is used for matching in worker
+    # processes.
+    return rule.matches(speech)
+
+
+def _get_bounds_words(speech):
+    # Get the number of words in speech and a set of its lowercase words for
+    # checking the match bounds of rules.
+    words = speech.split() if isinstance(speech, string_types) else speech
+    return len(words), set(word.lower() for word in words)
 
 
 class Rule(references.BaseRef):
@@ -40,10 +71,12 @@ class Rule(references.BaseRef):
         """
         super(Rule, self).__init__(name)
         self.visible = visible
+        self.grammar = None
+        self._version = 0
         self._expansion = None
+        self._expansion_source = None
         self.expansion = expansion
         self._active = True
-        self.grammar = None
 
         # Set case sensitivity (backing attribute and property).
         self._case_sensitive = case_sensitive
@@ -54,8 +87,13 @@ class Rule(references.BaseRef):
         """
         This rule's expansion.
 
+        The expansions of rules parsed with the ``lazy_rules`` parser option are
+        parsed the first time this property is used.
+
         :returns: Expansion
         """
+        if self._expansion_source is not None:
+            self._parse_expansion_source()
         return self._expansion
 
     @expansion.setter
@@ -93,11 +131,21 @@ class Rule(references.BaseRef):
             return self._name
 
     def _set_expansion(self, value):
+        # Set deferred match data that could use the previous expansion.
+        _set_deferred_match_data()
+
         # Reset expansion.rule if there was a previous expansion
         if self._expansion:
             self._expansion.rule = None
 
+        # Keep unparsed expansion text until the expansion is first used.
+        if isinstance(value, _ExpansionSource):
+            self._expansion, self._expansion_source = None, value
+            self._expansion_changed()
+            return
+
         # Handle the object passed in as an expansion
+        self._expansion_source = None
         self._expansion = Expansion.make_expansion(value)
 
         # Set the rule attribute for the rule's expansions
@@ -106,6 +154,39 @@ class Rule(references.BaseRef):
 
         map_expansion(self._expansion, set_rule, shallow=True)
 
+        self._expansion_changed()
+
+    def _parse_expansion_source(self):
+        # Parse the unparsed expansion text of this rule. Errors are raised each
+        # time the expansion is used. The rule's version is not changed because
+        # nothing can have used the expansion yet.
+        with _parse_lock:
+            source = self._expansion_source
+            if source is None:
+                return
+            expansion = source.parse(source.text)
+
+            # Set the rule attribute and case sensitivity of the expansions. There
+            # are no matchers to invalidate yet.
+            case_sensitive = self._case_sensitive
+            def func(x):
+                x.rule = self
+                if isinstance(x, Literal):
+                    x._case_sensitive = case_sensitive
+
+            map_expansion(expansion, func, shallow=True)
+            self._expansion, self._expansion_source = expansion, None
+
+        if self.grammar is not None:
+            self.grammar._expansion_parsed(self)
+
+    def _expansion_changed(self):
+        # Increase this rule's version number and let the grammar know that the
+        # rule's expansion has been changed or replaced.
+        self._version += 1
+        if self.grammar is not None:
+            self.grammar._expansion_changed(self)
+
     def compile(self, ignore_tags=False):
         """
         Compile this rule's expansion tree and return the result.
@@ -177,6 +258,10 @@ class Rule(references.BaseRef):
         value = bool(value)
         self._case_sensitive = value
 
+        # Unparsed expansions use the value when they are parsed.
+        if self._expansion_source is not None and self.grammar is None:
+            return
+
         # Define a function for setting case_sensitive for all Literal rule
         # expansions.
         def func(e):
@@ -193,18 +278,24 @@ class Rule(references.BaseRef):
         # Recursively operate on the rule expansion tree. Do *not* operate on
         # referenced rules directly.
         map_expansion(self.expansion, func, shallow=True)
+        if self.grammar is not None:
+            self.grammar._changed()
 
     def enable(self):
         """
         Allow this rule to produce compile output and to match speech strings.
         """
         self._active = True
+        if self.grammar is not None:
+            self.grammar._changed()
 
     def disable(self):
         """
         Stop this rule from producing compile output or from matching speech strings.
         """
         self._active = False
+        if self.grammar is not None:
+            self.grammar._changed()
 
     @property
     def active(self):
@@ -217,6 +308,21 @@ class Rule(references.BaseRef):
         """
         return self._active
 
+    @property
+    def matching_backend(self):
+        """
+        The backend used to match speech with this rule.
+
+        This is the :py:attr:`~jsgf.grammars.Grammar.matching_backend` value of the
+        rule's grammar or ``MatchingBackend.Pyparsing`` if the rule is not in a
+        grammar.
+
+        :returns: int
+        """
+        if self.grammar is not None:
+            return self.grammar.matching_backend
+        return MatchingBackend.Pyparsing
+
     @property
     def was_matched(self):
         """
@@ -226,6 +332,21 @@ class Rule(references.BaseRef):
         """
         return self.expansion.current_match is not None
 
+    def _within_match_bounds(self, bounds_words):
+        # Whether speech could match this rule, checked using the number of words
+        # in speech and the words that every match of the rule's expansion
+        # contains. Rules with invalid expansions are not rejected here; matching
+        # raises the error instead.
+        try:
+            min_words, max_words, required = \
+                self.expansion._get_match_bounds((self,))
+        except GrammarError:
+            return True
+        count, words = bounds_words
+        if count < min_words or max_words is not None and count > max_words:
+            return False
+        return required.issubset(words)
+
     def matches(self, speech):
         """
         Whether speech matches this rule.
@@ -237,55 +358,248 @@ class Rule(references.BaseRef):
 
             <rule> = [test] test;
 
-        :param speech: str
+        Ambiguous rule expansions can be matched if the rule's grammar uses the
+        automaton, chart or regular expression matching backend. Rules that
+        reference themselves can only be matched with the chart backend. See
+        :py:attr:`matching_backend`.
+
+        If one of these backends is used, speech is rejected without matching if
+        it has too few or too many words for this rule or is missing a word that
+        every match requires. See
+        :py:attr:`~jsgf.grammars.Grammar.prefilter_info`.
+
+        Speech can be a string, a sequence of words or a sequence of word IDs from
+        the vocabulary of the rule's grammar. See
+        :py:attr:`~jsgf.grammars.Grammar.vocabulary`.
+
+        :param speech: str | sequence of words or word IDs
         :returns: bool
         """
+        return self._matches(speech, True)
+
+    def _matches(self, speech, check_bounds):
+        # Match speech as described in matches(), only checking the match bounds
+        # of this rule if 'check_bounds' is True.
         if not self._active:
             return False
 
-        # Strip whitespace at the start of 'speech' and lower it to match regex
-        # properly.
-        speech = speech.lstrip()
+        speech = _get_speech_words(speech, self.grammar)
+
+        # Match the whole string with the automaton, chart parser or regular
+        # expression matcher if the grammar uses one of them. This also resets
+        # match data for this rule and referenced rules.
+        backend = self.matching_backend
+        if backend != MatchingBackend.Pyparsing:
+            if backend == MatchingBackend.Automaton:
+                matcher = self.expansion._get_automaton()
+            elif backend == MatchingBackend.Chart:
+                matcher = self.expansion._get_chart_parser()
+            else:
+                matcher = self.expansion._get_regex_matcher()
+
+            # Set match data when it is next used if the grammar defers it.
+            grammar = self.grammar
+            defer = grammar is not None and grammar.lazy_match_data
+
+            # Reject speech outside of the rule's match bounds without matching.
+            if check_bounds:
+                within_bounds = self._within_match_bounds(
+                    _get_bounds_words(speech))
+                if grammar is not None:
+                    grammar._count_prefilter_checks(1, int(not within_bounds))
+                if not within_bounds:
+                    return matcher._reject(defer)
+
+            if defer:
+                return matcher._defer_matches(speech)
+            matcher.matches(speech)
+            return self.expansion.current_match is not None
 
         # Reset match data for this rule and referenced rules.
         self.expansion.reset_for_new_match()
 
-        # Match the expansion and use the remainder substring to check if the rule
-        # matched completely.
+        # Match the expansion and use the remainder substring or words to check if
+        # the rule matched completely.
         remainder = self.expansion.matches(speech)
-        if remainder != "":
+        if remainder:
             self.expansion.current_match = None
 
         return self.expansion.current_match is not None
 
+    def matches_many(self, speech_strings, workers=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Match each string of an iterable with this rule and yield whether each
+        string matched in order.
+
+        Large batches are matched using a pool of worker processes which each
+        receive a copy of this rule and its grammar once. Match data is not set
+        for strings matched in worker processes. Small batches are matched in
+        this process using :meth:`matches`.
+
+        :param speech_strings: iterable of speech strings
+        :param workers: number of worker processes to use (default: the number of
+            CPUs)
+        :param chunk_size: number of speech strings to send to a worker process at
+            a time
+        :returns: generator
+        """
+        return match_many(self, _rule_matches, speech_strings, workers, chunk_size)
+
+    def match(self, speech):
+        """
+        Match speech with this rule and return a ``MatchResult`` with the match data
+        of each expansion, or None if the speech doesn't match.
+
+        Unlike :meth:`matches`, this method doesn't set match data on this rule's
+        expansions or the expansions of referenced rules, so a rule can be matched
+        from several threads at once. Speech is matched with the chart or regular
+        expression matching backend if the rule's grammar uses either and with
+        the automaton matching backend otherwise.
+
+        :param speech: str | sequence of words or word IDs
+        :returns: MatchResult | None
+        """
+        if not self._active:
+            return None
+
+        speech = _get_speech_words(speech, self.grammar)
+        backend = self.matching_backend
+        if backend == MatchingBackend.Chart:
+            return self.expansion._get_chart_parser().match(speech)
+        elif backend == MatchingBackend.Regex:
+            return self.expansion._get_regex_matcher().match(speech)
+        return self.expansion._get_automaton().match(speech)
+
+    def iter_parses(self, speech, limit=None, max_work=DEFAULT_MAX_WORK):
+        """
+        Match speech completely with this rule and yield a ``MatchResult`` for
+        each distinct way that it matches.
+
+        Parses are yielded lazily, with parses using more likely alternatives of
+        weighted alternative sets first. Parses that are equally likely are
+        yielded in the order that the matching backends prefer them, so the first
+        parse has the same match data as the result of :meth:`match`. Speech is
+        always matched with the chart matching backend, which finds parses of
+        each expansion at each position once and shares them between parses.
+
+        Finding parses stops after ``max_work`` steps, so that rules with very
+        many parses don't take too long to match. Steps are counted both for
+        searching the chart and for evaluating the match data of each parse.
+
+        :param speech: str | sequence of words or word IDs
+        :param limit: maximum number of parses to yield (default: no limit)
+        :param max_work: maximum number of steps to use for finding and
+            evaluating parses, or None for no maximum (default: ``DEFAULT_MAX_WORK``)
+        :returns: generator
+        """
+        if not self._active:
+            return iter(())
+
+        speech = _get_speech_words(speech, self.grammar)
+        return self.expansion._get_chart_parser().iter_parses(speech, limit,
+                                                              max_work)
+
     def find_matching_part(self, speech):
         """
         Searches for a part of speech that matches this rule and returns it.
 
+        The first non-empty match is used and its match data is set. If the
+        rule's grammar uses the automaton, chart or regular expression matching
+        backend, matches are only searched for at the start of words that
+        matches of this rule can start with and the part is returned as it
+        appears in speech. The pyparsing backend can match words that are run
+        together, so it searches at every character of speech instead. Speech
+        is lowercased for it and the returned part is too.
+
         If no part matches or the rule is disabled, return None.
 
-        :param speech: str
+        :param speech: str | sequence of words or word IDs
         :returns: str | None
         """
         if not self._active:
             return None
 
-        # Strip whitespace at the start of 'speech' and lower it to match regex
-        # properly.
-        speech = speech.lstrip().lower()
+        # Use the first match (if any).
+        for part in self._iter_matching_parts(speech):
+            return part
+        return None
+
+    def find_all_matching_parts(self, speech):
+        """
+        Search for each part of speech that matches this rule and yield them in
+        order.
+
+        Parts are found in one pass over the words of speech in the same way as
+        :meth:`find_matching_part`. Parts don't overlap; the search continues
+        after the end of each matching part. Match data is set for each part
+        when it is yielded.
+
+        :param speech: str | sequence of words or word IDs
+        :returns: generator
+        """
+        if not self._active:
+            return iter(())
+        return self._iter_matching_parts(speech)
+
+    def _iter_matching_parts(self, speech):
+        # Yield each non-overlapping part of speech that matches this rule and set
+        # its match data.
+        speech = _get_speech_words(speech, self.grammar)
+        if not isinstance(speech, string_types):
+            speech = " ".join(speech)
+        speech = speech.lstrip()
 
         # Reset match data for this rule and referenced rules.
         self.expansion.reset_for_new_match()
 
-        # Use the first match (if any) and break. The loop is required because
-        # scanString returns a generator.
-        result = None
-        for match in self.expansion.matcher_element.scanString(speech):
-            _, start, end = match
-            result = speech[start:end]
-            break
-
-        return result
+        if self.matching_backend == MatchingBackend.Pyparsing:
+            # Search every character offset with the parser element's
+            # scanString() method, because pyparsing can match words that are
+            # run together. Lower speech to match regex properly.
+            speech = speech.lower()
+            for _, start, end in self.expansion.matcher_element.scanString(speech):
+                # Don't include whitespace skipped after the match and skip
+                # matches of only whitespace.
+                part = speech[start:end].rstrip()
+                if part:
+                    yield part
+            return
+
+        # Otherwise only try matching at the start of words that this rule can
+        # start with and that are followed by enough words for a match.
+        try:
+            first_words, _, any_word = self.expansion._get_first_words((self,))
+            min_words, max_words, _ = self.expansion._get_match_bounds((self,))
+        except GrammarError:
+            # Matching will raise the error instead.
+            first_words, any_word, min_words, max_words = (), True, 0, None
+
+        backend = self.matching_backend
+        if backend == MatchingBackend.Automaton:
+            matcher = self.expansion._get_automaton()
+        elif backend == MatchingBackend.Chart:
+            matcher = self.expansion._get_chart_parser()
+        else:
+            matcher = self.expansion._get_regex_matcher()
+
+        _, words, offsets = _tokenize(speech)
+        end = 0
+        for i, word in enumerate(words):
+            if len(words) - i < min_words:
+                break
+            start = offsets[i][0]
+            if start < end or not (any_word or word.lower() in first_words):
+                continue
+
+            # Only pass the words that a match could use.
+            j = len(words) if max_words is None else i + max_words
+            result = matcher._simulate(words[i:j], False, True)
+            if not result or not result[0]:
+                continue
+            matcher._apply(result[1], words[i:j], offsets[i:j])
+            end = offsets[i + result[0] - 1][1]
+            yield speech[start:end]
 
     @property
     def tags(self):
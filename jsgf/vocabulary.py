@@ -0,0 +1,186 @@
+"""
+This module contains the ``Vocabulary`` class for mapping the words of speech
+to integer IDs.
+
+Speech can be passed to the matching methods of rules and grammars as a string,
+as a sequence of words or as a sequence of word IDs from the vocabulary of the
+matching rule's grammar. Sequences are matched without splitting or joining
+strings, which is useful for speech recognition engines that produce words or
+word IDs instead of text::
+
+    vocabulary = grammar.vocabulary
+    word_ids = vocabulary.encode("hello world")
+    grammar.find_matching_rules(word_ids)
+
+The automaton matching backend compares word IDs instead of words when every
+word of speech is given by its ID. Word IDs are still looked up for the other
+backends and for setting match data.
+
+"""
+
+from six import integer_types, string_types
+
+
+class Vocabulary(object):
+    """
+    Table of words and their integer IDs.
+
+    IDs are assigned to words in the order they are added, starting at 0, and
+    never change. Words are case sensitive, so "Hello" and "hello" have
+    different IDs.
+    """
+
+    def __init__(self, words=()):
+        """
+        :param words: iterable of words to add
+        """
+        self._words = []
+        self._ids = {}
+
+        # The ID of the lowercase form of each word, or -1 if it isn't in this
+        # vocabulary, and the IDs of words waiting for each lowercase form.
+        self._lower_ids = []
+        self._waiting_ids = {}
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __repr__(self):
+        return "%s(%d words)" % (self.__class__.__name__, len(self._words))
+
+    def add(self, word):
+        """
+        Add a word if it isn't in this vocabulary already and return its ID.
+
+        :param word: str
+        :returns: int
+        :raises: ValueError
+        """
+        word_id = self._ids.get(word)
+        if word_id is None:
+            if not isinstance(word, string_types) or len(word.split()) != 1:
+                raise ValueError("%r is not a single word" % (word,))
+            word_id = len(self._words)
+            self._words.append(word)
+            self._ids[word] = word_id
+
+            # Link the word with its lowercase form and words that are waiting
+            # for it as their lowercase form.
+            lower = word.lower()
+            lower_id = word_id if lower == word else self._ids.get(lower, -1)
+            self._lower_ids.append(lower_id)
+            if lower_id == -1:
+                self._waiting_ids.setdefault(lower, []).append(word_id)
+            for waiting_id in self._waiting_ids.pop(word, ()):
+                self._lower_ids[waiting_id] = word_id
+        return word_id
+
+    def get_id(self, word):
+        """
+        Get the ID of a word, or None if the word isn't in this vocabulary.
+
+        :param word: str
+        :returns: int | None
+        """
+        return self._ids.get(word)
+
+    def get_word(self, word_id):
+        """
+        Get the word with an ID.
+
+        :param word_id: int
+        :returns: str
+        :raises: ValueError
+        """
+        if not 0 <= word_id < len(self._words):
+            raise ValueError("%r is not a word ID of this vocabulary" % word_id)
+        return self._words[word_id]
+
+    def encode(self, speech):
+        """
+        Get a list of the IDs of each word of a speech string or sequence of
+        words, adding words that aren't in this vocabulary.
+
+        :param speech: str | sequence of words
+        :returns: list
+        """
+        if isinstance(speech, string_types):
+            speech = speech.split()
+        return [self.add(word) for word in speech]
+
+    def decode(self, word_ids):
+        """
+        Get a list of the words with each ID of a sequence.
+
+        :param word_ids: sequence of word IDs
+        :returns: list
+        :raises: ValueError
+        """
+        return [self.get_word(word_id) for word_id in word_ids]
+
+    def _get_lower_ids(self, word_ids):
+        """
+        Get a list of the IDs of the lowercase form of each word with an ID of a
+        sequence, using -1 for lowercase forms that aren't in this vocabulary.
+
+        :param word_ids: sequence of word IDs
+        :returns: list
+        """
+        lower_ids = self._lower_ids
+        return [lower_ids[word_id] for word_id in word_ids]
+
+
+class _WordIDs(tuple):
+    """
+    Tuple of the words of speech given as word IDs, which also has the IDs and
+    their vocabulary.
+
+    The automaton matching backend matches the IDs instead of the words, so that
+    words are compared as integers. Other backends, match data and the first word
+    index use the words.
+    """
+    def __new__(cls, words, ids=(), vocabulary=None):
+        result = super(_WordIDs, cls).__new__(cls, words)
+        result.ids = tuple(ids)
+        result.vocabulary = vocabulary
+        return result
+
+
+def _get_speech_words(speech, grammar):
+    """
+    Get speech to match as a string, or as a tuple of words if it is a sequence
+    of words or word IDs. Word IDs are looked up in the grammar's vocabulary and
+    a ``_WordIDs`` tuple is returned if every word is given by its ID.
+
+    :param speech: str | sequence of words or word IDs
+    :param grammar: Grammar | None
+    :returns: str | tuple
+    :raises: TypeError
+    """
+    if isinstance(speech, string_types):
+        return speech
+
+    words = tuple(speech)
+    for i, word in enumerate(words):
+        if isinstance(word, integer_types):
+            if grammar is None:
+                raise TypeError("word IDs can only be matched with rules in a "
+                                "grammar")
+            vocabulary = grammar.vocabulary
+            decoded = tuple(word if isinstance(word, string_types) else
+                            vocabulary.get_word(word) for word in words)
+            if all(isinstance(word, integer_types) for word in words):
+                return _WordIDs(decoded, words, vocabulary)
+            return decoded
+        elif not isinstance(word, string_types):
+            raise TypeError("speech must be a string or a sequence of words or "
+                            "word IDs, not %r at index %d" % (word, i))
+    return words
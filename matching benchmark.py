@@ -23,13 +23,25 @@ This script uses (roughly) the following grammar::
 You can specify an alternative rule to benchmark with using the -r/--rule-string
 arguments.
 
+The -d/--shared-depth arguments use a grammar of D levels instead, where each level
+references the level below it several times::
+
+    <level0> = <word>;
+    <level1> = <level0> <level0> | <level0>;
+    ...
+    public <levelD> = <levelD-1> <levelD-1> | <levelD-1>;
+
+Use the -m/--memo-size arguments to memoize results of matching referenced rules
+with the pyparsing backend, or the -c/--compare-memo arguments to time matching
+with and without memoization.
+
 """
 
 import argparse
 import time
 
 from jsgf import (AlternativeSet, Repeat, Rule, Sequence, RuleRef, OptionalGrouping,
-                  parse_rule_string)
+                  parse_rule_string, Grammar, MatchingBackend)
 
 
 # Random sample of words from the CMU US English dictionary.
@@ -75,17 +87,47 @@ NUMBERS = [
 ]
 
 
+# Matching backends by lowercase name.
+BACKENDS = dict((name.lower(), value)
+                for name, value in vars(MatchingBackend).items()
+                if not name.startswith("_"))
+
+
 def do_benchmark(rule, strings, args):
     # Match each speech string.
     quiet = args.quiet
-    for speech in strings:
-        rule.matches(speech)
+    if args.workers is not None:
+        # Match the strings in a batch using worker processes.
+        results = rule.matches_many(strings, args.workers)
+    else:
+        results = (rule.matches(speech) for speech in strings)
 
+    for speech, _ in zip(strings, results):
         # Print (or don't print) speech strings.
         if not quiet:
             print("Generated string: %s" % speech)
 
 
+def make_shared_rules(depth):
+    # Make a rule graph where each level references the level below it several
+    # times, so the lower levels are matched at the same positions many times.
+    word = Rule("word", False, AlternativeSet(*WORDS))
+    rules = [word, Rule("level0", False, RuleRef(word))]
+    for i in range(1, depth + 1):
+        below = rules[-1]
+        rules.append(Rule("level%d" % i, i == depth, AlternativeSet(
+            Sequence(RuleRef(below), RuleRef(below)), RuleRef(below)
+        )))
+    return rules[-1], rules
+
+
+def time_benchmark(rule, strings, args):
+    # Return the time taken to match each speech string.
+    now = time.time()
+    do_benchmark(rule, strings, args)
+    return time.time() - now
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="matching benchmark.py",
@@ -104,6 +146,33 @@ def main():
         "-q", "--quiet", default=False, action="store_true",
         help="Suppress output of generated strings.",
     )
+    parser.add_argument(
+        "-b", "--backend", default="pyparsing",
+        choices=sorted(BACKENDS, key=BACKENDS.get),
+        help="Matching backend to use.",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None,
+        help=("Number of worker processes to match strings with using "
+              "'Rule.matches_many()'. Strings are matched one at a time "
+              "by default."),
+    )
+    parser.add_argument(
+        "-d", "--shared-depth", type=int, default=None,
+        help=("Use a grammar of D levels that each reference the level below "
+              "several times instead of the default grammar."),
+    )
+    parser.add_argument(
+        "-m", "--memo-size", type=int, default=0,
+        help=("Maximum number of results of matching referenced rules to "
+              "memoize for each string using 'Grammar.match_memo_size'. "
+              "Results are not memoized by default."),
+    )
+    parser.add_argument(
+        "-c", "--compare-memo", default=False, action="store_true",
+        help=("Whether to time matching strings without memoization and with "
+              "the memo size given by -m/--memo-size (or 10000)."),
+    )
     parser.add_argument(
         "-p", "--profile", default=False, action="store_true",
         help=("Whether to run the benchmark through 'cProfile'. If the module is "
@@ -114,20 +183,39 @@ def main():
     args = parser.parse_args()
 
     # Set up rules for testing.
-    if not args.rule_string or args.rule_string == 'default':
+    if args.shared_depth is not None:
+        rule, rules = make_shared_rules(args.shared_depth)
+    elif not args.rule_string or args.rule_string == 'default':
         word = Rule("word", False, AlternativeSet(*WORDS))
         number = Rule("number", False, AlternativeSet(*NUMBERS))
         rule = Rule("series", True, Repeat(Sequence(
             RuleRef(word), OptionalGrouping(RuleRef(number))
         )))
+        rules = [rule, word, number]
     else:
         rule = parse_rule_string(args.rule_string)
+        rules = [rule]
+
+    # Add the rules to a grammar using the specified matching backend.
+    grammar = Grammar()
+    grammar.matching_backend = BACKENDS[args.backend]
+    grammar.add_rules(*rules)
+    grammar.match_memo_size = args.memo_size
 
     # Generate N speech strings to test how well the matching performs.
     strings = []
     for _ in range(args.n):
         strings.append(rule.generate())
 
+    if args.compare_memo:
+        # Time matching the strings without and with memoization.
+        for memo_size in (0, args.memo_size or 10000):
+            grammar.match_memo_size = memo_size
+            print("Matched %d generated strings in %.3f seconds with a memo size "
+                  "of %d." % (args.n, time_benchmark(rule, strings, args),
+                              memo_size))
+        return
+
     if args.profile:
         try:
             # Try 'cProfile'.
@@ -142,15 +230,13 @@ def main():
             "do_benchmark": do_benchmark, "rule": rule, "strings": strings,
             "args": args
         })
+        elapsed = time.time() - now
     else:
         # Run the benchmark without profiling.
-        now = time.time()
-        do_benchmark(rule, strings, args)
+        elapsed = time_benchmark(rule, strings, args)
 
     # Print the time it took to match N generated strings.
-    after = time.time()
-    print("Matched %d generated strings in %.3f seconds." %
-          (args.n, after - now))
+    print("Matched %d generated strings in %.3f seconds." % (args.n, elapsed))
 
 
 if __name__ == '__main__':
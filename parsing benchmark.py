@@ -0,0 +1,169 @@
+#!/usr/bin/python
+"""
+Benchmarking script for pyjsgf's grammar parsers.
+
+This file generates a grammar string with a number of rules and times how long the
+'parser' and 'fast_parser' modules take to load it. Run the script with '-h' or
+'--help' to see available arguments.
+
+The generated grammar looks (roughly) like this::
+
+    #JSGF V1.0 UTF-8 en;
+    grammar benchmark;
+
+    // Rule 0.
+    public <rule0> = /3/ (word word [<rule1>]) {tag0} | /0.5/ ((word)+) {tag1} | ...;
+    ...
+
+Use the -a/--alternatives arguments to change the number of alternatives in each
+rule. The 'parser' module will fail to parse rules with very long alternative sets
+due to recursion depth limits.
+
+Use the -w/--workers argument to parse the rules in worker processes. The grammar
+is written to a temporary file in this case.
+
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from jsgf import parser, fast_parser
+
+
+# Words to use in generated rules.
+WORDS = [
+    "academy's", 'ackermanville', 'acri', 'adjudge', 'adventurer', "agencies'",
+    'amarante', 'angelucci', 'annoys', 'anselma', 'armbrust', 'bacchus', 'basquez',
+    'beakman', 'befuddled', 'bestows', 'body', 'bolshevik', 'bromides', 'bruso',
+    'calcified', 'campuses', 'carrico', 'cavalcade', 'cespedes', 'charms',
+    'chongqing', "chun's", 'clymene', 'conboy', 'contest', 'corrected', 'costley',
+    'short-sighted', 'showers', 'simard', 'snacking', 'solvents', 'sopko'
+]
+
+PARSERS = {"pyparsing": parser, "fast": fast_parser}
+
+
+def make_alternative(rng, n_rules):
+    # Make a random weighted alternative with groupings, references, repeats and
+    # tags.
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+    choice = rng.randint(0, 3)
+    if choice == 0:
+        expansion = "(%s [<rule%d>])" % (words, rng.randrange(n_rules))
+    elif choice == 1:
+        expansion = "[%s]" % words
+    elif choice == 2:
+        expansion = "((%s)+)" % words
+    else:
+        expansion = words
+    return "/%s/ %s {tag%d}" % (rng.choice(["1", "2.5", "3", "0.5"]), expansion,
+                                rng.randrange(100))
+
+
+def make_grammar_string(n_rules, n_alternatives, seed):
+    rng = random.Random(seed)
+    lines = ["#JSGF V1.0 UTF-8 en;", "grammar benchmark;", ""]
+    for i in range(n_rules):
+        alternatives = [make_alternative(rng, n_rules)
+                        for _ in range(n_alternatives)]
+        lines.append("// Rule %d." % i)
+        lines.append("%s<rule%d> = %s;" % ("public " if i % 2 == 0 else "", i,
+                                           " | ".join(alternatives)))
+    return "\n".join(lines) + "\n"
+
+
+def time_parser(module, s, path, workers):
+    # Return the time taken to parse the grammar string, or the grammar file if
+    # using worker processes.
+    now = time.time()
+    if workers > 1:
+        module.parse_grammar_file(path, workers=workers)
+    else:
+        module.parse_grammar_string(s)
+    return time.time() - now
+
+
+def time_grammar(name, s, path, args):
+    module = PARSERS[name]
+    if args.profile:
+        try:
+            # Try 'cProfile'.
+            import cProfile as profile_mod
+        except ImportError:
+            # Fallback on 'profile' (slower) if it isn't available.
+            import profile as profile_mod
+
+        # Run the benchmark via the imported module.
+        now = time.time()
+        profile_mod.runctx("time_parser(module, s, path, workers)", {}, {
+            "time_parser": time_parser, "module": module, "s": s, "path": path,
+            "workers": args.workers
+        })
+        elapsed = time.time() - now
+    else:
+        elapsed = time_parser(module, s, path, args.workers)
+
+    # Print the time it took to parse the grammar.
+    print("Parsed a grammar of %d rules in %.3f seconds with the %s parser."
+          % (args.n, elapsed, name))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="parsing benchmark.py",
+        description="pyjsgf parsing benchmark"
+    )
+    arg_parser.add_argument(
+        "-n", "--n-rules", type=int, default=500, dest="n",
+        help="Number of rules to generate."
+    )
+    arg_parser.add_argument(
+        "-a", "--alternatives", type=int, default=4,
+        help="Number of alternatives in each generated rule."
+    )
+    arg_parser.add_argument(
+        "-s", "--seed", type=int, default=0,
+        help="Seed for generating the grammar."
+    )
+    arg_parser.add_argument(
+        "-P", "--parser", default="both", choices=["both", "pyparsing", "fast"],
+        help="Parser to time. Both parsers are timed by default.",
+    )
+    arg_parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="Number of worker processes to parse rules with.",
+    )
+    arg_parser.add_argument(
+        "-p", "--profile", default=False, action="store_true",
+        help=("Whether to run the benchmark through 'cProfile'. If the module is "
+              "not available, then 'profile' will be used instead."),
+    )
+
+    # Parse the arguments.
+    args = arg_parser.parse_args()
+    s = make_grammar_string(args.n, args.alternatives, args.seed)
+    if args.parser == "both":
+        names = ["pyparsing", "fast"]
+    else:
+        names = [args.parser]
+
+    # Write the grammar to a file if using worker processes.
+    path = None
+    if args.workers > 1:
+        fd, path = tempfile.mkstemp(suffix=".jsgf")
+        with os.fdopen(fd, "w") as f:
+            f.write(s)
+
+    try:
+        for name in names:
+            time_grammar(name, s, path, args)
+    finally:
+        if path is not None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import threading
+import time
+import unittest
+
+from jsgf import *
+from jsgf.ext import DictationGrammar
+
+try:
+    import asyncio
+    from jsgf.async_grammars import AsyncGrammar
+except (ImportError, SyntaxError):
+    AsyncGrammar = None
+
+
+@unittest.skipIf(AsyncGrammar is None, "requires Python 3.5 or higher")
+class AsyncGrammarCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.grammar = Grammar()
+        self.greet = PublicRule("greet", Sequence("hello", "world"))
+        self.grammar.add_rule(self.greet)
+        self.async_grammar = AsyncGrammar(self.grammar)
+
+        # Count calls to find_matching_rules() and optionally block them until an
+        # event is set.
+        self.calls = []
+        self.event = threading.Event()
+        self.event.set()
+        find_matching_rules = self.grammar.find_matching_rules
+
+        def wrapper(speech):
+            self.calls.append(speech)
+            self.event.wait(5)
+            return find_matching_rules(speech)
+
+        self.grammar.find_matching_rules = wrapper
+
+    def tearDown(self):
+        self.event.set()
+        self.async_grammar.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until_complete(self, *coroutines):
+        return self.loop.run_until_complete(asyncio.gather(
+            *coroutines, return_exceptions=True
+        ))
+
+    def test_find_matching_rules(self):
+        result = self.run_until_complete(
+            self.async_grammar.find_matching_rules("hello world"),
+            self.async_grammar.find_matching_rules("goodbye"),
+        )
+        self.assertEqual(result, [[self.greet], []])
+
+    def test_match(self):
+        result, = self.run_until_complete(self.async_grammar.match("hello world"))
+        self.assertEqual([r.rule for r in result], [self.greet])
+        self.assertEqual(result[0].current_match, "hello world")
+
+    def test_dictation_grammar(self):
+        grammar = DictationGrammar([self.greet])
+        async_grammar = AsyncGrammar(grammar)
+        result = self.run_until_complete(
+            async_grammar.find_matching_rules("hello world")
+        )
+        async_grammar.close()
+        self.assertEqual(result, [[self.greet]])
+
+    def test_coalescing(self):
+        # Concurrent requests for the same speech should share one call.
+        self.event.clear()
+        self.loop.call_later(0.1, self.event.set)
+        result = self.run_until_complete(*[
+            self.async_grammar.find_matching_rules(speech)
+            for speech in ["hello world", "hello world", "goodbye", "hello world"]
+        ])
+        self.assertEqual(result, [[self.greet], [self.greet], [], [self.greet]])
+        self.assertEqual(sorted(self.calls), ["goodbye", "hello world"])
+
+        # Results should not be the same list objects.
+        self.assertIsNot(result[0], result[1])
+
+    def test_timeout(self):
+        self.event.clear()
+        result, = self.run_until_complete(
+            self.async_grammar.find_matching_rules("hello world", timeout=0.05)
+        )
+        self.assertIsInstance(result, asyncio.TimeoutError)
+
+    def test_timeout_with_other_callers(self):
+        # Timeouts should not cancel calls that other callers are waiting for.
+        self.event.clear()
+        self.loop.call_later(0.1, self.event.set)
+        result = self.run_until_complete(
+            self.async_grammar.find_matching_rules("hello world", timeout=0.01),
+            self.async_grammar.find_matching_rules("hello world"),
+        )
+        self.assertIsInstance(result[0], asyncio.TimeoutError)
+        self.assertEqual(result[1], [self.greet])
+
+    def test_cancellation(self):
+        # Cancelling a request should stop the call if it hasn't started.
+        self.event.clear()
+        first = asyncio.ensure_future(
+            self.async_grammar.find_matching_rules("hello world")
+        )
+        second = asyncio.ensure_future(
+            self.async_grammar.update(lambda: None)
+        )
+        third = asyncio.ensure_future(
+            self.async_grammar.find_matching_rules("goodbye")
+        )
+        self.loop.call_later(0.05, third.cancel)
+        self.loop.call_later(0.1, self.event.set)
+        result = self.run_until_complete(first, second, third)
+        self.assertEqual(result[0], [self.greet])
+        self.assertIsInstance(result[2], asyncio.CancelledError)
+        self.assertEqual(self.calls, ["hello world"])
+
+    def test_update_ordering(self):
+        # Updates should wait for earlier requests, and later requests should wait
+        # for updates.
+        self.event.clear()
+        self.loop.call_later(0.1, self.event.set)
+        rule = PublicRule("goodbye", "goodbye")
+        result = self.run_until_complete(
+            self.async_grammar.find_matching_rules("goodbye"),
+            self.async_grammar.update(self.grammar.add_rule, rule),
+            self.async_grammar.find_matching_rules("goodbye"),
+            self.async_grammar.update(self.grammar.disable_rule, rule),
+            self.async_grammar.find_matching_rules("goodbye"),
+        )
+        self.assertEqual(result, [[], None, [rule], None, []])
+        self.assertEqual(self.calls, ["goodbye"] * 3)
+
+    def test_event_loop_not_blocked(self):
+        # The event loop should keep running while matching.
+        self.event.clear()
+        ticks = []
+
+        # Schedule callbacks instead of using a coroutine, because 'async'
+        # syntax can't be compiled by Python versions older than 3.5.
+        def tick():
+            ticks.append(time.time())
+            if len(ticks) < 5:
+                self.loop.call_later(0.01, tick)
+            else:
+                self.event.set()
+
+        self.loop.call_soon(tick)
+        self.run_until_complete(
+            self.async_grammar.find_matching_rules("hello world")
+        )
+        self.assertEqual(len(ticks), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,563 @@
+import unittest
+
+from jsgf import *
+from jsgf.ext import Dictation, DictationGrammar
+
+
+class AutomatonMatchingCase(unittest.TestCase):
+    """
+    Base test case for matching rules with the automaton backend.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = MatchingBackend.Automaton
+
+    def add_rule(self, expansion, name="test"):
+        rule = PublicRule(name, expansion)
+        self.grammar.add_rule(rule)
+        return rule
+
+
+class BackendSelectionCase(AutomatonMatchingCase):
+    def test_default_backend(self):
+        self.assertEqual(Grammar().matching_backend, MatchingBackend.Pyparsing)
+        self.assertEqual(PublicRule("test", "hello").matching_backend,
+                         MatchingBackend.Pyparsing)
+
+    def test_rule_backend(self):
+        rule = self.add_rule("hello")
+        self.assertEqual(rule.matching_backend, MatchingBackend.Automaton)
+
+    def test_invalid_backend(self):
+        def set_backend(value):
+            self.grammar.matching_backend = value
+
+        self.assertRaises(ValueError, set_backend, 4)
+        self.assertRaises(ValueError, set_backend, "automaton")
+
+    def test_dictation_grammar_backend(self):
+        grammar = DictationGrammar()
+        grammar.matching_backend = MatchingBackend.Automaton
+        self.assertEqual(grammar._jsgf_only_grammar.matching_backend,
+                         MatchingBackend.Automaton)
+        grammar.add_rule(PublicRule("test", Sequence("hello", Dictation())))
+        grammar.add_rule(PublicRule("greet", "hello world"))
+        self.assertEqual([r.name for r in grammar.find_matching_rules("hello")],
+                         ["test"])
+        self.assertEqual(
+            sorted(r.name for r in grammar.find_matching_rules("hello world")),
+            ["greet", "test"]
+        )
+
+
+class AutomatonMatchesCase(AutomatonMatchingCase):
+    def test_literal(self):
+        e = Literal("hello world")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hello world"))
+        self.assertTrue(r.matches("  HELLO   world "))
+        self.assertEqual(e.current_match, "hello world")
+        self.assertEqual(e.matching_slice, slice(0, 13))
+        self.assertFalse(r.matches("hello"))
+        self.assertIsNone(e.current_match)
+        self.assertFalse(r.matches("hello world hello"))
+
+    def test_case_sensitive(self):
+        r = self.add_rule("Hello")
+        r.case_sensitive = True
+        self.assertTrue(r.matches("Hello"))
+        self.assertFalse(r.matches("hello"))
+
+    def test_sequence(self):
+        e = Sequence("hello", "world")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hello world"))
+        self.assertEqual(e.children[0].current_match, "hello")
+        self.assertEqual(e.children[1].current_match, "world")
+        self.assertEqual(e.children[1].matching_slice, slice(6, 11))
+        self.assertFalse(r.matches("world hello"))
+
+    def test_alt_set(self):
+        e = AlternativeSet("hello", "hi", "hey there")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hi"))
+        self.assertEqual(e.current_match, "hi")
+        self.assertEqual(e.children[1].current_match, "hi")
+        self.assertIsNone(e.children[0].current_match)
+        self.assertTrue(r.matches("hey there"))
+        self.assertFalse(r.matches("hey"))
+
+    def test_alt_set_weights(self):
+        e = AlternativeSet("a", "b", "c")
+        e.weights = {"a": 0, "b": 1, "c": 2}
+        r = self.add_rule(e)
+        self.assertFalse(r.matches("a"))
+        self.assertTrue(r.matches("b"))
+        self.assertTrue(r.matches("c"))
+
+    def test_alt_set_longest_literal(self):
+        e = Repeat(AlternativeSet("up", "up up"))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("up up up"))
+        self.assertEqual(e.repetitions_matched, 2)
+        self.assertEqual(e.get_expansion_matches(e.child.children[1]),
+                         ["up up", None])
+
+    def test_alt_set_literal_trie(self):
+        words = ["word%d" % i for i in range(1000)]
+        e = Repeat(AlternativeSet("up", "up arrow", "Up Arrow Key", *words))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("word999 up arrow up up arrow key word0"))
+        self.assertEqual(e.get_expansion_matches(e.child), [
+            "word999", "up arrow", "up", "Up Arrow Key", "word0"
+        ])
+        self.assertEqual(e.get_expansion_slices(e.child), [
+            slice(0, 7), slice(8, 16), slice(17, 19), slice(20, 32),
+            slice(33, 38)
+        ])
+        self.assertEqual(e.get_expansion_matches(e.child.children[1]),
+                         [None, "up arrow", None, None, None])
+        self.assertFalse(r.matches("word1000"))
+
+        # Shorter literals are used if the longer ones don't lead to a match.
+        e = Sequence(AlternativeSet("up", "up arrow"), "arrow")
+        r = self.add_rule(e, "test2")
+        self.assertTrue(r.matches("up arrow"))
+        self.assertEqual(e.children[0].current_match, "up")
+
+        # Empty matches after literals have the right slices.
+        e = Sequence(AlternativeSet("up", "up arrow"), KleeneStar("down"))
+        r = self.add_rule(e, "test3")
+        self.assertTrue(r.matches("up arrow"))
+        self.assertEqual(e.children[1].matching_slice, slice(8, 8))
+
+    def test_alt_set_literal_trie_case(self):
+        e = AlternativeSet("Hello", "hello there")
+        r = self.add_rule(e)
+        r.case_sensitive = True
+        self.assertTrue(r.matches("Hello"))
+        self.assertFalse(r.matches("hello"))
+        self.assertFalse(r.matches("HELLO THERE"))
+        e.children[0].case_sensitive = False
+        self.assertTrue(r.matches("hello"))
+        self.assertEqual(e.current_match, "Hello")
+
+    def test_optional(self):
+        e = Sequence("hello", OptionalGrouping("there"))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hello"))
+        self.assertEqual(e.children[1].current_match, "")
+        self.assertEqual(e.children[1].child.current_match, "")
+        self.assertTrue(r.matches("hello there"))
+        self.assertEqual(e.children[1].current_match, "there")
+
+    def test_ambiguous_optional(self):
+        # Ambiguous expansions can be matched by the automaton backend.
+        e = Sequence(OptionalGrouping("test"), "test")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("test"))
+        self.assertEqual(e.children[0].current_match, "")
+        self.assertEqual(e.children[1].current_match, "test")
+        self.assertTrue(r.matches("test test"))
+        self.assertEqual(e.children[0].current_match, "test")
+
+    def test_repeat(self):
+        e = Repeat(AlternativeSet("a", "b"))
+        r = self.add_rule(e)
+        self.assertFalse(r.matches(""))
+        self.assertTrue(r.matches("a b a"))
+        self.assertEqual(e.repetitions_matched, 3)
+        self.assertEqual(e.get_expansion_matches(e.child), ["a", "b", "a"])
+        self.assertEqual(e.get_expansion_slices(e.child),
+                         [slice(0, 1), slice(2, 3), slice(4, 5)])
+
+    def test_repeat_backtracking(self):
+        # Greedy repeats give back repetitions if necessary.
+        e = Sequence(Repeat("a"), "a")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("a a a"))
+        self.assertEqual(e.children[0].repetitions_matched, 2)
+
+    def test_kleene_star(self):
+        e = Sequence("hello", KleeneStar("there"))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hello"))
+        self.assertEqual(e.children[1].current_match, "")
+        self.assertEqual(e.children[1].repetitions_matched, 0)
+        self.assertTrue(r.matches("hello there there"))
+        self.assertEqual(e.children[1].repetitions_matched, 2)
+
+    def test_rule_refs(self):
+        name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        e1, e2 = RuleRef(name), NamedRuleRef("name")
+        r = self.add_rule(Sequence("hello", e1, "and", e2))
+        self.grammar.add_rule(name)
+        self.assertTrue(r.matches("hello alice and bob"))
+        self.assertEqual(e1.current_match, "alice")
+        self.assertEqual(e2.current_match, "bob")
+        self.assertEqual(name.expansion.current_match, "bob")
+
+    def test_recursive_rule_ref(self):
+        r = self.add_rule(Sequence("a", OptionalGrouping(NamedRuleRef("test"))))
+        self.assertRaises(GrammarError, r.matches, "a a")
+
+    def test_null_and_void(self):
+        r1 = self.add_rule(Sequence("hello", NullRef()), "r1")
+        r2 = self.add_rule(AlternativeSet("hello", VoidRef()), "r2")
+        r3 = self.add_rule(Sequence("hello", VoidRef()), "r3")
+        self.assertTrue(r1.matches("hello"))
+        self.assertTrue(r2.matches("hello"))
+        self.assertFalse(r3.matches("hello"))
+
+    def test_dictation(self):
+        e = Sequence("say", Dictation(), "please")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("say hello world please"))
+        self.assertEqual(e.children[1].current_match, "hello world")
+        self.assertFalse(r.matches("say please"))
+
+    def test_expansion_prefix_match(self):
+        e = Sequence("hello", OptionalGrouping("there"))
+        self.add_rule(e)
+        self.assertEqual(e.matches("hello there world"), "world")
+        self.assertEqual(e.current_match, "hello there")
+        self.assertEqual(e.matches("goodbye"), "goodbye")
+        self.assertIsNone(e.current_match)
+
+    def test_disabled_rule(self):
+        r = self.add_rule("hello")
+        r.disable()
+        self.assertFalse(r.matches("hello"))
+
+    def test_find_matching_rules(self):
+        self.add_rule("hello", "r1")
+        self.add_rule(AlternativeSet("hi", "hello"), "r2")
+        self.add_rule("goodbye", "r3")
+        self.assertEqual(
+            sorted(r.name for r in self.grammar.find_matching_rules("hello")),
+            ["r1", "r2"]
+        )
+
+
+class AutomatonFindMatchingRulesCase(AutomatonMatchingCase):
+    def setUp(self):
+        super(AutomatonFindMatchingRulesCase, self).setUp()
+        self.name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        self.greet = self.add_rule(Sequence(
+            AlternativeSet("hello", "hi"), NamedRuleRef("name")
+        ), "greet")
+        self.call = self.add_rule(Sequence("call", NamedRuleRef("name")), "call")
+        self.names = self.add_rule(Repeat(NamedRuleRef("name")), "names")
+        self.grammar.add_rule(self.name)
+
+    def find(self, speech):
+        return [r.name for r in self.grammar.find_matching_rules(speech)]
+
+    def test_match_data(self):
+        self.assertEqual(self.find("hi bob"), ["greet"])
+        self.assertEqual(self.greet.expansion.current_match, "hi bob")
+        self.assertEqual(self.greet.expansion.children[1].current_match, "bob")
+        self.assertEqual(self.greet.expansion.children[1].matching_slice,
+                         slice(3, 6))
+        self.assertIsNone(self.call.expansion.current_match)
+        self.assertIsNone(self.names.expansion.current_match)
+
+        # Rules that don't match should have their match data reset, except for
+        # expansions shared with matching rules.
+        self.assertEqual(self.find("call alice"), ["call"])
+        self.assertIsNone(self.greet.expansion.current_match)
+        self.assertEqual(self.call.expansion.children[1].current_match, "alice")
+        self.assertEqual(self.name.expansion.current_match, "alice")
+        self.assertEqual(self.find("bob alice bob"), ["names"])
+        self.assertEqual(self.names.expansion.repetitions_matched, 3)
+        self.assertEqual(self.find("goodbye"), [])
+
+    def test_same_as_separate_matching(self):
+        # Test that the same rules are found as with the pyparsing backend.
+        for speech in ["hello alice", "call bob", "alice", "call", "hi hi", ""]:
+            self.grammar.matching_backend = MatchingBackend.Automaton
+            result = self.find(speech)
+            self.grammar.matching_backend = MatchingBackend.Pyparsing
+            self.assertEqual(result, self.find(speech))
+
+    def test_disabled_and_hidden_rules(self):
+        self.grammar.disable_rule("call")
+        self.assertEqual(self.find("call bob"), [])
+        self.assertEqual(self.find("bob"), ["names"])
+        self.grammar.enable_rule("call")
+        self.assertEqual(self.find("call bob"), ["call"])
+        self.call.visible = False
+        self.assertEqual(self.find("call bob"), [])
+
+    def test_rules_overriding_matches(self):
+        # Rules that override matches() should still be used.
+        class AlwaysMatchingRule(PublicRule):
+            def matches(self, speech):
+                return True
+
+        self.grammar.add_rule(AlwaysMatchingRule("always", "hello"))
+        self.assertEqual(self.find("call bob"), ["call", "always"])
+
+    def test_grammar_changes(self):
+        self.assertEqual(self.find("call carol"), [])
+        self.name.expansion.children.append(Literal("carol"))
+        self.assertEqual(self.find("call carol"), ["call"])
+        self.add_rule("carol", "carol")
+        self.assertEqual(self.find("carol"), ["names", "carol"])
+        self.grammar.remove_rule("names")
+        self.assertEqual(self.find("carol"), ["carol"])
+
+
+class MatchResultCase(AutomatonMatchingCase):
+    def setUp(self):
+        super(MatchResultCase, self).setUp()
+        self.name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        self.name.expansion.tag = "name"
+        self.greeting = AlternativeSet("hello", "hi")
+        self.greeting.tag = "greeting"
+        self.optional = OptionalGrouping("there")
+        self.ref = NamedRuleRef("name")
+        self.greet = self.add_rule(Sequence(
+            self.greeting, self.optional, self.ref
+        ), "greet")
+        self.repeat = Repeat(NamedRuleRef("name"))
+        self.names = self.add_rule(Sequence("call", self.repeat), "names")
+        self.grammar.add_rule(self.name)
+
+    def assert_untouched(self, rule):
+        map_expansion(rule.expansion, lambda e: (
+            self.assertIsNone(e.current_match),
+            self.assertIsNone(e.matching_slice)
+        ))
+
+    def test_rule_match(self):
+        result = self.greet.match("  hi alice ")
+        self.assertEqual(result.rule, self.greet)
+        self.assertIs(result.expansion, self.greet.expansion)
+        self.assertEqual(result.speech, "hi alice")
+        self.assertEqual(result.current_match, "hi alice")
+        self.assertEqual(result.get_current_match(self.greeting), "hi")
+        self.assertEqual(result.get_matching_slice(self.greeting), slice(0, 2))
+        self.assertEqual(result.get_current_match(self.optional), "")
+        self.assertEqual(result.get_matching_slice(self.optional), slice(3, 3))
+        self.assertEqual(result.get_current_match(self.ref), "alice")
+        self.assertEqual(result.get_matching_slice(self.ref), slice(3, 8))
+        self.assertEqual(result.get_current_match(self.name.expansion), "alice")
+        self.assertEqual(result.matched_tags, ["greeting", "name"])
+        self.assert_untouched(self.greet)
+        self.assert_untouched(self.name)
+
+    def test_no_match(self):
+        self.assertIsNone(self.greet.match("hi"))
+        self.assertIsNone(self.greet.match("goodbye alice"))
+        self.grammar.disable_rule(self.greet)
+        self.assertIsNone(self.greet.match("hi alice"))
+
+    def test_unknown_expansion(self):
+        result = self.greet.match("hi alice")
+        self.assertRaises(ValueError, result.get_current_match, Literal("hi"))
+        self.assertRaises(ValueError, result.get_matching_slice,
+                          self.names.expansion)
+
+    def test_repetitions(self):
+        result = self.names.match("call bob alice bob")
+        child = self.repeat.child
+        self.assertEqual(result.get_repetitions_matched(self.repeat), 3)
+        self.assertEqual(result.get_expansion_matches(self.repeat, child),
+                         ["bob", "alice", "bob"])
+        self.assertEqual(result.get_expansion_slices(self.repeat, child),
+                         [slice(5, 8), slice(9, 14), slice(15, 18)])
+        self.assertEqual(result.get_expansion_matches(self.repeat,
+                                                      self.name.expansion),
+                         ["bob", "alice", "bob"])
+        self.assertEqual(result.get_expansion_matches(
+            self.repeat, self.names.expansion.children[0]), [])
+        self.assertEqual(result.get_current_match(child), "bob")
+        self.assert_untouched(self.names)
+
+    def test_same_as_matches(self):
+        # Match results should have the same data as the expansions after using
+        # Rule.matches().
+        for speech in ["hello there bob", "hi alice", "call alice bob"]:
+            for rule in (self.greet, self.names):
+                result = rule.match(speech)
+                if not rule.matches(speech):
+                    self.assertIsNone(result)
+                    continue
+
+                def check(e):
+                    self.assertEqual(result.get_current_match(e), e.current_match)
+                    self.assertEqual(result.get_matching_slice(e),
+                                     e.matching_slice)
+                    self.assertEqual(result.had_match(e), e.had_match)
+
+                map_expansion(rule.expansion, check)
+                self.assertEqual(result.matched_tags, rule.matched_tags)
+
+    def test_grammar_match(self):
+        self.grammar.matching_backend = MatchingBackend.Pyparsing
+        results = self.grammar.match("hi bob")
+        self.assertEqual([r.rule for r in results], [self.greet])
+        self.assertEqual(results[0].get_current_match(self.ref), "bob")
+        results = self.grammar.match("call bob bob")
+        self.assertEqual([r.rule for r in results], [self.names])
+        self.assertEqual(self.grammar.match("goodbye"), [])
+        self.assert_untouched(self.greet)
+        self.assert_untouched(self.names)
+
+    def test_grammar_match_threads(self):
+        import threading
+
+        speech = ["hi alice", "hello there bob", "call alice bob", "goodbye"]
+        expected = [[(r.rule.name, r.current_match)
+                     for r in self.grammar.match(s)] for s in speech]
+        errors = []
+
+        def run():
+            for _ in range(50):
+                for s, e in zip(speech, expected):
+                    result = [(r.rule.name, r.current_match)
+                              for r in self.grammar.match(s)]
+                    if result != e:
+                        errors.append((s, result))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+
+class MatchStreamCase(AutomatonMatchingCase):
+    def setUp(self):
+        super(MatchStreamCase, self).setUp()
+        self.name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        self.greet = self.add_rule(Sequence(
+            AlternativeSet("hello", "hi there"), NamedRuleRef("name")
+        ), "greet")
+        self.call = self.add_rule(Sequence(
+            "call", NamedRuleRef("name"), OptionalGrouping("now")
+        ), "call")
+        self.names = self.add_rule(Repeat(NamedRuleRef("name")), "names")
+        self.grammar.add_rule(self.name)
+
+    def names_of(self, rules):
+        return [r.name for r in rules]
+
+    def test_feed(self):
+        stream = self.grammar.begin_stream()
+        self.assertEqual(stream.words, [])
+        self.assertEqual(self.names_of(stream.viable_rules),
+                         ["greet", "call", "names"])
+        self.assertEqual(stream.matching_rules, [])
+
+        stream.feed("call")
+        self.assertEqual(self.names_of(stream.viable_rules), ["call"])
+        self.assertEqual(stream.matching_rules, [])
+        stream.feed("bob")
+        self.assertEqual(self.names_of(stream.viable_rules), ["call"])
+        self.assertEqual(self.names_of(stream.matching_rules), ["call"])
+        stream.feed("now")
+        self.assertEqual(self.names_of(stream.matching_rules), ["call"])
+        stream.feed("please")
+        self.assertEqual(stream.viable_rules, [])
+        self.assertEqual(stream.matching_rules, [])
+        self.assertEqual(stream.words, ["call", "bob", "now", "please"])
+
+    def test_feed_several_words(self):
+        stream = self.grammar.begin_stream()
+        stream.feed("  hi there ")
+        self.assertEqual(stream.words, ["hi", "there"])
+        self.assertEqual(self.names_of(stream.viable_rules), ["greet"])
+        stream.feed("alice")
+        self.assertEqual(self.names_of(stream.matching_rules), ["greet"])
+
+    def test_same_as_find_matching_rules(self):
+        for speech in ["hi there alice", "call bob now", "bob alice bob",
+                       "call", "hello hello", "", "alice"]:
+            stream = self.grammar.begin_stream()
+            stream.feed(speech)
+            self.assertEqual(stream.matching_rules,
+                             self.grammar.find_matching_rules(speech))
+
+    def test_match(self):
+        stream = self.grammar.begin_stream()
+        stream.feed("call  Alice")
+        self.assertEqual(stream.speech, "call Alice")
+        results = stream.match()
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result.rule, self.call)
+        self.assertEqual(result.current_match, "call alice")
+        ref = self.call.expansion.children[1]
+        self.assertEqual(result.get_current_match(ref), "alice")
+        self.assertEqual(result.get_matching_slice(ref), slice(5, 10))
+        self.assertIsNone(self.call.expansion.current_match)
+        self.assertEqual(
+            [(m.rule, m.current_match) for m in stream.match()],
+            [(m.rule, m.current_match)
+             for m in self.grammar.match("call Alice")]
+        )
+
+    def test_rules_matching_any_speech(self):
+        optional = self.add_rule(OptionalGrouping("test"), "optional")
+        stream = self.grammar.begin_stream()
+        self.assertEqual(stream.matching_rules, [optional])
+        stream.feed("anything")
+        self.assertEqual(stream.viable_rules, [optional])
+        self.assertEqual(stream.matching_rules, [optional])
+
+    def test_grammar_changes(self):
+        # Changes after starting a stream are not used by it.
+        stream = self.grammar.begin_stream()
+        self.name.expansion.children.append(Literal("carol"))
+        stream.feed("carol")
+        self.assertEqual(stream.viable_rules, [])
+        stream = self.grammar.begin_stream()
+        stream.feed("carol")
+        self.assertEqual(self.names_of(stream.matching_rules), ["names"])
+
+    def test_automaton_stream(self):
+        automata = [r.expansion._get_automaton()
+                    for r in (self.greet, self.call, self.names)]
+        automaton_set = AutomatonSet(automata)
+        stream = automaton_set.begin_stream([1, 2])
+        self.assertEqual(stream.viable, [1, 2])
+        stream.feed("bob")
+        self.assertEqual(stream.viable, [2])
+        self.assertEqual(stream.matched, [2])
+        results = stream.match()
+        self.assertEqual(results[:2], [None, None])
+        self.assertEqual(results[2].current_match, "bob")
+
+
+class AutomatonInvalidationCase(AutomatonMatchingCase):
+    def test_invalidation(self):
+        e = AlternativeSet("a", "b")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("a"))
+        e.children.append(Literal("c"))
+        self.assertTrue(r.matches("c"))
+        e.children.pop(0)
+        self.assertFalse(r.matches("a"))
+        self.assertTrue(r.matches("b"))
+
+    def test_invalidation_of_references(self):
+        name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        r = self.add_rule(Sequence("hello", NamedRuleRef("name")))
+        self.grammar.add_rule(name)
+        self.assertTrue(r.matches("hello alice"))
+        name.expansion.children.append(Literal("carol"))
+        self.assertTrue(r.matches("hello carol"))
+
+    def test_backend_change(self):
+        e = Sequence(OptionalGrouping("test"), "test")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("test"))
+        self.grammar.matching_backend = MatchingBackend.Pyparsing
+        self.assertFalse(r.matches("test"))
+
+
+if __name__ == '__main__':
+    unittest.main()
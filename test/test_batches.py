@@ -0,0 +1,66 @@
+import unittest
+
+from jsgf import *
+from jsgf.batches import match_many
+
+
+def _speech_length(target, speech):
+    return target + len(speech)
+
+
+class MatchManyCase(unittest.TestCase):
+    def test_in_process(self):
+        # Batches smaller than workers * chunk_size are matched in this process.
+        result = match_many(1, _speech_length, ["a", "bb"], workers=2, chunk_size=2)
+        self.assertEqual(list(result), [2, 3])
+
+    def test_single_worker(self):
+        result = match_many(0, _speech_length, ["a"] * 10, workers=1, chunk_size=1)
+        self.assertEqual(list(result), [1] * 10)
+
+    def test_worker_processes(self):
+        speech = ["x" * i for i in range(20)]
+        result = match_many(1, _speech_length, iter(speech), workers=2,
+                            chunk_size=3)
+        self.assertEqual(list(result), list(range(1, 21)))
+
+    def test_invalid_chunk_size(self):
+        self.assertRaises(ValueError, list, match_many(0, _speech_length, ["a"],
+                                                       chunk_size=0))
+
+
+class ManyMatchesCase(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar()
+        self.name = PrivateRule("name", AlternativeSet("alice", "bob"))
+        self.greet = PublicRule("greet", Sequence("hello", RuleRef(self.name)))
+        self.call = PublicRule("call", Sequence("call", RuleRef(self.name)))
+        self.grammar.add_rules(self.name, self.greet, self.call)
+        self.speech = ["hello alice", "call bob", "goodbye", "hello bob"] * 4
+
+    def test_rule_matches_many(self):
+        expected = [self.greet.matches(s) for s in self.speech]
+        for workers in (1, 2):
+            result = self.greet.matches_many(self.speech, workers, chunk_size=2)
+            self.assertEqual(list(result), expected)
+
+    def test_find_matching_rules_many(self):
+        expected = [self.grammar.find_matching_rules(s) for s in self.speech]
+        for workers in (1, 2):
+            result = list(self.grammar.find_matching_rules_many(
+                self.speech, workers, chunk_size=2
+            ))
+            self.assertEqual(result, expected)
+
+            # Rules in the results should be the rules in this grammar.
+            self.assertIs(result[0][0], self.greet)
+
+    def test_automaton_backend(self):
+        self.grammar.matching_backend = MatchingBackend.Automaton
+        expected = [self.grammar.find_matching_rules(s) for s in self.speech]
+        result = self.grammar.find_matching_rules_many(self.speech, 2, 2)
+        self.assertEqual(list(result), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
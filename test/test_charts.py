@@ -0,0 +1,315 @@
+import unittest
+
+import jsgf.charts
+from jsgf import *
+from jsgf.ext import Dictation
+
+
+class ChartMatchingCase(unittest.TestCase):
+    """
+    Base test case for matching rules with the chart backend.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = MatchingBackend.Chart
+
+    def add_rule(self, expansion, name="test"):
+        rule = PublicRule(name, expansion)
+        self.grammar.add_rule(rule)
+        return rule
+
+    def add_recursive_rule(self, name, make_alternative, *alternatives):
+        # Add a rule with an alternative set that references the rule itself.
+        rule = self.add_rule(AlternativeSet(*alternatives), name)
+        rule.expansion.children.insert(0, make_alternative(RuleRef(rule)))
+        return rule
+
+
+class ChartMatchesCase(ChartMatchingCase):
+    def test_rule_backend(self):
+        rule = self.add_rule("hello")
+        self.assertEqual(rule.matching_backend, MatchingBackend.Chart)
+
+    def test_literal(self):
+        e = Literal("hello world")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("  HELLO   world "))
+        self.assertEqual(e.current_match, "hello world")
+        self.assertEqual(e.matching_slice, slice(0, 13))
+        self.assertFalse(r.matches("hello"))
+        self.assertIsNone(e.current_match)
+
+    def test_ambiguous_optional(self):
+        e = Sequence(OptionalGrouping("test"), "test")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("test"))
+        self.assertEqual(e.children[0].current_match, "")
+        self.assertEqual(e.children[1].current_match, "test")
+        self.assertTrue(r.matches("test test"))
+        self.assertEqual(e.children[0].current_match, "test")
+        self.assertFalse(r.matches("test test test"))
+
+    def test_ambiguous_repeats(self):
+        # Greedy repeats are preferred and give back repetitions if necessary.
+        e = Sequence(Repeat("a"), KleeneStar("a"), "a")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("a a a a"))
+        self.assertEqual(e.children[0].repetitions_matched, 3)
+        self.assertEqual(e.children[1].repetitions_matched, 0)
+
+    def test_alt_set_literal_table(self):
+        words = ["word%d" % i for i in range(1000)]
+        e = Repeat(AlternativeSet("up", "up arrow", "Up Arrow Key", *words))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("word999 up arrow up up arrow key word0"))
+        self.assertEqual(e.get_expansion_matches(e.child), [
+            "word999", "up arrow", "up", "Up Arrow Key", "word0"
+        ])
+        self.assertFalse(r.matches("word1000"))
+
+    def test_dictation(self):
+        e = Sequence("say", Dictation(), "please")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("say hello world please"))
+        self.assertEqual(e.children[1].current_match, "hello world")
+        self.assertFalse(r.matches("say please"))
+
+    def test_expansion_prefix_match(self):
+        e = Sequence("hello", OptionalGrouping("there"))
+        self.add_rule(e)
+        self.assertEqual(e.matches("hello there world"), "world")
+        self.assertEqual(e.children[1].current_match, "there")
+
+    def test_same_as_automaton(self):
+        # The same parse is preferred as with the automaton backend.
+        def make_rules():
+            name = PrivateRule("name", AlternativeSet("alice", "bob",
+                                                     "alice bob"))
+            e = Sequence(KleeneStar(AlternativeSet(NamedRuleRef("name"),
+                                                   Dictation())),
+                         OptionalGrouping(Repeat("bob")), NamedRuleRef("name"))
+            return PublicRule("test", e), name
+
+        automaton_grammar = Grammar()
+        automaton_grammar.matching_backend = MatchingBackend.Automaton
+        automaton_grammar.add_rules(*make_rules())
+        self.grammar.add_rules(*make_rules())
+        for speech in ["alice bob", "bob bob bob", "hello alice bob bob",
+                       "alice bob alice bob", "hello world"]:
+            expected = automaton_grammar.get_rule("test").match(speech)
+            result = self.grammar.get_rule("test").match(speech)
+            self.assertEqual(expected is None, result is None)
+            if result is None:
+                continue
+            for e1, e2 in zip(flat_map_expansion(expected.expansion),
+                              flat_map_expansion(result.expansion)):
+                self.assertEqual(expected.get_current_match(e1),
+                                 result.get_current_match(e2))
+                self.assertEqual(expected.get_matching_slice(e1),
+                                 result.get_matching_slice(e2))
+
+
+class ChartRecursionCase(ChartMatchingCase):
+    def test_right_recursion(self):
+        r = self.add_recursive_rule("test", lambda ref: Sequence("go", ref),
+                                    "stop")
+        self.assertTrue(r.matches("stop"))
+        self.assertTrue(r.matches("go go stop"))
+        self.assertEqual(r.expansion.current_match, "go go stop")
+        self.assertFalse(r.matches("go go"))
+
+        # Deeply nested matches don't use Python's call stack.
+        self.assertTrue(r.matches("go " * 2000 + "stop"))
+
+    def test_left_recursion(self):
+        r = self.add_recursive_rule(
+            "test", lambda ref: Sequence(ref, "plus", "one"), "one")
+        self.assertTrue(r.matches("one"))
+        self.assertTrue(r.matches("one plus one plus one"))
+        seq = r.expansion.children[0]
+        self.assertEqual(seq.current_match, "one plus one plus one")
+        self.assertEqual(seq.children[0].current_match, "one plus one")
+        self.assertEqual(seq.children[0].matching_slice, slice(0, 12))
+        self.assertFalse(r.matches("plus one"))
+        self.assertFalse(r.matches("one plus"))
+
+    def test_indirect_left_recursion(self):
+        # <a> = <b> x | y; <b> = <a> z | w;
+        b = self.add_rule(AlternativeSet("w"), "b")
+        a = self.add_rule(AlternativeSet(Sequence(RuleRef(b), "x"), "y"), "a")
+        b.expansion.children.insert(0, Sequence(RuleRef(a), "z"))
+        for speech in ["y", "w x", "y z x", "w x z x", "y z x z x"]:
+            self.assertTrue(a.matches(speech), speech)
+        self.assertTrue(b.matches("y z"))
+        self.assertFalse(a.matches("y z"))
+        self.assertFalse(a.matches("w x z"))
+
+    def test_ambiguous_recursion(self):
+        # <test> = <test> <test> | a; matches any number of a's.
+        r = self.add_recursive_rule(
+            "test", lambda ref: Sequence(ref, RuleRef(ref.referenced_rule)),
+            "a")
+        for n in range(1, 8):
+            self.assertTrue(r.matches(" ".join(["a"] * n)))
+        self.assertFalse(r.matches(""))
+
+    def test_recursive_repeat(self):
+        r = self.add_recursive_rule(
+            "test", lambda ref: Sequence("(", KleeneStar(ref), ")"), "x")
+        self.assertTrue(r.matches("( x ( x x ) ( ) x )"))
+        self.assertFalse(r.matches("( x ( x )"))
+
+    def test_rule_match(self):
+        r = self.add_recursive_rule("test", lambda ref: Sequence("go", ref),
+                                    "stop")
+        result = r.match("go go stop")
+        self.assertEqual(result.current_match, "go go stop")
+        self.assertIsNone(r.expansion.current_match)
+        self.assertIsNone(r.match("go"))
+        self.assertEqual([m.rule for m in self.grammar.match("go stop")], [r])
+
+    def test_find_matching_rules(self):
+        r1 = self.add_recursive_rule("r1", lambda ref: Sequence("go", ref),
+                                     "stop")
+        r2 = self.add_rule(Sequence("go", "stop"), "r2")
+        self.assertEqual(self.grammar.find_matching_rules("go stop"), [r1, r2])
+        self.assertEqual(self.grammar.find_matching_rules("go go stop"), [r1])
+
+    def test_invalidation(self):
+        r = self.add_recursive_rule("test", lambda ref: Sequence("go", ref),
+                                    "stop")
+        self.assertFalse(r.matches("go halt"))
+        r.expansion.children.append(Literal("halt"))
+        self.assertTrue(r.matches("go go halt"))
+
+
+class IterParsesCase(ChartMatchingCase):
+    def parse_matches(self, rule, speech, expansions, **kwargs):
+        # Get the current match of each expansion for each parse.
+        return [[parse.get_current_match(e) for e in expansions]
+                for parse in rule.iter_parses(speech, **kwargs)]
+
+    def test_ambiguous_alternatives(self):
+        e = AlternativeSet("a b", Sequence("a", "b"), Sequence(Dictation(), "b"))
+        r = self.add_rule(e)
+        self.assertEqual(self.parse_matches(r, "a b", e.children), [
+            ["a b", None, None], [None, "a b", None], [None, None, "a b"]
+        ])
+        self.assertEqual(self.parse_matches(r, "a", e.children), [])
+
+    def test_ambiguous_repeats(self):
+        e = Sequence(Repeat("a"), KleeneStar("a"))
+        r = self.add_rule(e)
+        parses = list(r.iter_parses("a a a"))
+        self.assertEqual([[p.get_repetitions_matched(c) for c in e.children]
+                          for p in parses], [[3, 0], [2, 1], [1, 2]])
+
+    def test_repeat_splits(self):
+        e = Repeat(Dictation())
+        r = self.add_rule(e)
+        parses = list(r.iter_parses("a b c"))
+        self.assertEqual([p.get_expansion_matches(e, e.child) for p in parses], [
+            ["a b c"], ["a b", "c"], ["a", "b c"], ["a", "b", "c"]
+        ])
+
+    def test_first_parse_same_as_match(self):
+        e = Sequence(KleeneStar(AlternativeSet("a", "a a", Dictation())),
+                     OptionalGrouping("a"), "b")
+        r = self.add_rule(e)
+        for speech in ["b", "a b", "a a b", "x a a b", "a x a b"]:
+            expected = r.match(speech)
+            first = next(r.iter_parses(speech))
+            for e1 in flat_map_expansion(e):
+                self.assertEqual(expected.get_current_match(e1),
+                                 first.get_current_match(e1))
+                self.assertEqual(expected.get_matching_slice(e1),
+                                 first.get_matching_slice(e1))
+
+    def test_weights(self):
+        e = AlternativeSet("a b", Sequence("a", "b"), Sequence(Dictation(), "b"))
+        e.weights = {e.children[0]: 1, e.children[1]: 5, e.children[2]: 2}
+        r1 = self.add_rule(e)
+        self.assertEqual(self.parse_matches(r1, "a b", e.children), [
+            [None, "a b", None], [None, None, "a b"], ["a b", None, None]
+        ])
+
+        # Weights of alternative sets are combined.
+        e1 = AlternativeSet("x", Sequence("x"))
+        e2 = AlternativeSet("y", Sequence("y"))
+        e1.weights = {e1.children[0]: 1, e1.children[1]: 3}
+        e2.weights = {e2.children[0]: 1, e2.children[1]: 9}
+        r2 = self.add_rule(Sequence(e1, e2), "test2")
+        self.assertEqual(
+            self.parse_matches(r2, "x y", [e1.children[0], e2.children[0]]),
+            [[None, None], ["x", None], [None, "y"], ["x", "y"]]
+        )
+
+        # Changing weights changes the order of parses.
+        e.weights = {e.children[0]: 5, e.children[1]: 1, e.children[2]: 2}
+        self.assertEqual(self.parse_matches(r1, "a b", e.children)[0],
+                         ["a b", None, None])
+
+    def test_limit(self):
+        r = self.add_rule(Repeat(Dictation()))
+        self.assertEqual(len(list(r.iter_parses("a b c d", limit=3))), 3)
+        self.assertEqual(len(list(r.iter_parses("a b c d"))), 8)
+
+    def test_max_work(self):
+        # <test> = <test> <test> | a; has exponentially many parses.
+        r = self.add_recursive_rule(
+            "test", lambda ref: Sequence(ref, RuleRef(ref.referenced_rule)),
+            "a")
+        self.assertTrue(list(r.iter_parses("a a a")))
+        speech = " ".join(["a"] * 40)
+        parses = list(r.iter_parses(speech, max_work=1000))
+        self.assertLessEqual(len(parses), 1)
+        self.assertTrue(list(r.iter_parses(speech, limit=1, max_work=None)))
+
+    def test_max_work_counts_evaluation(self):
+        # <test> = ([a] [a] [a] [a])+; has many parses that are each found
+        # quickly, so the steps of evaluating them have to be counted too.
+        r = self.add_rule(Repeat(Sequence(*[OptionalGrouping("a")] * 4)))
+        speech = " ".join(["a"] * 12)
+        charts, evaluations = [], []
+
+        class RecordingChart(jsgf.charts._Chart):
+            def __init__(self, *args):
+                super(RecordingChart, self).__init__(*args)
+                charts.append(self)
+
+            def count_work(self, steps=1):
+                if steps > 1:
+                    evaluations.append(steps)
+                super(RecordingChart, self).count_work(steps)
+
+        chart_class = jsgf.charts._Chart
+        jsgf.charts._Chart = RecordingChart
+        try:
+            parses = list(r.iter_parses(speech, max_work=2000))
+        finally:
+            jsgf.charts._Chart = chart_class
+
+        # Every yielded parse is counted. Counting stops once the budget is
+        # used up, which may be while evaluating a parse that isn't yielded.
+        self.assertTrue(parses)
+        self.assertIn(len(evaluations), (len(parses), len(parses) + 1))
+        self.assertGreaterEqual(charts[0].work, sum(evaluations))
+        self.assertGreater(charts[0].work, 2000)
+        self.assertLessEqual(charts[0].work, 2000 + max(evaluations))
+        self.assertLess(len(parses), len(list(r.iter_parses(speech, limit=1000))))
+
+    def test_recursion(self):
+        r = self.add_recursive_rule("test", lambda ref: Sequence("go", ref),
+                                    "stop", Sequence("go", Dictation()))
+        seq = r.expansion.children[0]
+        self.assertEqual(self.parse_matches(r, "go go stop", [seq]),
+                         [["go go stop"], ["go go stop"], [None]])
+
+    def test_disabled_rule(self):
+        r = self.add_rule("a")
+        r.disable()
+        self.assertEqual(list(r.iter_parses("a")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
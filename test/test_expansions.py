@@ -358,6 +358,15 @@ class Comparisons(unittest.TestCase):
         self.assertEqual(RuleRef(rule1), RuleRef(deepcopy(rule1)))
         self.assertNotEqual(RuleRef(rule1), RuleRef(rule2))
 
+    def test_recursive_rule_ref(self):
+        rule1 = Rule("test", True, AlternativeSet("test"))
+        rule1.expansion.children.append(Sequence("a", RuleRef(rule1)))
+        rule2 = Rule("test", True, AlternativeSet("test"))
+        rule2.expansion.children.append(Sequence("a", RuleRef(rule2)))
+        self.assertEqual(RuleRef(rule1), RuleRef(rule2))
+        rule2.expansion.children.append(Literal("b"))
+        self.assertNotEqual(RuleRef(rule1), RuleRef(rule2))
+
     def test_set_equality(self):
         # Test with only literals
         self.assertSetEqual({Literal("a"), Literal("z"), Literal("b")},
@@ -195,6 +195,15 @@ class DictationMatchesCase(unittest.TestCase):
         self.assertEqual(rep.get_expansion_matches(seq), ["lower lorem ipsum"] * 2)
         self.assertEqual(rep.get_expansion_matches(dict_), ["lorem ipsum"] * 2)
 
+    def test_stop_literals(self):
+        # Dictation should stop before any of many possible next literals.
+        stops = ["stop%d" % i for i in range(10, 100)]
+        dict_ = Dict()
+        e = Seq(dict_, *([Opt(s) for s in stops] + ["end"]))
+        self.assertEqual(e.matches("lorem ipsum stop42 stop43 end"), "")
+        self.assertEqual(dict_.current_match, "lorem ipsum")
+        self.assertEqual(dict_.matching_slice, slice(0, 11))
+
 
 class DictationMembersCase(unittest.TestCase):
     """
@@ -222,6 +231,38 @@ class DictationMembersCase(unittest.TestCase):
         self.assertNotEqual(hash(e1), hash(Dict()))
         self.assertNotEqual(hash(e2), hash(Dict()))
 
+    def test_use_current_match_in_repeat(self):
+        # Test that repetitions record the values of Dictation expansions that
+        # match their current match values.
+        d = Dict()
+        seq = Seq("a", d)
+        e = Rep(seq)
+        d.current_match = "x y"
+        d.use_current_match = True
+        self.assertEqual(e.matches("a x y a x y"), "")
+        self.assertEqual(e.get_expansion_matches(d), ["x y", "x y"])
+        self.assertEqual(e.get_expansion_matches(seq), ["a x y", "a x y"])
+
+    def test_next_literals_cache(self):
+        # Test that the cached set of next literals is collected again when the
+        # tree changes.
+        d = Dict()
+        e = Seq(d, "end")
+        self.assertEqual(d._get_next_literals(), frozenset(["end"]))
+        self.assertIs(d._get_next_literals(), d._get_next_literals())
+        e.children[1].text = "finish"
+        self.assertEqual(d._get_next_literals(), frozenset(["finish"]))
+        e.children.append(Literal("now"))
+        e.children[1] = Opt("finish")
+        self.assertEqual(d._get_next_literals(), frozenset(["finish", "now"]))
+
+        # Test moving the sequence into another tree.
+        root = Seq(e, "again")
+        e.children.pop(2)
+        self.assertEqual(d._get_next_literals(), frozenset(["finish", "again"]))
+        self.assertEqual(root.matches("lorem finish again"), "")
+        self.assertEqual(d.current_match, "lorem")
+
 
 class ExpansionSequenceCase(unittest.TestCase):
     """
@@ -0,0 +1,478 @@
+# encoding=utf-8
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from pyparsing import ParseException
+
+from jsgf import *
+from jsgf import fast_parser, parser
+
+
+def structure(e):
+    """
+    Return a tuple describing an expansion tree, including the types, tags and
+    weights of each expansion and the parents of each child.
+    """
+    if isinstance(e, Literal):
+        value = e.text
+    elif isinstance(e, NamedRuleRef):
+        value = e.name
+    else:
+        value = None
+    children = tuple(structure(child) for child in e.children)
+    parents_ok = all(child.parent is e for child in e.children)
+    weights = None
+    if isinstance(e, AlternativeSet) and e.weights:
+        weights = sorted(
+            (structure(child), weight) for child, weight in e.weights.items()
+        )
+    return type(e).__name__, e.tag, value, weights, parents_ok, children
+
+
+class ExpansionParserTests(unittest.TestCase):
+    """
+    Tests that fast_parser.parse_expansion_string() produces the same expansion
+    trees and raises the same errors as parser.parse_expansion_string().
+    """
+    def assert_same(self, s):
+        expected = parser.parse_expansion_string(s)
+        result = fast_parser.parse_expansion_string(s)
+        self.assertEqual(type(expected), type(result))
+        self.assertEqual(structure(expected), structure(result))
+
+    def assert_same_error(self, s):
+        try:
+            parser.parse_expansion_string(s)
+        except Exception as e:
+            self.assertRaises(type(e), fast_parser.parse_expansion_string, s)
+        else:
+            self.fail("%r did not raise an error" % s)
+
+    def test_literals_and_references(self):
+        for s in ["hello", "hello world", u"привет мир", "don't", "a-b",
+                  "<greeting>", "<com.example.grammar.rule>", "<NULL>",
+                  "<VOID>", "hello <NULL> <VOID> world"]:
+            self.assert_same(s)
+
+    def test_groupings(self):
+        for s in ["[a]", "(a)", "(a b)", "[a b] c", "a [b (c [d])] e",
+                  "((((((a))))))", "[[[b]]]", "(a) (b) [c] (d)"]:
+            self.assert_same(s)
+
+    def test_alternative_sets(self):
+        for s in ["a|b", "a|b|c", "a b | c d", "i (go | run) to school",
+                  "(a | b) | (c | d)", "a | (b | [c | d]) | e", "a | <NULL>",
+                  "[a | b c] d | e"]:
+            self.assert_same(s)
+
+    def test_weights(self):
+        for s in ["/10/ a | /5.5/ b | /20/ c",
+                  "/10/ [a] | /5.5/ (b) | /20/ (c d) | /2.5/ <test>",
+                  "/1/ a | /1e3/ b", "/.5/ a b | /0/ c", "/2/ a | /3/ a",
+                  "(/2/ a | /3/ b) c", "/1/ (/2/ a | /3/ b) | /4/ c"]:
+            self.assert_same(s)
+
+    def test_tags_and_unary_operators(self):
+        for s in ["a {tag}", "a {1} | b {2}", "/10/ a {1} | /5.5/ b {2}",
+                  "a+", "a*", "((a b)+) {x}", "([a]*) {y} {z}", "a b+ (c*) {t}",
+                  "((a {1} | b {2})+) {3}", "(<r>+) {x}", "a {x-y's}"]:
+            self.assert_same(s)
+
+    def test_comments(self):
+        for s in ["a /* comment */ b", "a // comment", "(a /* x */ | b)",
+                  "/* c */ /1/ a | /2/ b"]:
+            self.assert_same(s)
+
+    def test_errors(self):
+        for s in ["", "a|b|", "|a", "(a", "a)", "[a b", "a {", "a {}",
+                  "<>", "<a b>", "// a | /5/ b", "/1/ a | /2/ b | // c",
+                  "/-1/ a | /5/ b", "[/2/ a] | /6/ b", "/2/ a | [/6/ b]",
+                  "(/2/ a) | /6/ b", "/2/ a | /6/ b | (/12/ c)",
+                  "/2/ a | (/6/ b)", "/2/ test", "a ; b", "a+ {x}",
+                  "(a b)* {y}", "a {\\{x\\}}"]:
+            self.assert_same_error(s)
+
+    def test_invalid_alternative_weights(self):
+        self.assertRaises(TypeError, fast_parser.parse_expansion_string,
+                          "/-1/ a | /5/ b")
+        self.assertRaises(GrammarError, fast_parser.parse_expansion_string,
+                          "/2/ a | [/6/ b]")
+        self.assertRaises(ParseException, fast_parser.parse_expansion_string,
+                          "// a | /5/ b")
+
+    def test_long_alternative_set(self):
+        """Alternative sets of any length can be parsed."""
+        words = ["w%d" % i for i in range(5000)]
+        result = fast_parser.parse_expansion_string(" | ".join(words))
+        self.assertEqual(result, AlternativeSet(*words))
+        self.assertEqual([child.text for child in result.children], words)
+
+        # Weighted alternatives.
+        result = fast_parser.parse_expansion_string(" | ".join(
+            "/%d/ %s" % (i + 1, word) for i, word in enumerate(words)
+        ))
+        self.assertEqual(len(result.weights), 5000)
+        self.assertEqual(result.weights[Literal("w4999")], 5000)
+
+    def test_long_sequence(self):
+        """Long sequences of groupings can be parsed."""
+        s = " ".join("(w%d)" % i for i in range(5000))
+        result = fast_parser.parse_expansion_string(s)
+        self.assertIsInstance(result, Sequence)
+        self.assertEqual(len(result.children), 5000)
+
+    def test_deep_nesting(self):
+        """Deeply nested groupings can be parsed."""
+        s = "(" * 2000 + "a" + ")" * 2000
+        result = fast_parser.parse_expansion_string(s)
+        depth = 0
+        while isinstance(result, RequiredGrouping):
+            result = result.children[0]
+            depth += 1
+        self.assertEqual(depth, 2000)
+        self.assertEqual(result, Literal("a"))
+
+
+class RuleParserTests(unittest.TestCase):
+    def assert_same(self, s):
+        expected = parser.parse_rule_string(s)
+        result = fast_parser.parse_rule_string(s)
+        self.assertEqual(type(expected), type(result))
+        self.assertEqual(expected.name, result.name)
+        self.assertEqual(expected.visible, result.visible)
+        self.assertEqual(structure(expected.expansion),
+                         structure(result.expansion))
+
+    def test_rules(self):
+        for s in ["<a> = b;", "public <a> = b;", "PUBLIC <a> = b c;",
+                  "<a> = b | c {x};", "<a> = /1/ b | /2/ c;",
+                  "public <a> = (x | y)+;", "<a> = b\n", "<a> = b // c\n"]:
+            self.assert_same(s)
+
+    def test_errors(self):
+        for s in ["<a> = b", "<a> b;", "a = b;", "<a> = ;", "public a = b;",
+                  "<NULL> = a;"]:
+            self.assertRaises((ParseException, GrammarError),
+                              fast_parser.parse_rule_string, s)
+
+
+class GrammarParserTests(unittest.TestCase):
+    def assert_same(self, s):
+        expected = parser.parse_grammar_string(s)
+        result = fast_parser.parse_grammar_string(s)
+        self.assertEqual(expected, result)
+        self.assertEqual(expected.jsgf_version, result.jsgf_version)
+        self.assertEqual(expected.charset_name, result.charset_name)
+        self.assertEqual(expected.language_name, result.language_name)
+        self.assertEqual(expected.compile(), result.compile())
+
+    def test_headers(self):
+        for header in ["#JSGF V1.0;", "#JSGF V1.0 UTF-8;", "#JSGF V2.0 UTF-16 en;",
+                       "#JSGF V1.0 en;", "#jsgf v1.0 UTF-8 english;"]:
+            self.assert_same(header + "grammar test;public <r> = hello;")
+
+    def test_line_delimiters(self):
+        self.assert_same("#JSGF V1.0 UTF-8 en\n"
+                         "grammar test\n"
+                         "public <rule> = hello\n")
+        self.assert_same("#JSGF V1.0 UTF-8 en;\n\n\ngrammar test;\n\n"
+                         "public <rule> = hello;\n\n<a> = b;")
+
+    def test_imports(self):
+        self.assert_same("#JSGF V1.0;\n"
+                         "grammar test;\n"
+                         "import <com.example.grammar.greet>;\n"
+                         "import <com.example.*>;\n"
+                         "import <grammars.test1.*>;\n"
+                         "public <rule> = hello <greet>;\n")
+
+    def test_comments(self):
+        self.assert_same(
+            "#JSGF V1.0;\n"
+            "\n"
+            "// test comment.\n"
+            "grammar test; /* in-line comment */\n"
+            "\n"
+            "import <com.example.grammar.greet>; // another in-line comment.\n"
+            "/*\n"
+            " * Rules are defined below "
+            " * this multi-line comment.\n"
+            " */\n"
+            "public <rule> = hello; // one more in-line comment.\n"
+            "//comment after the rule definitions.\n"
+        )
+
+    def test_long_rule(self):
+        """Grammars with rules the parser module cannot parse can be loaded."""
+        words = ["w%d" % i for i in range(3000)]
+        grammar = fast_parser.parse_grammar_string(
+            "#JSGF V1.0;\n"
+            "grammar test;\n"
+            "public <numbers> = %s;\n" % " | ".join(words)
+        )
+        self.assertEqual(grammar.get_rule("numbers").expansion,
+                         AlternativeSet(*words))
+
+    def test_valid_grammar(self):
+        self.assertTrue(fast_parser.valid_grammar(
+            "#JSGF V1.0 UTF-8 en;grammar test;public <rule> = hello;"))
+        self.assertFalse(fast_parser.valid_grammar("grammar test;"
+                                                   "public <test> = test;"))
+        self.assertFalse(fast_parser.valid_grammar("#JSGF V1.0 UTF-8 en;"
+                                                   "grammar test;"))
+        self.assertFalse(fast_parser.valid_grammar(
+            "#JSGF V1.0;grammar test;<a> = b;<a> = c;"))
+
+    def test_file_parsing(self):
+        """Grammar files are read in and parsed correctly."""
+        grammar_dir = os.path.join(os.path.dirname(__file__), "grammars")
+        for name in sorted(os.listdir(grammar_dir)):
+            path = os.path.join(grammar_dir, name)
+            self.assertEqual(parser.parse_grammar_file(path),
+                             fast_parser.parse_grammar_file(path))
+
+        # Write a grammar string to a temporary file.
+        tf = tempfile.NamedTemporaryFile(mode="a", delete=False)
+        with tf:
+            tf.write("#JSGF V2.0 UTF-16 english;grammar test;"
+                     "public <test> = hello;<test2> = hi;")
+        grammar = fast_parser.parse_grammar_file(tf.name)
+        os.remove(tf.name)
+        expected = Grammar("test")
+        expected.jsgf_version = "2.0"
+        expected.charset_name = "UTF-16"
+        expected.language_name = "english"
+        expected.add_rules(PublicRule("test", "hello"), Rule("test2", False, "hi"))
+        self.assertEqual(expected, grammar)
+
+
+class WorkerParsingTests(unittest.TestCase):
+    """Tests for parsing grammar files using worker processes."""
+
+    def setUp(self):
+        # Send every rule to a worker process separately.
+        self.min_part_size = fast_parser.MIN_PART_SIZE
+        fast_parser.MIN_PART_SIZE = 1
+        self.paths = []
+
+    def tearDown(self):
+        fast_parser.MIN_PART_SIZE = self.min_part_size
+        for path in self.paths:
+            os.remove(path)
+
+    def write_file(self, s):
+        tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        with tf:
+            tf.write(s)
+        self.paths.append(tf.name)
+        return tf.name
+
+    def assert_same(self, s):
+        # Check that parsing the file with workers gives the same grammar or
+        # error as parsing it without them.
+        path = self.write_file(s)
+        try:
+            expected = fast_parser.parse_grammar_file(path)
+        except ParseException as e:
+            for parse_file in (fast_parser.parse_grammar_file,
+                               parser.parse_grammar_file):
+                with self.assertRaises(ParseException) as cm:
+                    parse_file(path, workers=2)
+                self.assertEqual((cm.exception.loc, cm.exception.msg),
+                                 (e.loc, e.msg))
+                self.assertEqual((cm.exception.lineno, cm.exception.col),
+                                 (e.lineno, e.col))
+        except GrammarError as e:
+            for parse_file in (fast_parser.parse_grammar_file,
+                               parser.parse_grammar_file):
+                with self.assertRaises(GrammarError) as cm:
+                    parse_file(path, workers=2)
+                self.assertEqual(str(cm.exception), str(e))
+        else:
+            for parse_file in (fast_parser.parse_grammar_file,
+                               parser.parse_grammar_file):
+                self.assertEqual(parse_file(path, workers=2), expected)
+                self.assertEqual(parse_file(path, workers=2).rules,
+                                 expected.rules)
+
+    def test_split_rules(self):
+        s = ("<a> = x; /* ; */ <b;c> = y;;\n\n<d> = z\n<e> = w; // ;\n"
+             "<f> = /2/ v {t} | /1/ u;  ")
+        parts = fast_parser._Parser(s).split_rules(0, 1)
+        self.assertEqual([s[start:end] for start, end in parts], [
+            "<a> = x;", " /* ; */ <b;c> = y;;\n\n",
+            "<d> = z\n<e> = w; // ;\n", "<f> = /2/ v {t} | /1/ u;", "  "
+        ])
+        self.assertEqual(fast_parser._Parser(s).split_rules(0, 30),
+                         [(0, 30), (30, 76), (76, len(s))])
+
+    def test_rules(self):
+        rules = "".join(
+            "/* Rule %d; */ %s<rule;%d> = /2/ (a | b) {t%d} | /1/ <rule;%d>+ //;\n"
+            "<other%d> = c [d]*\n" % (i, "public " if i % 2 else "", i, i,
+                                       (i + 1) % 20, i)
+            for i in range(20)
+        )
+        self.assert_same("#JSGF V1.0 UTF-8 en;\ngrammar test;\n"
+                         "import <a.*>;\n" + rules)
+        self.assert_same("#JSGF V1.0;grammar test;<a> = b;")
+        self.assert_same("#JSGF V1.0;grammar test;<a> = b;<c> = d;\n\n")
+
+    def test_errors(self):
+        header = "#JSGF V1.0;\ngrammar test;\n"
+        rules = "".join("<rule%d> = a b c;\n" % i for i in range(10))
+        self.assert_same(header)
+        self.assert_same(header + "<a> = (b;\n" + rules)
+        self.assert_same(header + rules + "<a> = (b;\n" + rules)
+        self.assert_same(header + rules + "<a> = b;\n /* c */")
+        self.assert_same(header + rules + "<a> = b;\n <c> =")
+        self.assert_same(header + rules + "<rule5> = b;\n" + rules)
+        self.assert_same(header + rules + "<a> = /2/ b | c;\n" + rules)
+        self.assert_same(header + rules + "<a> = /* b;\n" + rules)
+
+
+class LazyRulesTests(unittest.TestCase):
+    """Tests for parsing rule expansions when they are first used."""
+
+    grammar_string = ("#JSGF V1.0;\ngrammar test;\n"
+                      "public <greet> = <hello> <name> {greeting};\n"
+                      "public <hello> = /2/ Hello | /1/ hi /* ; */;;\n"
+                      "<name> = alice | <name;s> [and alice]\n;"
+                      "<name;s> = bob*; // ;\n"
+                      "<unused> = (x | y)+\n")
+
+    def unparsed_names(self, grammar):
+        return [r.name for r in grammar.rules if r._expansion_source is not None]
+
+    def test_rules(self):
+        expected = fast_parser.parse_grammar_string(self.grammar_string)
+        for parse_string in (fast_parser.parse_grammar_string,
+                             parser.parse_grammar_string):
+            grammar = parse_string(self.grammar_string, lazy_rules=True)
+            self.assertEqual(len(self.unparsed_names(grammar)), 5)
+            self.assertEqual([(r.name, r.visible) for r in grammar.rules],
+                             [(r.name, r.visible) for r in expected.rules])
+            for rule, expected_rule in zip(grammar.rules, expected.rules):
+                self.assertEqual(structure(rule.expansion),
+                                 structure(expected_rule.expansion))
+                self.assertIs(rule.expansion.rule, rule)
+            self.assertEqual(grammar, expected)
+            self.assertEqual(self.unparsed_names(grammar), [])
+
+    def test_parsed_on_use(self):
+        grammar = fast_parser.parse_grammar_string(self.grammar_string, True)
+        greet = grammar.get_rule("greet")
+        self.assertTrue(greet.matches("hello bob and alice"))
+        self.assertEqual(self.unparsed_names(grammar), ["unused"])
+
+        grammar = fast_parser.parse_grammar_string(self.grammar_string, True)
+        self.assertEqual(grammar.get_rule("hello").compile(),
+                         "public <hello> = (/2.0000/ hello|/1.0000/ hi);")
+        self.assertEqual(len(grammar.get_rule("name").dependencies), 1)
+        self.assertEqual(self.unparsed_names(grammar), ["greet", "unused"])
+
+    def test_case_sensitivity(self):
+        s = "#JSGF V1.0;grammar test;public <a> = Hello <b>;<b> = World;"
+        grammar = fast_parser.parse_grammar_string(s, True)
+        grammar.case_sensitive = True
+        self.assertTrue(grammar.get_rule("a").matches("Hello World"))
+        self.assertFalse(grammar.get_rule("a").matches("hello world"))
+
+        rule, _ = fast_parser._Parser(s, True).parse_rule(s.index("public"))
+        rule.case_sensitive = True
+        self.assertTrue(rule.expansion.children[0].case_sensitive)
+        self.assertEqual(rule.expansion.children[0].text, "Hello")
+
+    def test_changed_references(self):
+        grammar = fast_parser.parse_grammar_string(self.grammar_string, True)
+        greet = grammar.get_rule("greet")
+        self.assertTrue(greet.matches("hi alice"))
+        grammar.get_rule("hello").expansion = Literal("hey")
+        self.assertFalse(greet.matches("hi alice"))
+        self.assertTrue(greet.matches("hey alice"))
+
+    def test_errors(self):
+        header = "#JSGF V1.0;\ngrammar test;\n"
+        for body, count in (("(b", 2), ("b = c", 2), ("b /* <c> = */ |", 2),
+                            ("b |", 2), ("b /* c", 1)):
+            grammar = fast_parser.parse_grammar_string(
+                header + "<a> = %s;\n<d> = e;" % body, True)
+            self.assertEqual(len(grammar.rules), count)
+            rule = grammar.rules[0]
+            for _ in range(2):
+                self.assertRaises((ParseException, GrammarError),
+                                  lambda: rule.expansion)
+            if count == 2:
+                self.assertEqual(grammar.rules[1].expansion, Literal("e"))
+
+        # Errors in rule names are still raised straight away, as are rules that
+        # aren't terminated before the next rule, with the same error as when
+        # expansions are parsed straight away.
+        for s in ("public <a> = a\npublic <b> = b",
+                  "<a> = b\n<c> = d;\n<d> = e;",
+                  "<a> = b <c> // d;\n<e> = f;\n"):
+            with self.assertRaises(ParseException) as cm:
+                fast_parser.parse_grammar_string(header + s)
+            e = cm.exception
+            with self.assertRaises(ParseException) as cm:
+                fast_parser.parse_grammar_string(header + s, True)
+            self.assertEqual((cm.exception.loc, cm.exception.msg), (e.loc, e.msg))
+        for s in ("<a = b;", "<a> b;", "public <a> = b;\n<c;"):
+            self.assertRaises(ParseException, fast_parser.parse_grammar_string,
+                              header + s, True)
+        self.assertRaises(GrammarError, fast_parser.parse_grammar_string,
+                          header + "<a> = b; <a> = c;", True)
+
+    def test_pickling(self):
+        grammar = fast_parser.parse_grammar_string(self.grammar_string, True)
+        grammar.get_rule("hello").expansion
+        result = pickle.loads(pickle.dumps(grammar))
+        self.assertEqual(self.unparsed_names(result), ["greet", "name", "name;s",
+                                                       "unused"])
+        self.assertTrue(result.get_rule("greet").matches("hello bob"))
+        self.assertEqual(result, fast_parser.parse_grammar_string(
+            self.grammar_string))
+
+    def test_file_parsing(self):
+        tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        with tf:
+            tf.write(self.grammar_string)
+        try:
+            expected = fast_parser.parse_grammar_file(tf.name)
+            for parse_file in (fast_parser.parse_grammar_file,
+                               parser.parse_grammar_file):
+                for lazy in (False, True):
+                    for workers in (1, 2):
+                        grammar = parse_file(tf.name, lazy, workers=workers,
+                                             lazy_rules=True)
+                        self.assertEqual(len(self.unparsed_names(grammar)), 5)
+                        self.assertEqual(grammar, expected)
+        finally:
+            os.remove(tf.name)
+
+    def test_import_resolution(self):
+        cwd = os.getcwd()
+        directory = tempfile.mkdtemp()
+        os.chdir(directory)
+        try:
+            with open("test.jsgf", "w") as f:
+                f.write(self.grammar_string)
+            Import.lazy_rules = True
+            rule = Import("test.hello").resolve()
+            self.assertEqual(len(self.unparsed_names(rule.grammar)), 5)
+            self.assertEqual(rule.expansion.compile(),
+                             "(/2.0000/ hello|/1.0000/ hi)")
+            self.assertEqual(self.unparsed_names(rule.grammar),
+                             ["greet", "name", "name;s", "unused"])
+        finally:
+            Import.lazy_rules = False
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,11 @@ import copy
 import tempfile
 import unittest
 
+import pyparsing
+
 from jsgf import *
-from jsgf.ext import Dictation
+from jsgf import automata
+from jsgf.ext import Dictation, DictationGrammar
 
 
 class BasicGrammarCase(unittest.TestCase):
@@ -87,6 +90,23 @@ class BasicGrammarCase(unittest.TestCase):
                         PublicRule("name", "bob")]
         self.assertRaises(GrammarError, self.grammar.add_rules, *rules_to_add)
 
+    def test_add_rules_with_duplicate_names(self):
+        # Rules with the same name in one add_rules() call are checked too, and
+        # comparable rules are skipped.
+        rules = [PrivateRule("a", "x"), PrivateRule("b", "y")]
+        self.grammar.add_rules(*rules)
+        self.grammar.add_rules(PrivateRule("c", "z"), PrivateRule("c", "z"),
+                               PrivateRule("a", "x"))
+        self.assertEqual(self.grammar.rule_names.count("c"), 1)
+        self.assertRaises(GrammarError, self.grammar.add_rules,
+                          PrivateRule("d", "z"), PrivateRule("d", "w"))
+
+        # Renaming rules after adding them is handled.
+        rules[0].name = "e"
+        self.grammar.add_rules(PrivateRule("a", "w"))
+        self.assertRaises(GrammarError, self.grammar.add_rules,
+                          PrivateRule("e", "w"))
+
     def test_enable_disable_rule(self):
         self.grammar.disable_rule(self.rule1)
         self.assertFalse(self.rule1.active)
@@ -735,5 +755,679 @@ class RootGrammarCase(unittest.TestCase):
         )
 
 
+class FirstWordIndexCase(unittest.TestCase):
+    """
+    Tests for skipping rules that cannot start with the first word of speech in
+    Grammar.find_matching_rules.
+    """
+    backend = MatchingBackend.Pyparsing
+
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = self.backend
+        self.name = PrivateRule("name", AlternativeSet("peter", "john"))
+        self.greet = PublicRule("greet", Sequence(
+            AlternativeSet("hello", "hi there"), RuleRef(self.name)
+        ))
+        self.call = PublicRule("call", Sequence(
+            OptionalGrouping("please"), "call", RuleRef(self.name)
+        ))
+        self.grammar.add_rules(self.greet, self.call, self.name)
+
+    def candidates(self, speech):
+        index = self.grammar._first_word_index
+        return sorted(r.name for r in index.candidates(speech).values())
+
+    def assert_matching_rules(self, speech, expected):
+        self.assertEqual(self.grammar.find_matching_rules(speech), expected)
+
+    def test_candidates(self):
+        self.assertEqual(self.candidates("hello peter"), ["greet"])
+        self.assertEqual(self.candidates("HI there john"), ["greet"])
+        self.assertEqual(self.candidates("please call john"), ["call"])
+        self.assertEqual(self.candidates("call john"), ["call"])
+        self.assertEqual(self.candidates("peter"), ["name"])
+        self.assertEqual(self.candidates("goodbye"), [])
+        self.assertEqual(self.candidates(""), [])
+
+    def test_find_matching_rules(self):
+        self.assert_matching_rules("hello peter", [self.greet])
+        self.assert_matching_rules("  hi there john", [self.greet])
+        self.assert_matching_rules("please call john", [self.call])
+        self.assert_matching_rules("call peter", [self.call])
+        self.assert_matching_rules("hello", [])
+        self.assert_matching_rules("goodbye", [])
+        self.assert_matching_rules("", [])
+
+    def test_skipped_rules_reset(self):
+        self.assert_matching_rules("hello peter", [self.greet])
+        self.assertTrue(self.greet.was_matched)
+        self.assert_matching_rules("call peter", [self.call])
+        self.assertFalse(self.greet.was_matched)
+        self.assertEqual(self.greet.expansion.current_match, None)
+
+    def test_nullable_rules(self):
+        rule = PublicRule("optional", KleeneStar("test"))
+        self.grammar.add_rule(rule)
+        self.assertEqual(self.candidates(""), ["optional"])
+        self.assertEqual(self.candidates("test"), ["optional"])
+        self.assert_matching_rules("", [rule])
+        self.assert_matching_rules("test test", [rule])
+
+    def test_rules_matching_any_speech(self):
+        # Rules with optional or <NULL> expansions match any speech.
+        optional = PublicRule("optional", OptionalGrouping("test"))
+        null = PublicRule("null", NullRef())
+        self.grammar.add_rules(optional, null)
+        self.assertEqual(self.candidates("anything"), ["null", "optional"])
+        self.assert_matching_rules("anything", [optional, null])
+        self.assert_matching_rules("call john", [self.call, optional, null])
+
+    def test_null_and_void_refs(self):
+        null = PublicRule("null", Sequence(NullRef(), "test"))
+        void = PublicRule("void", AlternativeSet(VoidRef(), "test"))
+        self.grammar.add_rules(null, void)
+        self.assertEqual(self.candidates("test"), ["null", "void"])
+        self.assertEqual(self.candidates(""), [])
+
+    def test_dictation(self):
+        rule = PublicRule("dictation", Sequence(Dictation(), "test"))
+        self.grammar.add_rule(rule)
+        self.assertEqual(self.candidates("anything"), ["dictation"])
+        self.assertEqual(self.candidates("test"), ["dictation"])
+        self.assertEqual(self.candidates(""), [])
+
+    def test_add_remove_rule(self):
+        rule = PublicRule("goodbye", "goodbye")
+        self.grammar.add_rule(rule)
+        self.assertEqual(self.candidates("goodbye"), ["goodbye"])
+        self.assert_matching_rules("goodbye", [rule])
+        self.grammar.remove_rule(rule)
+        self.assertEqual(self.candidates("goodbye"), [])
+        self.assert_matching_rules("goodbye", [])
+
+    def test_enable_disable_rule(self):
+        self.grammar.disable_rule(self.greet)
+        self.assertEqual(self.candidates("hello peter"), [])
+        self.assert_matching_rules("hello peter", [])
+        self.grammar.enable_rule(self.greet)
+        self.assertEqual(self.candidates("hello peter"), ["greet"])
+        self.assert_matching_rules("hello peter", [self.greet])
+
+    def test_unresolved_reference(self):
+        # References are resolved again when the referenced rule is added.
+        grammar = Grammar()
+        grammar.matching_backend = self.backend
+        rule = PublicRule("test", Sequence(NamedRuleRef("greeting"), "world"))
+        grammar.add_rule(rule)
+        index = grammar._first_word_index
+        self.assertEqual(list(index.candidates("x").values()), [rule])
+        grammar.add_rule(PrivateRule("greeting", "hello"))
+        self.assertEqual(list(index.candidates("x").values()), [])
+        self.assertEqual(len(index.candidates("hello")), 2)
+        self.assertEqual(grammar.find_matching_rules("hello world"), [rule])
+
+    def test_recursive_reference(self):
+        rule = PublicRule("recursive", AlternativeSet(
+            "stop", Sequence("go", NamedRuleRef("recursive"))
+        ))
+        self.grammar.add_rule(rule)
+        self.assertEqual(self.candidates("go"), ["recursive"])
+        self.assertEqual(self.candidates("stop"), ["recursive"])
+        self.assertEqual(self.candidates("goodbye"), [])
+
+    def test_expansion_changes(self):
+        # Changing a referenced rule's expansion should re-index rules using it.
+        self.name.expansion.children.pop(0)
+        self.name.expansion.children[0].parent = None
+        self.name.expansion = AlternativeSet("mary", "anna")
+        self.assertEqual(self.candidates("mary"), ["name"])
+        self.assert_matching_rules("hello mary", [self.greet])
+        self.assert_matching_rules("hello peter", [])
+
+        # Changing the first words of a rule directly.
+        self.call.expansion.children.pop(0)
+        self.call.expansion.invalidate_matcher()
+        self.assertEqual(self.candidates("please"), [])
+        self.assert_matching_rules("please call mary", [])
+        self.assert_matching_rules("call mary", [self.call])
+
+    def test_run_together_words(self):
+        # Pyparsing can match words that are run together, so rules must not be
+        # skipped using the index with that backend.
+        rule = PublicRule("letters", Sequence(AlternativeSet("a", "b"),
+                                              OptionalGrouping("c")))
+        self.grammar.add_rule(rule)
+        for speech in ("ac", "bc", "a c", "cb"):
+            expected = [r for r in self.grammar.rules
+                        if r.visible and r.matches(speech)]
+            self.assert_matching_rules(speech, expected)
+        if self.backend == MatchingBackend.Pyparsing:
+            self.assert_matching_rules("ac", [rule])
+            self.assertEqual(len(self.grammar.match("ac")), 0)
+
+
+class AutomatonFirstWordIndexCase(FirstWordIndexCase):
+    backend = MatchingBackend.Automaton
+
+
+class MatchBoundsCase(unittest.TestCase):
+    """
+    Tests for rejecting speech outside of the match bounds of rules in
+    Rule.matches and Grammar.find_matching_rules.
+    """
+    backend = MatchingBackend.Automaton
+
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = self.backend
+        self.name = PrivateRule("name", AlternativeSet("peter", "mary anne"))
+        self.call = PublicRule("call", Sequence(
+            "call", OptionalGrouping("my friend"), RuleRef(self.name), "now"
+        ))
+        self.grammar.add_rules(self.call, self.name)
+
+    def bounds(self, e, rules=()):
+        return e._get_match_bounds(rules)
+
+    def test_bounds(self):
+        self.assertEqual(self.bounds(Literal("Hello World")),
+                         (2, 2, frozenset(["hello", "world"])))
+        self.assertEqual(self.bounds(AlternativeSet("a b", "b c d")),
+                         (2, 3, frozenset(["b"])))
+        self.assertEqual(self.bounds(AlternativeSet()), (0, 0, frozenset()))
+        self.assertEqual(self.bounds(OptionalGrouping("a b")),
+                         (0, 2, frozenset()))
+        self.assertEqual(self.bounds(Repeat("a b")), (2, None, frozenset("ab")))
+        self.assertEqual(self.bounds(KleeneStar("a")), (0, None, frozenset()))
+        self.assertEqual(self.bounds(KleeneStar(NullRef())), (0, 0, frozenset()))
+        self.assertEqual(self.bounds(Sequence("a", Dictation(), "b")),
+                         (3, None, frozenset("ab")))
+        self.assertEqual(self.bounds(self.call.expansion, (self.call,)),
+                         (3, 6, frozenset(["call", "now"])))
+
+    def test_recursive_reference(self):
+        rule = PublicRule("recursive", AlternativeSet(
+            "stop", Sequence("go", NamedRuleRef("recursive"))
+        ))
+        self.grammar.add_rule(rule)
+        self.assertEqual(self.bounds(rule.expansion, (rule,)),
+                         (1, None, frozenset()))
+
+    def test_rule_matches(self):
+        self.assertTrue(self.call.matches("call mary anne now"))
+        self.assertFalse(self.call.matches("call peter"))
+        self.assertFalse(self.call.matches("call my friend mary anne now please"))
+        self.assertEqual(self.grammar.prefilter_info, PrefilterInfo(3, 2))
+        self.grammar.reset_prefilter_info()
+        self.assertEqual(self.grammar.prefilter_info, PrefilterInfo(0, 0))
+
+        # Match data is reset for rejected speech.
+        self.assertTrue(self.call.matches("call peter now"))
+        self.assertFalse(self.call.matches("call peter then"))
+        self.assertFalse(self.call.was_matched)
+        self.assertIsNone(self.name.expansion.current_match)
+        self.assertEqual(self.grammar.prefilter_info, PrefilterInfo(2, 1))
+
+    def test_find_matching_rules(self):
+        self.assertEqual(self.grammar.find_matching_rules("call peter now"),
+                         [self.call])
+        self.assertEqual(self.grammar.find_matching_rules("CALL peter NOW"),
+                         [self.call])
+        self.assertEqual(self.grammar.prefilter_info.pruned, 0)
+        self.assertEqual(self.grammar.find_matching_rules("call peter then"), [])
+        self.assertEqual(self.grammar.find_matching_rules(["call", "now"]), [])
+        self.assertEqual(self.grammar.prefilter_info.pruned, 2)
+
+        # Rejected rules that matched previously are reset.
+        self.grammar.find_matching_rules("call peter now")
+        self.assertTrue(self.call.was_matched)
+        self.grammar.find_matching_rules("call peter")
+        self.assertFalse(self.call.was_matched)
+
+    def test_rules_matching_any_speech(self):
+        optional = PublicRule("optional", OptionalGrouping("call"))
+        self.grammar.add_rule(optional)
+        self.assertEqual(self.grammar.find_matching_rules("call"), [optional])
+        self.assertTrue(optional.matches("call me"))
+
+    def test_expansion_changes(self):
+        self.assertFalse(self.call.matches("call john smith now"))
+        self.name.expansion.children.append("john smith")
+        self.assertTrue(self.call.matches("call john smith now"))
+        self.call.expansion.children.pop()
+        self.assertTrue(self.call.matches("call peter"))
+        self.assertEqual(self.grammar.find_matching_rules("call peter"),
+                         [self.call])
+
+    def test_lazy_match_data(self):
+        self.grammar.lazy_match_data = True
+        try:
+            self.assertTrue(self.call.matches("call peter now"))
+            self.assertFalse(self.call.matches("call peter"))
+            self.assertFalse(self.call.was_matched)
+        finally:
+            automata._set_deferred_match_data()
+
+    def test_run_together_words(self):
+        # Grammar.find_matching_rules() should find the same rules as
+        # Rule.matches(), including with pyparsing, which can match words that
+        # are run together.
+        ab = PublicRule("ab", Sequence("a", "b"))
+        repeat = parse_rule_string("public <repeat> = hello (x)+;")
+        self.grammar.add_rules(ab, repeat)
+        for backend in (MatchingBackend.Pyparsing, self.backend):
+            self.grammar.matching_backend = backend
+            for speech in ("ab", "a b", "hellox", "hello xx", "hello x", "hello"):
+                expected = [r for r in self.grammar.rules
+                            if r.visible and r.matches(speech)]
+                self.assertEqual(self.grammar.find_matching_rules(speech),
+                                 expected)
+
+        self.grammar.matching_backend = MatchingBackend.Pyparsing
+        self.assertEqual(self.grammar.find_matching_rules("ab"), [ab])
+        self.assertEqual(self.grammar.find_matching_rules("hellox"), [repeat])
+        self.assertEqual(self.grammar.find_matching_rules("hello xx"), [repeat])
+
+
+class ChartMatchBoundsCase(MatchBoundsCase):
+    backend = MatchingBackend.Chart
+
+
+class RegexMatchBoundsCase(MatchBoundsCase):
+    backend = MatchingBackend.Regex
+
+
+class ReferenceIndexCase(unittest.TestCase):
+    """
+    Tests for the index of rule references used to invalidate references to
+    changed rules.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.name = PrivateRule("name", AlternativeSet("peter", "john"))
+        self.greet = PublicRule("greet", Sequence("hello", RuleRef(self.name)))
+        self.call = PublicRule("call", Sequence("call", NamedRuleRef("name")))
+        self.grammar.add_rules(self.name, self.greet, self.call)
+
+    def references(self, name):
+        index = self.grammar._reference_index
+        return sorted(x.rule.name for x in index.references(name))
+
+    def test_references(self):
+        self.assertEqual(self.references("name"), ["call", "greet"])
+        self.assertEqual(self.references("greet"), [])
+        self.grammar.remove_rule(self.call)
+        self.assertEqual(self.references("name"), ["greet"])
+
+    def test_tree_changes(self):
+        self.assertEqual(self.references("name"), ["call", "greet"])
+        self.greet.expansion.children.pop()
+        self.call.expansion.children.append(NamedRuleRef("greet"))
+        self.call.expansion.children[2].rule = self.call
+        self.assertEqual(self.references("name"), ["call"])
+        self.assertEqual(self.references("greet"), ["call"])
+
+    def test_versions(self):
+        version = self.name._version
+        e = self.name.expansion
+        expansion_version = e._version
+        e.children[0].text = "mary"
+        self.assertEqual(self.name._version, version + 1)
+        self.assertEqual(e._version, expansion_version + 1)
+        self.name.expansion = "peter"
+        self.assertEqual(self.name._version, version + 2)
+
+    def test_lazy_invalidation(self):
+        self.assertEqual(self.grammar.find_matching_rules("hello peter"),
+                         [self.greet])
+        ref = self.greet.expansion.children[1]
+        self.assertTrue(ref._matcher_cached)
+
+        # References are invalidated before they are next used.
+        self.name.expansion.children.append("mary")
+        self.assertTrue(ref._matcher_cached)
+        self.assertEqual(self.grammar.find_matching_rules("hello mary"),
+                         [self.greet])
+        self.assertEqual(self.grammar._changed_names, set())
+
+    def test_recursive_references(self):
+        rule = PublicRule("recursive", AlternativeSet(
+            "stop", Sequence("go", NamedRuleRef("recursive"))
+        ))
+        self.grammar.add_rule(rule)
+        index = self.grammar._first_word_index
+        self.assertEqual(list(index.candidates("stop").values()), [rule])
+
+        # Invalidating references to the rule should stop.
+        rule.expansion.children.append("wait")
+        self.grammar._update_references()
+        self.assertEqual(list(index.candidates("wait").values()), [rule])
+
+
+class MatchCacheCase(unittest.TestCase):
+    """
+    Tests for caching Grammar.find_matching_rules results.
+    """
+    backend = MatchingBackend.Pyparsing
+
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = self.backend
+        self.grammar.match_cache_size = 2
+        self.name = PrivateRule("name", AlternativeSet("peter", "john"))
+        self.greet = PublicRule("greet", Sequence(
+            AlternativeSet("hello", "hi"), RuleRef(self.name)
+        ))
+        self.count = PublicRule("count", Sequence(
+            "count", Repeat(AlternativeSet("one", "two"))
+        ))
+        self.grammar.add_rules(self.greet, self.count, self.name)
+
+    def assert_cache_info(self, hits, misses, size):
+        self.assertEqual(self.grammar.match_cache_info,
+                         (hits, misses, self.grammar.match_cache_size, size))
+
+    def test_disabled_by_default(self):
+        grammar = Grammar()
+        grammar.add_rule(PublicRule("test", "test"))
+        self.assertEqual(grammar.match_cache_size, 0)
+        grammar.find_matching_rules("test")
+        grammar.find_matching_rules("test")
+        self.assertEqual(grammar.match_cache_info, (0, 0, 0, 0))
+
+    def test_invalid_size(self):
+        def set_size():
+            self.grammar.match_cache_size = -1
+        self.assertRaises(ValueError, set_size)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.grammar.find_matching_rules("hello peter"),
+                         [self.greet])
+        self.assert_cache_info(0, 1, 1)
+        self.assertEqual(self.grammar.find_matching_rules("  hello peter "),
+                         [self.greet])
+        self.assert_cache_info(1, 1, 1)
+        self.assertEqual(self.grammar.find_matching_rules("goodbye"), [])
+        self.assert_cache_info(1, 2, 2)
+        self.assertEqual(self.grammar.find_matching_rules("goodbye"), [])
+        self.assert_cache_info(2, 2, 2)
+        self.grammar.clear_match_cache()
+        self.assert_cache_info(2, 2, 0)
+
+    def test_least_recently_used(self):
+        for speech in ("hello peter", "hi john", "hello peter", "count one"):
+            self.grammar.find_matching_rules(speech)
+        self.assert_cache_info(1, 3, 2)
+
+        # "hi john" was the least recently used result.
+        self.grammar.find_matching_rules("hello peter")
+        self.grammar.find_matching_rules("hi john")
+        self.assert_cache_info(2, 4, 2)
+
+    def test_restore_match_data(self):
+        self.grammar.find_matching_rules("hello peter")
+        self.grammar.find_matching_rules("count one two one")
+        self.assertFalse(self.greet.was_matched)
+
+        # Match data should be restored from the cache.
+        self.assertEqual(self.grammar.find_matching_rules("hello peter"),
+                         [self.greet])
+        self.assert_cache_info(1, 2, 2)
+        self.assertEqual(self.greet.expansion.current_match, "hello peter")
+        self.assertEqual(self.name.expansion.current_match, "peter")
+        self.assertFalse(self.count.was_matched)
+
+        self.grammar.find_matching_rules("count one two one")
+        self.assert_cache_info(2, 2, 2)
+        self.assertFalse(self.greet.was_matched)
+        repeat = self.count.expansion.children[1]
+        self.assertEqual(repeat.current_match, "one two one")
+        self.assertEqual(repeat.get_expansion_matches(repeat.child),
+                         ["one", "two", "one"])
+        self.assertEqual(repeat.matching_slice, slice(6, 17))
+
+        # Matching again shouldn't change cached repetition data.
+        self.grammar.find_matching_rules("count two")
+        self.grammar.find_matching_rules("count one two one")
+        self.assertEqual(repeat.get_expansion_matches(repeat.child),
+                         ["one", "two", "one"])
+
+    def assert_invalidated(self, speech, expected):
+        hits = self.grammar.match_cache_info.hits
+        self.assertEqual(self.grammar.find_matching_rules(speech), expected)
+        self.assertEqual(self.grammar.match_cache_info.hits, hits)
+
+    def test_add_remove_rule(self):
+        self.grammar.find_matching_rules("goodbye")
+        rule = PublicRule("goodbye", "goodbye")
+        self.grammar.add_rule(rule)
+        self.assert_invalidated("goodbye", [rule])
+        self.grammar.remove_rule(rule)
+        self.assert_invalidated("goodbye", [])
+
+    def test_enable_disable_rule(self):
+        self.grammar.find_matching_rules("hello peter")
+        self.grammar.disable_rule(self.greet)
+        self.assert_invalidated("hello peter", [])
+        self.greet.enable()
+        self.assert_invalidated("hello peter", [self.greet])
+        self.greet.disable()
+        self.assert_invalidated("hello peter", [])
+
+    def test_visibility(self):
+        self.grammar.find_matching_rules("peter")
+        self.name.visible = True
+        self.assert_invalidated("peter", [self.name])
+
+    def test_expansion_changes(self):
+        self.grammar.find_matching_rules("hello mary")
+        self.name.expansion = AlternativeSet("mary", "anna")
+        self.assert_invalidated("hello mary", [self.greet])
+        self.name.expansion.children.append("peter")
+        self.assert_invalidated("hello peter", [self.greet])
+
+    def test_case_sensitivity(self):
+        self.grammar.find_matching_rules("HELLO peter")
+        self.greet.case_sensitive = True
+        self.assert_invalidated("HELLO peter", [])
+        self.grammar.case_sensitive = False
+        self.assert_invalidated("HELLO peter", [self.greet])
+
+    def test_copy(self):
+        self.grammar.find_matching_rules("hello peter")
+        grammar = copy.deepcopy(self.grammar)
+        self.assertEqual(grammar.match_cache_info, (0, 0, 2, 0))
+        self.assertEqual(grammar.find_matching_rules("hello peter"),
+                         [grammar.get_rule("greet")])
+
+
+class AutomatonMatchCacheCase(MatchCacheCase):
+    backend = MatchingBackend.Automaton
+
+
+class MatchMemoCase(unittest.TestCase):
+    """
+    Tests for memoizing the results of matching referenced rules with
+    Grammar.match_memo_size.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.word = PrivateRule("word", AlternativeSet("a", "b", "c"))
+        self.levels = [PrivateRule("level0", RuleRef(self.word))]
+        for i in range(1, 5):
+            below = self.levels[-1]
+            self.levels.append(PrivateRule("level%d" % i, AlternativeSet(
+                Sequence(RuleRef(below), RuleRef(below)), RuleRef(below)
+            )))
+        self.top = PublicRule("top", Sequence(
+            "start", Repeat(RuleRef(self.levels[2])), "end",
+            RuleRef(self.levels[4])
+        ))
+        self.grammar.add_rules(self.word, self.top, *self.levels)
+
+    def get_match_data(self):
+        result = []
+
+        def f(x):
+            result.append((x.current_match, x.matching_slice))
+            if isinstance(x, Repeat):
+                result.append((x.get_expansion_matches(x.child),
+                               x.get_expansion_slices(x.child)))
+
+        for rule in self.grammar.rules:
+            map_expansion(rule.expansion, f, shallow=True)
+        return result
+
+    def test_disabled_by_default(self):
+        self.assertEqual(Grammar().match_memo_size, 0)
+
+    def test_invalid_size(self):
+        def set_size():
+            self.grammar.match_memo_size = -1
+        self.assertRaises(ValueError, set_size)
+
+    def test_same_match_data(self):
+        for speech in ["start a b end c", "start a b c end a b c a", "start a",
+                       "start a end a b c a b c a b c a b c a b c a b c",
+                       "start c c c c c c c c c end c c c c c c c c c c"]:
+            self.grammar.match_memo_size = 0
+            expected_rules = self.grammar.find_matching_rules(speech)
+            expected = self.get_match_data()
+            for size in (1, 5, 1000):
+                self.grammar.match_memo_size = size
+                self.assertEqual(self.grammar.find_matching_rules(speech),
+                                 expected_rules)
+                self.assertEqual(self.get_match_data(), expected)
+
+    def test_fewer_matches(self):
+        # Count the number of times the lowest level is matched.
+        element = self.levels[0].expansion.matcher_element
+        parse_impl = element.parseImpl
+        calls = []
+
+        def counting_parse_impl(*args, **kwargs):
+            calls.append(args)
+            return parse_impl(*args, **kwargs)
+
+        element.parseImpl = counting_parse_impl
+        speech = "start a b c end a b c a b c a b"
+        self.assertTrue(self.top.matches(speech))
+        unmemoized_calls = len(calls)
+        del calls[:]
+        self.grammar.match_memo_size = 1000
+        self.assertTrue(self.top.matches(speech))
+        self.assertLess(len(calls), unmemoized_calls)
+
+        # pyparsing's global packrat setting should not be changed.
+        self.assertFalse(pyparsing.ParserElement._packratEnabled)
+
+    def test_dictation_grammar(self):
+        grammar = DictationGrammar()
+        grammar.match_memo_size = 10
+        self.assertEqual(grammar._jsgf_only_grammar.match_memo_size, 10)
+
+
+class LazyMatchDataCase(unittest.TestCase):
+    """
+    Tests for deferring match data with Grammar.lazy_match_data.
+    """
+    backend = MatchingBackend.Automaton
+
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = self.backend
+        self.grammar.lazy_match_data = True
+        self.name = PrivateRule("name", AlternativeSet("peter", "john"))
+        self.greet = PublicRule("greet", Sequence(
+            AlternativeSet("hello", "hi"), RuleRef(self.name)
+        ))
+        self.count = PublicRule("count", Sequence(
+            "count", Repeat(AlternativeSet("one", "two"))
+        ))
+        self.grammar.add_rules(self.greet, self.count, self.name)
+
+    def tearDown(self):
+        automata._set_deferred_match_data()
+
+    def test_property(self):
+        self.assertFalse(Grammar().lazy_match_data)
+        grammar = DictationGrammar()
+        grammar.lazy_match_data = 1
+        self.assertIs(grammar.lazy_match_data, True)
+        self.assertTrue(grammar._jsgf_only_grammar.lazy_match_data)
+
+    def test_set_when_used(self):
+        self.assertEqual(self.grammar.find_matching_rules("hello peter"),
+                         [self.greet])
+        self.assertIsNone(self.greet.expansion._current_match)
+        self.assertEqual(self.greet.expansion.current_match, "hello peter")
+        self.assertEqual(self.name.expansion.current_match, "peter")
+        self.assertEqual(self.name.expansion.matching_slice, slice(6, 11))
+
+    def test_rule_matches(self):
+        self.assertTrue(self.greet.matches("hello peter"))
+        self.assertTrue(self.count.matches("count one two"))
+        self.assertFalse(self.greet.matches("hello mary"))
+        self.assertTrue(self.name.matches("john"))
+        self.assertFalse(self.greet.was_matched)
+        self.assertEqual(self.name.expansion.current_match, "john")
+        repeat = self.count.expansion.children[1]
+        self.assertEqual(repeat.get_expansion_matches(repeat.child),
+                         ["one", "two"])
+        self.assertEqual(repeat.repetitions_matched, 2)
+
+    def test_skipped_rules_reset(self):
+        self.grammar.find_matching_rules("hello peter")
+        self.assertEqual(self.grammar.find_matching_rules("count one"),
+                         [self.count])
+        self.assertFalse(self.greet.was_matched)
+        self.assertEqual(self.count.expansion.current_match, "count one")
+
+    def test_replaced_matches_discarded(self):
+        for speech in ("count one", "count two", "count one two"):
+            self.assertTrue(self.count.matches(speech))
+        self.assertEqual(len(automata._deferred_matches), 1)
+        self.assertEqual(self.count.expansion.current_match, "count one two")
+        self.assertEqual(len(automata._deferred_matches), 0)
+
+    def test_max_deferred_matches(self):
+        for _ in range(automata._MAX_DEFERRED_MATCHES + 1):
+            self.grammar.find_matching_rules("count one")
+        self.assertLessEqual(len(automata._deferred_matches),
+                             automata._MAX_DEFERRED_MATCHES)
+        self.assertEqual(self.count.expansion.current_match, "count one")
+
+    def test_expansion_changes(self):
+        self.greet.matches("hi john")
+        expansion = self.name.expansion
+        self.name.expansion = AlternativeSet("mary", "anna")
+        self.assertEqual(expansion.current_match, "john")
+        self.assertTrue(self.greet.matches("hi mary"))
+        self.greet.expansion.children[0].children.append("hey")
+        self.assertEqual(self.greet.expansion.current_match, "hi mary")
+
+    def test_same_as_eager(self):
+        grammar = Grammar()
+        grammar.matching_backend = self.backend
+        count = PublicRule("count", Sequence(
+            "count", Repeat(AlternativeSet("one", "two"))
+        ))
+        grammar.add_rule(count)
+        for speech in ("count one two", "count", "count two"):
+            self.count.matches(speech)
+            count.matches(speech)
+            self.assertEqual(
+                [(e.current_match, e.matching_slice)
+                 for e in flat_map_expansion(self.count.expansion)],
+                [(e.current_match, e.matching_slice)
+                 for e in flat_map_expansion(count.expansion)]
+            )
+
+
+class ChartLazyMatchDataCase(LazyMatchDataCase):
+    backend = MatchingBackend.Chart
+
+
 if __name__ == '__main__':
     unittest.main()
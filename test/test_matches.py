@@ -240,6 +240,39 @@ class MatchesCase(unittest.TestCase):
         self.assertFalse(r.matches("two"))
         self.assertFalse(r.matches("three"))
 
+    def test_alt_set_literal_lookup(self):
+        # Test that large sets of literal alternatives keep the longest match
+        # semantics of pyparsing's Or element.
+        words = ["word%d" % i for i in range(1000)]
+        e = Repeat(AlternativeSet("up", "up arrow", "Up Arrow Key", *words))
+        r = PublicRule("test", e)
+        self.assertTrue(r.matches("word999 up arrow up up arrow key word0"))
+        self.assertEqual(e.get_expansion_matches(e.child), [
+            "word999", "up arrow", "up", "Up Arrow Key", "word0"
+        ])
+        self.assertEqual(e.get_expansion_slices(e.child), [
+            slice(0, 7), slice(8, 16), slice(17, 19), slice(20, 32),
+            slice(33, 38)
+        ])
+        self.assertFalse(r.matches("word1000"))
+
+        # Test with case-sensitive and case-insensitive literals together.
+        e = AlternativeSet("Hello", "hello there")
+        r = Rule("test", True, e)
+        e.children[0].case_sensitive = True
+        self.assertTrue(r.matches("Hello"))
+        self.assertFalse(r.matches("hello"))
+        self.assertTrue(r.matches("HELLO THERE"))
+        self.assertEqual(e.current_match, "hello there")
+
+        # Test that weights are still used.
+        e = AlternativeSet("up", "up arrow", "down")
+        e.weights = {"up": 1, "up arrow": 0, "down": 2}
+        r = Rule("test", True, Sequence(e, OptionalGrouping("arrow")))
+        self.assertTrue(r.matches("up arrow"))
+        self.assertEqual(e.current_match, "up")
+        self.assertTrue(r.matches("down"))
+
     def test_alt_set_and_optionals(self):
         # Test for Matching issue with alternatives and OptionalGrouping (iss. #12)
         e = Sequence("this is a ", OptionalGrouping("big"),
@@ -663,6 +696,34 @@ class MatchesCase(unittest.TestCase):
         # Test with get_expansion_matches an expansion that isn't a descendant
         self.assertListEqual(e.get_expansion_matches(Literal("d")), [])
 
+    def test_repetition_match_data_of_equal_expansions(self):
+        # Match data recorded for each repetition should distinguish between
+        # equal expansions in different places.
+        a1, a2 = Literal("a"), Literal("a")
+        e = Repeat(Sequence(AlternativeSet(a1, "b"), OptionalGrouping(a2)))
+        self.assertEqual(e.matches("a a b a b"), "")
+        self.assertListEqual(e.get_expansion_matches(a1), ["a", None, None])
+        self.assertListEqual(e.get_expansion_matches(a2), ["a", "a", ""])
+        self.assertListEqual(e.get_expansion_slices(a2),
+                             [slice(2, 3), slice(6, 7), None])
+
+    def test_repetition_match_data_of_referenced_rules(self):
+        # Only the expansions matched by each repetition should have values.
+        words = ["w%d" % i for i in range(50)]
+        word = Rule("word", False, AlternativeSet(*words))
+        e = Repeat(NamedRuleRef("word"))
+        r = PublicRule("test", e)
+        Grammar().add_rules(word, r)
+        self.assertTrue(r.matches("w3 w10 w3"))
+        alt = word.expansion
+        self.assertListEqual(e.get_expansion_matches(alt), ["w3", "w10", "w3"])
+        self.assertListEqual(e.get_expansion_matches(alt.children[3]),
+                             ["w3", None, "w3"])
+        self.assertListEqual(e.get_expansion_slices(alt.children[10]),
+                             [None, slice(3, 6), None])
+        self.assertListEqual(e.get_expansion_matches(alt.children[0]),
+                             [None, None, None])
+
     def test_forward_searching_complex(self):
         e = Sequence("a", Sequence(
             OptionalGrouping("b"), OptionalGrouping("c"),
@@ -717,6 +778,11 @@ class MatchesCase(unittest.TestCase):
         self.assertFalse(r.matches("b"))
         self.assertEqual(e.current_match, None)
 
+        # Change the text of the "a" literal.
+        e.children[0].text = "c"
+        self.assertFalse(r.matches("a"))
+        self.assertTrue(r.matches("c"))
+
     def test_invalidation_of_references(self):
         # Test invalidation of references.
         n = Rule("n", False, AlternativeSet("once", "twice", "thrice"))
@@ -744,6 +810,23 @@ class MatchesCase(unittest.TestCase):
         self.assertListEqual(g.find_matching_rules("do this thrice"), [r1, r2])
         self.assertListEqual(g.find_matching_rules("do this four times"), [r1, r2])
 
+    def test_invalidation_of_nested_references(self):
+        # Test invalidation of references to rules that reference changed rules.
+        n = PrivateRule("n", AlternativeSet("once", "twice"))
+        m = PrivateRule("m", Sequence(NamedRuleRef("n"), "more"))
+        r = PublicRule("test", Sequence("do this", RuleRef(m)))
+        g = Grammar()
+        g.add_rules(n, m, r)
+        self.assertTrue(r.matches("do this once more"))
+
+        # Change n's expansion tree and then replace it.
+        n.expansion.children.append("thrice")
+        self.assertTrue(r.matches("do this thrice more"))
+        n.expansion = AlternativeSet("four times")
+        self.assertTrue(r.matches("do this four times more"))
+        self.assertFalse(r.matches("do this once more"))
+        self.assertListEqual(g.find_matching_rules("do this four times more"), [r])
+
 
 if __name__ == '__main__':
     unittest.main()
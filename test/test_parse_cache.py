@@ -0,0 +1,273 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyparsing import ParseException
+
+from jsgf import (parse_grammar_file, parse_grammar_string, Import, Grammar,
+                  PublicRule, Rule, AlternativeSet, Literal, NamedRuleRef)
+from jsgf import fast_parser, parse_cache
+from jsgf import ParseCache
+
+
+class ParseCacheCase(unittest.TestCase):
+    """ Base ParseCache TestCase class. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.cache = ParseCache(self.cache_dir)
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, s, name="test.jsgf"):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(s)
+        return path
+
+    def parse_file(self, path):
+        # Parse function that records the paths it is called with.
+        self.parsed.append(path)
+        return parse_grammar_file(path)
+
+    def entry_names(self):
+        return [name for name in os.listdir(self.cache_dir)
+                if name.endswith(".pickle")]
+
+
+class ParseCacheTests(ParseCacheCase):
+    """ Tests for the ParseCache class. """
+
+    grammar_string = ("#JSGF V1.0 UTF-8 en;\n"
+                      "grammar test;\n"
+                      "import <com.example.grammar.*>;\n"
+                      "public <greet> = /2/ (hello | hi) {greeting} | /1/ <name>+;\n"
+                      "<name> = [alice] {a} | bob* | <NULL> | <VOID>;\n")
+
+    def test_miss_and_hit(self):
+        """ Grammars are parsed on the first use and loaded afterwards. """
+        path = self.write_file(self.grammar_string)
+        self.assertIsNone(self.cache.load(path))
+        expected = parse_grammar_string(self.grammar_string)
+        self.assertEqual(self.cache.parse_grammar_file(path, self.parse_file),
+                         expected)
+        self.assertEqual(self.parsed, [path])
+
+        # The second call should use the cache entry, including from a different
+        # ParseCache object.
+        for cache in (self.cache, ParseCache(self.cache_dir)):
+            grammar = cache.parse_grammar_file(path, self.parse_file)
+            self.assertEqual(grammar, expected)
+            self.assertEqual(self.parsed, [path])
+        self.assertEqual(len(self.entry_names()), 1)
+
+    def test_round_trip(self):
+        """ Cached grammars are equal to the parsed grammars. """
+        grammar = parse_grammar_string(self.grammar_string)
+        path = self.write_file(self.grammar_string)
+        self.cache.store(path, grammar)
+        result = self.cache.load(path)
+        self.assertEqual(result, grammar)
+        self.assertEqual(result.compile(), grammar.compile())
+        self.assertEqual(result.imports, [Import("com.example.grammar.*")])
+
+        # Check weights, tags and parent expansions.
+        greet = result.get_rule("greet")
+        self.assertEqual(greet.expansion.weights,
+                         grammar.get_rule("greet").expansion.weights)
+        for e in greet.expansion.children:
+            self.assertIs(e.parent, greet.expansion)
+        self.assertIs(greet.expansion.children[0].parent, greet.expansion)
+        self.assertEqual(greet.expansion.children[0].tag, "greeting")
+
+    def test_test_grammar_files(self):
+        """ Test grammar files are cached correctly. """
+        grammars_dir = os.path.join(os.path.dirname(__file__), "grammars")
+        for name in sorted(os.listdir(grammars_dir)):
+            path = os.path.join(grammars_dir, name)
+            expected = parse_grammar_file(path)
+            self.cache.store(path, expected)
+            self.assertEqual(self.cache.load(path), expected)
+
+    def test_content_change(self):
+        """ Entries are not used after a file's contents change. """
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        st = os.stat(path)
+        s = self.grammar_string.replace("alice", "alicia")
+        self.write_file(s)
+
+        # Keep the same modification time; the size has changed.
+        os.utime(path, (st.st_atime, st.st_mtime))
+        self.assertIsNone(self.cache.load(path))
+        self.assertEqual(self.cache.parse_grammar_file(path, self.parse_file),
+                         parse_grammar_string(s))
+        self.assertEqual(self.parsed, [path, path])
+
+        # Use different contents of the same size.
+        s2 = s.replace("alicia", "alicio")
+        self.write_file(s2)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(self.cache.parse_grammar_file(path, self.parse_file),
+                         parse_grammar_string(s2))
+        self.assertEqual(len(self.parsed), 3)
+
+    def test_modification_time_change(self):
+        """ Entries are used if only a file's modification time changes. """
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(self.cache.load(path),
+                         parse_grammar_string(self.grammar_string))
+
+        # The entry's file information should have been updated. Modification
+        # times set with os.utime() can differ from the given float slightly, so
+        # compare with the file's new information.
+        (size, mtime, _), _ = self.cache._read_entry(self.cache._entry_path(path))
+        new_st = os.stat(path)
+        self.assertEqual((size, mtime), (new_st.st_size, new_st.st_mtime))
+        self.assertAlmostEqual(mtime, st.st_mtime + 10, places=3)
+
+    def test_source_change(self):
+        """ Entries are not used after the package's source code changes. """
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        source_hash = parse_cache._get_source_hash()
+        parse_cache._source_hash = source_hash + "0"
+        try:
+            self.assertIsNone(self.cache.load(path))
+        finally:
+            parse_cache._source_hash = source_hash
+        self.assertIsNotNone(self.cache.load(path))
+
+    def test_file_paths(self):
+        """ Entries are keyed on file paths. """
+        path1 = self.write_file(self.grammar_string, "test1.jsgf")
+        path2 = self.write_file(self.grammar_string, "test2.jsgf")
+        self.cache.parse_grammar_file(path1, self.parse_file)
+        self.assertIsNone(self.cache.load(path2))
+        self.cache.parse_grammar_file(path2, self.parse_file)
+        self.assertEqual(self.parsed, [path1, path2])
+        self.assertEqual(len(self.entry_names()), 2)
+
+    def test_invalid_entries(self):
+        """ Invalid entries are ignored and replaced. """
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        entry_path = self.cache._entry_path(path)
+        for data in (b"", b"not a cache entry", open(entry_path, "rb").read()[:20]):
+            with open(entry_path, "wb") as f:
+                f.write(data)
+            self.assertIsNone(self.cache.load(path))
+
+        self.cache.parse_grammar_file(path, self.parse_file)
+        self.assertEqual(len(self.parsed), 2)
+        self.assertIsNotNone(self.cache.load(path))
+
+    def test_no_temporary_files(self):
+        """ Temporary files are not left in the cache directory. """
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        self.cache.store(path, parse_grammar_string(self.grammar_string))
+        self.assertEqual(os.listdir(self.cache_dir), self.entry_names())
+
+    def test_clear(self):
+        """ ParseCache.clear() removes every entry. """
+        ParseCache(os.path.join(self.directory, "missing")).clear()
+        path = self.write_file(self.grammar_string)
+        self.cache.parse_grammar_file(path, self.parse_file)
+        self.cache.clear()
+        self.assertEqual(self.entry_names(), [])
+        self.assertIsNone(self.cache.load(path))
+
+    def test_large_grammar(self):
+        """ Grammars with deeply nested or long expansions are cached. """
+        grammar = Grammar("test")
+        e = Literal("x")
+        for _ in range(300):
+            e = AlternativeSet(e, "y")
+        grammar.add_rules(
+            PublicRule("nested", e),
+            Rule("long", False, AlternativeSet(*[NamedRuleRef("nested")
+                                                 for _ in range(5000)]))
+        )
+        path = self.write_file("")
+        self.cache.store(path, grammar)
+        result = self.cache.load(path)
+        self.assertEqual(result.get_rule("long"), grammar.get_rule("long"))
+
+        # Check the nested expansion without recursion.
+        e, depth = result.get_rule("nested").expansion, 0
+        while e.children:
+            self.assertEqual(e.children[1], Literal("y"))
+            e, depth = e.children[0], depth + 1
+        self.assertEqual((e, depth), (Literal("x"), 300))
+
+
+class ParseGrammarFileTests(ParseCacheCase):
+    """ Tests for the cache_dir parameter of parse_grammar_file functions. """
+
+    def test_parse_grammar_file(self):
+        s = "#JSGF V1.0;\ngrammar test;\npublic <greet> = hello | hi;\n"
+        path = self.write_file(s)
+        expected = parse_grammar_string(s)
+        for parse_file in (parse_grammar_file, fast_parser.parse_grammar_file):
+            for lazy in (False, True):
+                grammar = parse_file(path, lazy=lazy, cache_dir=self.cache_dir)
+                self.assertEqual(grammar, expected)
+        self.assertEqual(len(self.entry_names()), 1)
+        self.assertEqual(self.cache.load(path), expected)
+
+    def test_lazy_rules(self):
+        s = "#JSGF V1.0;\ngrammar test;\npublic <greet> = hello | hi;\n<a> = (b;\n"
+        path = self.write_file(s)
+        grammar = fast_parser.parse_grammar_file(path, cache_dir=self.cache_dir,
+                                                 lazy_rules=True)
+        greet = grammar.get_rule("greet")
+        self.assertEqual(greet.expansion, AlternativeSet("hello", "hi"))
+
+        # Unparsed rule expansions are stored as they are. They are parsed when
+        # the grammar is loaded without lazy_rules.
+        for parse_file in (parse_grammar_file, fast_parser.parse_grammar_file):
+            grammar = parse_file(path, cache_dir=self.cache_dir, lazy_rules=True)
+            self.assertIsNotNone(grammar.get_rule("a")._expansion_source)
+            self.assertRaises(ParseException, parse_file, path,
+                              cache_dir=self.cache_dir)
+        self.assertEqual(len(self.entry_names()), 1)
+
+
+class ImportCacheTests(ParseCacheCase):
+    """ Tests for the Import.parse_cache_dir attribute. """
+
+    def setUp(self):
+        super(ImportCacheTests, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.write_file("#JSGF V1.0;\ngrammar test;\npublic <greet> = hello;\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        Import.parse_cache_dir = None
+        super(ImportCacheTests, self).tearDown()
+
+    def test_import_resolution(self):
+        self.assertFalse(os.path.exists(self.cache_dir))
+        self.assertEqual(Import("test.greet").resolve(),
+                         PublicRule("greet", "hello"))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+        Import.parse_cache_dir = self.cache_dir
+        self.assertEqual(Import("test.greet").resolve(),
+                         PublicRule("greet", "hello"))
+        self.assertEqual(len(self.entry_names()), 1)
+        self.assertEqual(self.cache.load("test.jsgf").rules,
+                         [PublicRule("greet", "hello")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import tempfile
 from pyparsing import ParseException
 
 from jsgf import *
+from jsgf import references
 from jsgf.parser import parse_expansion_string, parse_rule_string
 
 
@@ -70,6 +71,39 @@ class ValidGrammarTests(unittest.TestCase):
                           "public <rule> = hello;\n")
 
 
+class NameMatcherTests(unittest.TestCase):
+    """
+    Tests that the name matchers in the references module accept the same names
+    as the pyparsing elements they replace.
+    """
+    names = [
+        "test", "test.rule", "com.example.*", "test.*", "a.b.c", u"привет",
+        " test ", "test\t", "\ttest", "test /* comment */", "// c\ntest",
+        "", " ", ".", "test.", ".test", "a..b", "a b", "NULL", "VOID", " NULL",
+        "NULLs", "a$b", "a+b", "a(b)", "a:b|c", "*", "a.*.b", "test;", 1, 2.5,
+    ]
+
+    def assert_same(self, element, matcher):
+        for name in self.names:
+            self.assertEqual(element.matches(name), matcher.matches(name),
+                             "%r gave different results" % name)
+
+    def test_base_names(self):
+        self.assert_same(references.base_name, references.base_name_matcher)
+        self.assert_same(references.reserved_names,
+                         references.reserved_names_matcher)
+
+    def test_qualified_names(self):
+        self.assert_same(references.optionally_qualified_name,
+                         references.optionally_qualified_name_matcher)
+
+    def test_import_names(self):
+        self.assert_same(references.import_name, references.import_name_matcher)
+
+    def test_grammar_names(self):
+        self.assert_same(references.grammar_name, references.grammar_name_matcher)
+
+
 class ExpansionParserTests(unittest.TestCase):
     """Test the parse_expansion_string function."""
 
@@ -384,5 +418,124 @@ class GrammarParserTests(unittest.TestCase):
         self.assertEqual(expected, grammar)
 
 
+class GrammarFileIteratorTests(unittest.TestCase):
+    """
+    Tests for the iter_grammar_file function and lazy grammar file parsing.
+    """
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def write_file(self, s):
+        tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        with tf:
+            tf.write(s)
+        self.paths.append(tf.name)
+        return tf.name
+
+    def assert_same(self, s):
+        # Check that parsing the file lazily gives the same grammar, using very
+        # small chunks to test statements split across them.
+        path = self.write_file(s)
+        expected = parse_grammar_file(path)
+        self.assertEqual(parse_grammar_file(path, lazy=True), expected)
+        for chunk_size in (1, 2, 3, 7):
+            statements = list(iter_grammar_file(path, chunk_size))
+            self.assertEqual(statements[0], GrammarHeader(
+                expected.jsgf_version, expected.charset_name,
+                expected.language_name, expected.name
+            ))
+            self.assertEqual(statements[1:], expected.imports + expected.rules)
+
+    def test_statements(self):
+        path = self.write_file("#JSGF V1.0 UTF-8 en;\n"
+                               "grammar test;\n"
+                               "import <com.example.grammar.greet>;\n"
+                               "public <rule> = hello | hi;\n"
+                               "<name> = alice | bob;\n")
+        self.assertEqual(list(iter_grammar_file(path)), [
+            GrammarHeader("1.0", "UTF-8", "en", "test"),
+            Import("com.example.grammar.greet"),
+            PublicRule("rule", AlternativeSet("hello", "hi")),
+            Rule("name", False, AlternativeSet("alice", "bob")),
+        ])
+
+    def test_lazy_parsing(self):
+        self.assert_same("#JSGF V1.0 UTF-8 en\n"
+                         "grammar test\n"
+                         "public <rule> = hello\n")
+        self.assert_same("#JSGF V2.0;;grammar test;;import <a.*>\n"
+                         "public <rule> = /1/ hello {1} | /2/ ((hi)+) {2};;\n"
+                         "<a> = [<rule>] <NULL>;")
+
+    def test_comments_and_names_with_semicolons(self):
+        self.assert_same("#JSGF V1.0; // a comment; with semicolons\n"
+                         "grammar test; /* another; */\n"
+                         "public <rule> = hello /* ; */ <a;b>;\n"
+                         "<a;b> = world // ;\n"
+                         ";\n"
+                         "// last comment;\n")
+
+    def test_test_grammar_files(self):
+        grammar_dir = os.path.join(os.path.dirname(__file__), "grammars")
+        for name in sorted(os.listdir(grammar_dir)):
+            path = os.path.join(grammar_dir, name)
+            self.assertEqual(parse_grammar_file(path, lazy=True),
+                             parse_grammar_file(path))
+
+    def test_errors(self):
+        # Errors are raised when they are reached.
+        path = self.write_file("#JSGF V1.0;\n"
+                               "grammar test;\n"
+                               "public <rule> = hello;\n"
+                               "<rule2> = hello hi world;\n"
+                               "<rule3> = )\n")
+        statements = iter_grammar_file(path, 4)
+        self.assertEqual(len([next(statements) for _ in range(3)]), 3)
+        self.assertRaises(ParseException, list, statements)
+        self.assertRaises(ParseException, parse_grammar_file, path, True)
+
+        # Test that the same errors as the non-lazy parser are raised.
+        for s in ["grammar test; public <test> = test;",
+                  "#JSGF V1.0; grammar test;",
+                  "#JSGF V1.0; grammar test; <a> = b; <a> = c;",
+                  "#JSGF V1.0; grammar test; <a> = /2/ b | [/6/ c];",
+                  "#JSGF V1.0; grammar test; <a> = b; // no newline"]:
+            path = self.write_file(s)
+            try:
+                parse_grammar_file(path)
+            except Exception as e:
+                self.assertRaises(type(e), parse_grammar_file, path, True)
+            else:
+                self.fail("%r did not raise an error" % s)
+
+    def test_late_error_locations(self):
+        # Errors have locations in the whole file, not in the text that hadn't
+        # been parsed when they were raised.
+        rules = "".join("public <rule%d> = hello world %d;\n" % (i, i)
+                        for i in range(500))
+        for error in ("public <a> = a\npublic <b> = b\n", "<a> = )\n",
+                      "<a> = b; /* c"):
+            path = self.write_file("#JSGF V1.0;\ngrammar test;\n" + rules +
+                                   error)
+            with self.assertRaises(ParseException) as cm:
+                parse_grammar_file(path)
+            e = cm.exception
+            self.assertGreater(e.lineno, 500)
+            expected = (e.loc, e.lineno, e.col, e.msg)
+            with self.assertRaises(ParseException) as cm:
+                parse_grammar_file(path, True)
+            e = cm.exception
+            self.assertEqual((e.loc, e.lineno, e.col, e.msg), expected)
+            for chunk_size in (7, 1000):
+                with self.assertRaises(ParseException) as cm:
+                    list(iter_grammar_file(path, chunk_size))
+                e = cm.exception
+                self.assertEqual((e.loc, e.lineno, e.col, e.msg), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,211 @@
+import unittest
+
+from jsgf import *
+from jsgf.ext import Dictation
+
+
+class RegexMatchingCase(unittest.TestCase):
+    """
+    Base test case for matching rules with the regular expression backend.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = MatchingBackend.Regex
+
+    def add_rule(self, expansion, name="test"):
+        rule = PublicRule(name, expansion)
+        self.grammar.add_rule(rule)
+        return rule
+
+
+class RegexMatchesCase(RegexMatchingCase):
+    def test_rule_backend(self):
+        rule = self.add_rule("hello")
+        self.assertEqual(rule.matching_backend, MatchingBackend.Regex)
+        self.assertTrue(rule.matches("hello"))
+        self.assertIsInstance(rule.expansion._regex_matcher, RegexMatcher)
+        self.assertIsNotNone(rule.expansion._regex_matcher.pattern)
+
+    def test_literal(self):
+        e = Literal("hello world")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("  HELLO   world "))
+        self.assertEqual(e.current_match, "hello world")
+        self.assertEqual(e.matching_slice, slice(0, 13))
+        self.assertFalse(r.matches("hello"))
+        self.assertIsNone(e.current_match)
+
+    def test_special_characters(self):
+        e = Sequence("a.b", "(c)")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("a.b (c)"))
+        self.assertFalse(r.matches("axb (c)"))
+
+    def test_sequence_and_rule_refs(self):
+        name = PrivateRule("name", AlternativeSet("peter", "john"))
+        self.grammar.add_rule(name)
+        e = Sequence(AlternativeSet("hello", "hi"), OptionalGrouping("there"),
+                     RuleRef(name))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hi john"))
+        self.assertEqual(e.current_match, "hi john")
+        self.assertEqual(e.children[0].current_match, "hi")
+        self.assertEqual(e.children[1].current_match, "")
+        self.assertEqual(e.children[1].matching_slice, slice(3, 3))
+        self.assertEqual(e.children[2].current_match, "john")
+        self.assertEqual(name.expansion.current_match, "john")
+        self.assertEqual(name.expansion.matching_slice, slice(3, 7))
+
+    def test_ambiguous_optional(self):
+        e = Sequence(OptionalGrouping("test"), "test")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("test"))
+        self.assertEqual(e.children[0].current_match, "")
+        self.assertEqual(e.children[1].current_match, "test")
+        self.assertTrue(r.matches("test test"))
+        self.assertEqual(e.children[0].current_match, "test")
+        self.assertFalse(r.matches("test test test"))
+
+    def test_literal_alternatives(self):
+        # Longer literals are preferred.
+        e = Sequence(AlternativeSet("a", "a b"), OptionalGrouping("b"))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("a b"))
+        self.assertEqual(e.children[0].current_match, "a b")
+        self.assertEqual(e.children[1].current_match, "")
+
+    def test_repeats(self):
+        # Repetition data is set for trees with repeats.
+        e = Sequence("count", Repeat(AlternativeSet("one", "two")))
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("count one two one"))
+        repeat = e.children[1]
+        self.assertEqual(repeat.repetitions_matched, 3)
+        self.assertEqual(repeat.get_expansion_matches(repeat.child),
+                         ["one", "two", "one"])
+        self.assertEqual(repeat.get_expansion_slices(repeat.child),
+                         [slice(6, 9), slice(10, 13), slice(14, 17)])
+        self.assertFalse(r.matches("count one three"))
+        self.assertEqual(repeat.repetitions_matched, 0)
+
+    def test_repeat_match_data(self):
+        # Expansions outside repeats use the groups of the regular expression
+        # and expansions inside them are matched again with an automaton. The
+        # match data is the same as with the automaton backend.
+        number = PrivateRule("number", AlternativeSet("one", "two", "three"))
+        self.grammar.add_rule(number)
+        inner = KleeneStar(Sequence("and", RuleRef(number)))
+        e = Sequence(AlternativeSet("count", "add"), OptionalGrouping("up"),
+                     Repeat(Sequence(RuleRef(number), inner)),
+                     AlternativeSet("now", "later"))
+        r = self.add_rule(e)
+        matcher = e._get_regex_matcher()
+        self.assertIsNotNone(matcher.pattern)
+        self.assertIn(matcher._indices[id(e.children[3])], matcher._groups)
+        self.assertNotIn(matcher._indices[id(inner)], matcher._groups)
+        tree = flat_map_expansion(e) + flat_map_expansion(number.expansion)
+        repeats = [x for x in tree if isinstance(x, Repeat)]
+        speech = "Add one and TWO and three two one and one later"
+
+        def get_data(result):
+            data = [(result.get_current_match(x), result.get_matching_slice(x))
+                    for x in tree]
+            for repeat in repeats:
+                data.append(result.get_repetitions_matched(repeat))
+                for x in flat_map_expansion(repeat.child):
+                    data.append((result.get_expansion_matches(repeat, x),
+                                 result.get_expansion_slices(repeat, x)))
+            return data
+
+        result = r.match(speech)
+        self.assertEqual(result.get_current_match(e.children[0]), "add")
+        self.assertEqual(result.get_repetitions_matched(e.children[2]), 3)
+        self.assertEqual(result.get_expansion_matches(inner, inner.child),
+                         ["and one"])
+        regex_data = get_data(result)
+        self.grammar.matching_backend = MatchingBackend.Automaton
+        self.assertEqual(regex_data, get_data(r.match(speech)))
+
+        # Setting match data on the expansions gives the same result.
+        self.grammar.matching_backend = MatchingBackend.Regex
+        self.assertTrue(r.matches(speech))
+        self.assertEqual(e.children[2].get_expansion_matches(number.expansion),
+                         ["three", "two", "one"])
+        self.assertEqual(e.children[3].current_match, "later")
+        self.assertEqual(e.children[3].matching_slice, slice(42, 47))
+
+    def test_case_sensitivity(self):
+        e = Literal("Hello")
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("HELLO"))
+        self.assertEqual(e.current_match, "Hello")
+        r.case_sensitive = True
+        self.assertFalse(r.matches("HELLO"))
+        self.assertTrue(r.matches("Hello"))
+
+        # Literals with different case sensitivity are matched with an
+        # automaton.
+        e = Sequence("a", "b")
+        r = self.add_rule(e, "mixed")
+        e.children[0].case_sensitive = True
+        self.assertTrue(r.matches("a B"))
+        self.assertIsNone(e._regex_matcher.pattern)
+        self.assertFalse(r.matches("A B"))
+
+    def test_dictation(self):
+        e = Sequence("hello", Dictation())
+        r = self.add_rule(e)
+        self.assertTrue(r.matches("hello big world"))
+        self.assertEqual(e.children[1].current_match, "big world")
+        self.assertIsNone(e._regex_matcher.pattern)
+
+    def test_recursive_rule(self):
+        # Rules that reference themselves are matched with a chart parser.
+        r = self.add_rule(AlternativeSet("test"))
+        r.expansion.children.insert(0, Sequence(RuleRef(r), "again"))
+        self.assertTrue(r.matches("test again again"))
+        self.assertEqual(r.expansion.current_match, "test again again")
+        self.assertIsInstance(r.expansion._regex_matcher, ChartParser)
+
+    def test_expansion_matches(self):
+        e = Sequence("hello", OptionalGrouping("world"))
+        self.add_rule(e)
+        self.assertEqual(e.matches("hello world again"), "again")
+        self.assertEqual(e.current_match, "hello world")
+        self.assertEqual(e.matches(["hello", "there"]), ("there",))
+        self.assertEqual(e.matches("goodbye"), "goodbye")
+        self.assertIsNone(e.current_match)
+
+    def test_words_with_spaces(self):
+        r = self.add_rule("hello world")
+        self.assertFalse(r.matches(["hello world"]))
+        self.assertTrue(r.matches(["hello", "world"]))
+
+    def test_match_result(self):
+        e = Sequence("hello", AlternativeSet("peter", "john"))
+        r = self.add_rule(e)
+        result = r.match("hello john")
+        self.assertEqual(result.get_current_match(e.children[1]), "john")
+        self.assertEqual(result.get_matching_slice(e.children[1]), slice(6, 10))
+        self.assertIsNone(e.current_match)
+        self.assertIsNone(r.match("hello mary"))
+
+    def test_find_matching_rules(self):
+        r1 = self.add_rule(Sequence("open", AlternativeSet("file", "folder")),
+                           "open")
+        r2 = self.add_rule(Sequence("close", OptionalGrouping("file")), "close")
+        self.assertEqual(self.grammar.find_matching_rules("open folder"), [r1])
+        self.assertEqual(self.grammar.find_matching_rules("close"), [r2])
+        self.assertEqual(r2.expansion.current_match, "close")
+
+    def test_invalidation(self):
+        e = AlternativeSet("hello", "hi")
+        r = self.add_rule(e)
+        self.assertFalse(r.matches("hey"))
+        e.children.append("hey")
+        self.assertTrue(r.matches("hey"))
+        self.assertEqual(e.current_match, "hey")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -139,6 +139,49 @@ class MemberTests(unittest.TestCase):
         self.assertIsNone(r1.find_matching_part("hello world"))
         self.assertIsNone(r1.find_matching_part("test"))
 
+    def test_find_matching_part_run_together(self):
+        # The pyparsing backend matches words that are run together, so parts
+        # are searched for at every character.
+        r1 = PublicRule("test", "cat")
+        self.assertEqual(r1.find_matching_part("concatenate"), "cat")
+        self.assertEqual(r1.find_matching_part("a cat"), "cat")
+        r2 = parse_rule_string("public <repeat> = hello (x)+;")
+        self.assertTrue(r2.matches("helloxx"))
+        self.assertEqual(r2.find_matching_part("helloxx"), "helloxx")
+        self.assertEqual(r2.find_matching_part("say helloxx now"), "helloxx")
+        r3 = parse_rule_string("public <open> = [please] open;")
+        self.assertEqual(r3.find_matching_part("pleaseopen"), "pleaseopen")
+        self.assertEqual(r3.find_matching_part("xopen"), "open")
+        self.assertEqual(list(r3.find_all_matching_parts("xopen open")),
+                         ["open", "open"])
+
+    def test_find_matching_part_empty_matches(self):
+        # Empty matches are not used.
+        r = PublicRule("optional", Sequence(OptionalGrouping("a"), KleeneStar("b")))
+        self.assertIsNone(r.find_matching_part("c d"))
+        self.assertEqual(r.find_matching_part("c b b d"), "b b")
+
+    def test_find_all_matching_parts(self):
+        r1 = PublicRule("test", Sequence("hello", OptionalGrouping("world")))
+        parts = r1.find_all_matching_parts("hello test hello world hello")
+        self.assertEqual(list(parts), ["hello", "hello world", "hello"])
+        self.assertEqual(list(r1.find_all_matching_parts("test")), [])
+
+        # Match data is set for each part when it is yielded.
+        parts = r1.find_all_matching_parts("hello world test hello")
+        self.assertEqual(next(parts), "hello world")
+        self.assertEqual(r1.expansion.current_match, "hello world")
+        self.assertEqual(next(parts), "hello")
+        self.assertEqual(r1.expansion.matching_slice, slice(17, 22))
+
+        # Parts don't overlap.
+        r2 = PublicRule("pairs", Sequence("a", "a"))
+        self.assertEqual(list(r2.find_all_matching_parts("a a a a a")),
+                         ["a a", "a a"])
+
+        r1.disable()
+        self.assertEqual(list(r1.find_all_matching_parts("hello")), [])
+
     def test_case_sensitive(self):
         """JSGF Rules support configurable case-sensitivity."""
         direction = Rule("direction", False, AlternativeSet(
@@ -215,6 +258,65 @@ class MemberTests(unittest.TestCase):
         self.assertEqual(cmd.fully_qualified_name, "com.example.grammar.cmd")
 
 
+class FindMatchingPartCase(unittest.TestCase):
+    """
+    Tests for finding matching parts of speech with the automaton, chart and
+    regular expression matching backends.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.name = PrivateRule("name", AlternativeSet("peter", "mary anne"))
+        self.call = PublicRule("call", Sequence(
+            OptionalGrouping("please"), "call", RuleRef(self.name)
+        ))
+        self.grammar.add_rules(self.call, self.name)
+
+    def check_backend(self, backend):
+        self.grammar.matching_backend = backend
+        speech = "Then PLEASE call Mary Anne and call peter"
+        self.assertEqual(self.call.find_matching_part(speech),
+                         "PLEASE call Mary Anne")
+        self.assertEqual(self.name.expansion.current_match, "mary anne")
+        self.assertEqual(self.call.expansion.matching_slice, slice(5, 26))
+        self.assertEqual(list(self.call.find_all_matching_parts(speech)),
+                         ["PLEASE call Mary Anne", "call peter"])
+        self.assertEqual(self.name.expansion.current_match, "peter")
+        self.assertIsNone(self.call.find_matching_part("call john"))
+        self.assertIsNone(self.call.expansion.current_match)
+
+        # Word sequences can be searched.
+        self.assertEqual(self.call.find_matching_part(["so", "call", "peter"]),
+                         "call peter")
+
+    def test_automaton(self):
+        self.check_backend(MatchingBackend.Automaton)
+
+    def test_chart(self):
+        self.check_backend(MatchingBackend.Chart)
+
+    def test_regex(self):
+        self.check_backend(MatchingBackend.Regex)
+
+    def test_word_starts(self):
+        # Matches are only found at the start of words.
+        rule = PublicRule("test", "cat")
+        self.grammar.add_rule(rule)
+        for backend in (MatchingBackend.Automaton, MatchingBackend.Chart,
+                        MatchingBackend.Regex):
+            self.grammar.matching_backend = backend
+            self.assertIsNone(rule.find_matching_part("concatenate"))
+            self.assertEqual(rule.find_matching_part("a cat"), "cat")
+
+    def test_empty_matches(self):
+        # Preferred matches of no words are skipped.
+        self.grammar.matching_backend = MatchingBackend.Automaton
+        rule = PublicRule("test", AlternativeSet(KleeneStar("a"), "b"))
+        self.grammar.add_rule(rule)
+        self.assertEqual(rule.find_matching_part("c b"), "b")
+        self.assertEqual(list(rule.find_all_matching_parts("a a b c a")),
+                         ["a a", "b", "a"])
+
+
 class InvalidRules(unittest.TestCase):
     def test_invalid_rules(self):
         # Literals with text == "" raise CompilationErrors
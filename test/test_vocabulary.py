@@ -0,0 +1,214 @@
+import unittest
+
+from jsgf import *
+from jsgf.ext import Dictation
+
+
+class VocabularyCase(unittest.TestCase):
+    def test_add(self):
+        vocabulary = Vocabulary(["hello", "world"])
+        self.assertEqual(len(vocabulary), 2)
+        self.assertEqual(vocabulary.add("hello"), 0)
+        self.assertEqual(vocabulary.add("Hello"), 2)
+        self.assertEqual(list(vocabulary), ["hello", "world", "Hello"])
+        self.assertIn("world", vocabulary)
+        self.assertNotIn("there", vocabulary)
+        self.assertRaises(ValueError, vocabulary.add, "hello world")
+        self.assertRaises(ValueError, vocabulary.add, "")
+        self.assertRaises(ValueError, vocabulary.add, 1)
+
+    def test_lookup(self):
+        vocabulary = Vocabulary(["hello", "world"])
+        self.assertEqual(vocabulary.get_id("world"), 1)
+        self.assertIsNone(vocabulary.get_id("there"))
+        self.assertEqual(vocabulary.get_word(1), "world")
+        self.assertRaises(ValueError, vocabulary.get_word, 2)
+        self.assertRaises(ValueError, vocabulary.get_word, -1)
+
+    def test_encode_decode(self):
+        vocabulary = Vocabulary(["hello", "world"])
+        self.assertEqual(vocabulary.encode("  hello there world "), [0, 2, 1])
+        self.assertEqual(vocabulary.encode(["world", "again"]), [1, 3])
+        self.assertEqual(vocabulary.decode([2, 0, 3]),
+                         ["there", "hello", "again"])
+        self.assertRaises(ValueError, vocabulary.decode, [4])
+
+    def test_lower_ids(self):
+        vocabulary = Vocabulary(["Hello", "world"])
+        self.assertEqual(vocabulary._get_lower_ids([0, 1]), [-1, 1])
+        vocabulary.add("hello")
+        self.assertEqual(vocabulary._get_lower_ids([1, 0, 2]), [1, 2, 2])
+
+    def test_grammar_vocabulary(self):
+        grammar = Grammar()
+        grammar.add_rule(PublicRule("test", Sequence("Hello world", "again")))
+        vocabulary = grammar.vocabulary
+        self.assertEqual(list(vocabulary), ["hello", "world", "again"])
+        self.assertIs(grammar.vocabulary, vocabulary)
+
+        # Vocabularies can be shared.
+        other = Grammar()
+        other.vocabulary = vocabulary
+        self.assertIs(other.vocabulary, vocabulary)
+        self.assertRaises(TypeError, setattr, other, "vocabulary", ["hello"])
+
+
+class SequenceMatchingCase(unittest.TestCase):
+    """
+    Test matching sequences of words and word IDs with each matching backend.
+    """
+    backends = (MatchingBackend.Pyparsing, MatchingBackend.Automaton,
+                MatchingBackend.Chart)
+
+    def make_grammar(self, backend):
+        grammar = Grammar()
+        grammar.matching_backend = backend
+        self.greeting = AlternativeSet("hello", "hi")
+        self.name = Dictation()
+        grammar.add_rule(PublicRule("greet", Sequence(
+            self.greeting, OptionalGrouping("there"), self.name
+        )))
+        grammar.add_rule(PublicRule("bye", "goodbye"))
+        return grammar
+
+    def test_rule_matches(self):
+        for backend in self.backends:
+            grammar = self.make_grammar(backend)
+            rule = grammar.get_rule("greet")
+            word_ids = grammar.vocabulary.encode("Hi there Alice Smith")
+            for speech in [["Hi", "there", "Alice", "Smith"], word_ids]:
+                self.assertTrue(rule.matches(speech), backend)
+                self.assertEqual(self.greeting.current_match, "hi")
+                self.assertEqual(self.name.current_match, "Alice Smith")
+                self.assertEqual(rule.expansion.current_match,
+                                 "hi there Alice Smith")
+            self.assertFalse(rule.matches(["goodbye"]))
+            self.assertFalse(rule.matches([]))
+
+    def test_expansion_remainder(self):
+        for backend in self.backends:
+            grammar = self.make_grammar(backend)
+            e = grammar.get_rule("bye").expansion
+            self.assertEqual(e.matches(["goodbye", "for", "now"]),
+                             ("for", "now"))
+            self.assertEqual(e.matches(("hello",)), ("hello",))
+
+    def test_find_matching_rules(self):
+        for backend in self.backends:
+            grammar = self.make_grammar(backend)
+            grammar.match_cache_size = 10
+            word_ids = grammar.vocabulary.encode("goodbye")
+            for _ in range(2):
+                self.assertEqual(
+                    [r.name for r in grammar.find_matching_rules(word_ids)],
+                    ["bye"]
+                )
+            self.assertEqual(
+                [r.name for r in grammar.find_matching_rules(["hello", "bob"])],
+                ["greet"]
+            )
+
+    def test_match_result(self):
+        for backend in self.backends[1:]:
+            grammar = self.make_grammar(backend)
+            result = grammar.get_rule("greet").match(["hello", "bob"])
+            self.assertEqual(result.speech, "hello bob")
+            self.assertEqual(result.get_current_match(self.name), "bob")
+            self.assertEqual(result.get_matching_slice(self.name), slice(6, 9))
+            [result] = grammar.match(grammar.vocabulary.encode("goodbye"))
+            self.assertEqual(result.rule.name, "bye")
+            self.assertEqual(result.speech, "goodbye")
+
+    def test_stream(self):
+        grammar = self.make_grammar(MatchingBackend.Automaton)
+        stream = grammar.begin_stream()
+        stream.feed(["hi"])
+        stream.feed(grammar.vocabulary.encode("there bob"))
+        self.assertEqual(stream.speech, "hi there bob")
+        self.assertEqual([r.name for r in stream.matching_rules], ["greet"])
+
+    def test_invalid_speech(self):
+        grammar = self.make_grammar(MatchingBackend.Automaton)
+        rule = grammar.get_rule("bye")
+        self.assertRaises(TypeError, rule.matches, [None])
+        self.assertRaises(ValueError, rule.matches, [len(grammar.vocabulary)])
+        self.assertRaises(TypeError, Literal("goodbye").matches, [0])
+
+
+class WordIDMatchingCase(unittest.TestCase):
+    """
+    Test matching word IDs with the automaton backend, which compares the IDs
+    instead of the words.
+    """
+    def setUp(self):
+        self.grammar = Grammar()
+        self.grammar.matching_backend = MatchingBackend.Automaton
+        self.name = Dictation()
+        bob = Literal("Bob")
+        self.rule = PublicRule("test", Sequence(
+            AlternativeSet("hello there", "hi", "hey you"), bob,
+            OptionalGrouping(Sequence(self.name, "please"))
+        ))
+        self.grammar.add_rule(self.rule)
+
+        # Adding the rule makes its literals case insensitive like the grammar.
+        bob.case_sensitive = True
+
+    def check_matches(self, speech, expected):
+        grammar = self.grammar
+        word_ids = grammar.vocabulary.encode(speech)
+        self.assertEqual(self.rule.matches(word_ids), expected, speech)
+        self.assertEqual(self.rule.matches(speech), expected, speech)
+        self.assertEqual(self.rule.match(word_ids) is not None, expected)
+        self.assertEqual(grammar.find_matching_rules(word_ids),
+                         [self.rule] if expected else [])
+
+    def test_matches(self):
+        self.check_matches("hello there Bob", True)
+        self.check_matches("HI Bob", True)
+        self.check_matches("Hey YOU Bob open the door please", True)
+        self.check_matches("hi bob", False)
+        self.check_matches("hello Bob", False)
+        self.check_matches("hi Bob please", False)
+        self.check_matches("hi Bob PLEASE please", False)
+
+        # Dictation words are matched using their IDs too.
+        self.assertTrue(self.rule.matches(
+            self.grammar.vocabulary.encode("hi Bob open Sesame please")))
+        self.assertEqual(self.name.current_match, "open Sesame")
+
+    def test_program_translated(self):
+        automaton = self.rule.expansion._get_automaton()
+        vocabulary = self.grammar.vocabulary
+        self.assertTrue(self.rule.matches(vocabulary.encode("hi Bob")))
+        self.assertIs(automaton._translated_program[0], vocabulary)
+
+        # Matching IDs from another vocabulary translates the program again and
+        # adds the words of the program to the vocabulary.
+        other = Vocabulary(["Bob", "HI"])
+        self.grammar.vocabulary = other
+        self.assertTrue(self.rule.matches(other.encode("HI Bob")))
+        self.assertIs(automaton._translated_program[0], other)
+        self.assertIn("hello", other)
+        self.assertIn("please", other)
+
+
+class LazyMatchValuesCase(unittest.TestCase):
+    def test_values_joined_when_used(self):
+        for backend in (MatchingBackend.Automaton, MatchingBackend.Chart):
+            grammar = Grammar()
+            grammar.matching_backend = backend
+            e = Sequence("hello", Dictation())
+            grammar.add_rule(PublicRule("test", e))
+            self.assertTrue(grammar.get_rule("test").matches("HELLO big world"))
+
+            # Match values are only created when they are used.
+            self.assertNotIsInstance(e.children[1]._current_match, str)
+            self.assertEqual(e.children[1].current_match, "big world")
+            self.assertEqual(e.children[1]._current_match, "big world")
+            self.assertEqual(e.children[1].matching_slice, slice(6, 15))
+            self.assertEqual(e.current_match, "hello big world")
+
+
+if __name__ == '__main__':
+    unittest.main()